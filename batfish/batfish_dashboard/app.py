@@ -1,4 +1,6 @@
 import dash
+import dash_uploader as du
+from components.functions import SNAPSHOT_UPLOAD_ROOT
 
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
@@ -11,3 +13,6 @@ server = app.server
 app.config.suppress_callback_exceptions = True
 app.scripts.config.serve_locally = False
 app.css.config.serve_locally = False
+
+# Snapshot files are streamed in chunks to a per-upload directory
+du.configure_upload(app, SNAPSHOT_UPLOAD_ROOT)
@@ -1,5 +1,10 @@
 import json
+import shutil
+import threading
 import time
+import uuid
+from collections import OrderedDict
+from contextlib import closing
 import dash
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
@@ -7,18 +12,35 @@ import dash_daq as daq
 import dash_html_components as html
 import dash_table
 import pandas as pd
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, MATCH
 from dash.exceptions import PreventUpdate
 from app import app
 from components.batfish import Batfish
-from components.functions import save_file
+from components.batfish import rank_failures
+from components.batfish import BATFISH_MAX_SCENARIOS
+from components.jobs import job_queue, JobCancelled
+from components.functions import SNAPSHOT_UPLOAD_DIRECTORIES
+from components.functions import get_snapshot_upload_dir
+from components.functions import get_uploaded_files
+from components.functions import delete_stale_uploads
 from components.functions import delete_old_files
 from components.functions import get_traceroute_details
+from components.functions import get_trace_hops
+from components.functions import get_stored_trace
 from components.functions import get_layer3_graph
 from components.functions import get_ospf_graph
 from components.functions import get_bgp_graph
 from components.functions import get_traceroute_content
 from components.functions import get_acl_content
+from components.functions import get_job_components
+from components.functions import get_job_progress
+from components.functions import get_batch_traceroute_summary
+from components.functions import get_failure_sweep_content
+from components.functions import get_failure_sweep_table
+from components.functions import get_topology
+from components.functions import keep_topology
+from components.functions import TOPOLOGY_STORE_SIZE
+from components.functions import get_lod_elements
 
 @app.callback(
     Output('cytoscape-mouseoverNodeData-output', 'children'),
@@ -102,6 +124,50 @@ def set_batfish_host(value, n):
     return value
 
 
+###################### Background Jobs ###############################
+@app.callback(
+    [Output({'type': 'job-progress', 'index': MATCH}, 'children'),
+     Output({'type': 'job-status', 'index': MATCH}, 'data'),
+     Output({'type': 'job-interval', 'index': MATCH}, 'disabled')],
+    [Input({'type': 'job-store', 'index': MATCH}, 'data'),
+     Input({'type': 'job-interval', 'index': MATCH}, 'n_intervals')],
+    [State({'type': 'job-status', 'index': MATCH}, 'data')]
+)
+def poll_background_job(job_id, n, last_status):
+    if not job_id:
+        raise PreventUpdate
+    ctx = dash.callback_context
+    kind = ctx.outputs_list[0]['id']['index']
+    job = job_queue.get(job_id)
+    if job is None:
+        return None, None, True
+    status = {'id': job.id, 'status': job.status, 'progress': job.progress}
+    if status == last_status:
+        status = dash.no_update
+    return get_job_progress(kind, job), status, job.done
+
+
+@app.callback(
+    Output({'type': 'job-cancel', 'index': MATCH}, 'disabled'),
+    [Input({'type': 'job-cancel', 'index': MATCH}, 'n_clicks')],
+    [State({'type': 'job-store', 'index': MATCH}, 'data')]
+)
+def cancel_background_job(n, job_id):
+    if not n or not job_id:
+        raise PreventUpdate
+    job_queue.cancel(job_id)
+    return True
+
+
+def get_finished_job_result(status):
+    if not status or status['status'] != 'finished':
+        raise PreventUpdate
+    job = job_queue.get(status['id'])
+    if job is None:
+        raise PreventUpdate
+    return job.result
+
+
 ###################### Delete Network ###############################
 @app.callback(Output('delete-success', 'children'),
               [Input('delete_network_submit_button', 'n_clicks'),
@@ -115,6 +181,7 @@ def delete_network(submit, delete_network, batfish_host):
         raise PreventUpdate
     batfish = Batfish(batfish_host)
     batfish.delete_network(delete_network)
+    clear_tab_content_cache(batfish_host, delete_network)
 
 
 @app.callback(
@@ -290,6 +357,25 @@ def add_dropdown_for_breadfirst_roots(layout, nodes):
         return dropdown
 
 
+@app.callback([Output('cytoscape', 'elements'),
+               Output('topology-expanded-clusters', 'data')],
+              [Input('cytoscape', 'tapNodeData')],
+              [State('topology-graph-id', 'data'),
+               State('topology-expanded-clusters', 'data')])
+def toggle_topology_cluster(node_data, graph_id, expanded):
+    if not node_data or not graph_id or 'cluster' not in node_data:
+        raise PreventUpdate
+    topology = get_topology(graph_id)
+    if topology is None:
+        raise PreventUpdate
+    expanded = list(expanded or [])
+    if node_data['cluster'] in expanded:
+        expanded.remove(node_data['cluster'])
+    else:
+        expanded.append(node_data['cluster'])
+    return get_lod_elements(topology, expanded), expanded
+
+
 @app.callback(Output('create_snapshot_modal', 'is_open'),
               [Input('create-snapshot-button', 'n_clicks')],
               [State("create_snapshot_modal", "is_open")], )
@@ -299,65 +385,78 @@ def create_snapshot_modal(n, is_open):
     return is_open
 
 
+@app.callback([Output('snapshot-upload-id', 'data')] +
+              [Output(uploader_id, 'upload_id')
+               for uploader_id in SNAPSHOT_UPLOAD_DIRECTORIES],
+              [Input('create-snapshot-button', 'n_clicks'),
+               Input({'type': 'job-store', 'index': 'create_snapshot'},
+                     'data')])
+def set_snapshot_upload_id(n, job_id):
+    delete_stale_uploads()
+    upload_id = uuid.uuid4().hex
+    return [upload_id] + [upload_id + '/' + directory
+                          for directory in
+                          SNAPSHOT_UPLOAD_DIRECTORIES.values()]
+
+
+def create_snapshot_job(job, batfish_host, batfish_network, snapshot_name,
+                        snapshot_dir):
+    try:
+        job.set_progress(10, "Connecting to Batfish")
+        batfish = Batfish(batfish_host)
+        batfish.set_network(batfish_network)
+        job.set_progress(25, "Parsing snapshot " + snapshot_name)
+        batfish.init_snapshot(snapshot_name, snapshot_dir=snapshot_dir)
+    finally:
+        clear_tab_content_cache(batfish_host, batfish_network, snapshot_name)
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+    if job.cancelled:
+        batfish.delete_snapshot(snapshot_name)
+        raise JobCancelled()
+
+
 @app.callback([Output('output-data-upload', 'children'),
-               Output('create-snapshot-name', 'invalid')],
-              [Input('device-configs-upload-data', 'contents'),
-               Input('host-configs-upload-data', 'contents'),
-               Input('iptables-configs-upload-data', 'contents'),
-               Input('aws-configs-upload-data', 'contents'),
-               Input('misc-configs-upload-data', 'contents'),
-               Input('modal-select-network-button', 'value'),
+               Output('create-snapshot-name', 'invalid'),
+               Output({'type': 'job-store', 'index': 'create_snapshot'},
+                      'data')],
+              [Input(uploader_id, 'isCompleted')
+               for uploader_id in SNAPSHOT_UPLOAD_DIRECTORIES] +
+              [Input('modal-select-network-button', 'value'),
                Input('create_snapshot_submit_button', 'n_clicks'),
                Input('create-snapshot-name', 'value')],
-              [State("device-configs-upload-data", "filename"),
-               State("host-configs-upload-data", "filename"),
-               State("iptables-configs-upload-data", "filename"),
-               State("aws-configs-upload-data", "filename"),
-               State("misc-configs-upload-data", "filename"),
+              [State('snapshot-upload-id', 'data'),
                State("batfish_host_input", "value")], )
-def create_snapshot_modal(device_configs_upload_content,
-                          host_configs_upload_content,
-                          iptables_configs_upload_content,
-                          aws_configs_upload_content,
-                          misc_configs_upload_content,
+def create_snapshot_modal(device_configs_uploaded,
+                          host_configs_uploaded,
+                          iptables_configs_uploaded,
+                          aws_configs_uploaded,
+                          misc_configs_uploaded,
                           batfish_network,
                           submit, snapshot_name,
-                          device_config_filenames,
-                          host_config_filenames,
-                          iptables_config_filenames,
-                          aws_config_filenames,
-                          misc_config_filenames,
+                          upload_id,
                           batfish_host):
-    device_html_list = None
-    host_html_list = None
-    iptable_html_list = None
-    aws_html_list = None
-    misc_html_list = None
-
-    if device_config_filenames is not None:
-        device_html_list = html.Ul(
-            [html.Li(x) for x in device_config_filenames])
-    if host_config_filenames is not None:
-        host_html_list = html.Ul(
-            [html.Li(x) for x in host_config_filenames])
-    if iptables_config_filenames is not None:
-        iptable_html_list = html.Ul(
-            [html.Li(x) for x in iptables_config_filenames])
-    if aws_config_filenames is not None:
-        aws_html_list = html.Ul(
-            [html.Li(x) for x in aws_config_filenames])
-    if misc_config_filenames is not None:
-        misc_html_list = html.Ul(
-            [html.Li(x) for x in misc_config_filenames])
+    # Files are streamed to disk by the uploaders, so only the names
+    # present in the upload directory are listed here
+    uploaded_files = OrderedDict()
+    if upload_id is not None:
+        for directory in SNAPSHOT_UPLOAD_DIRECTORIES.values():
+            uploaded_files[directory] = get_uploaded_files(upload_id,
+                                                           directory)
+
+    def get_html_list(directory):
+        filenames = uploaded_files.get(directory)
+        if not filenames:
+            return None
+        return html.Ul([html.Li(x) for x in filenames])
 
     all_children = html.Div([
         html.Ul(
             children=[
-                html.Li(['Device Configs', device_html_list]),
-                html.Li(['Host Configs', host_html_list]),
-                html.Li(['IP Table Configs', iptable_html_list]),
-                html.Li(['AWS Configs', aws_html_list]),
-                html.Li(['Misc Configs', misc_html_list]),
+                html.Li(['Device Configs', get_html_list('configs')]),
+                html.Li(['Host Configs', get_html_list('hosts')]),
+                html.Li(['IP Table Configs', get_html_list('iptables')]),
+                html.Li(['AWS Configs', get_html_list('aws_configs')]),
+                html.Li(['Misc Configs', get_html_list('batfish')]),
             ],
         )
     ])
@@ -369,50 +468,27 @@ def create_snapshot_modal(device_configs_upload_content,
 
     if button_id == "create_snapshot_submit_button":
         if snapshot_name == "":
-            return all_children, True
-        if device_config_filenames is not None:
-            for name, data in zip(device_config_filenames,
-                                  device_configs_upload_content):
-                save_file("device_config", name, data)
-        if host_config_filenames is not None:
-            for name, data in zip(host_config_filenames,
-                                  host_configs_upload_content):
-                save_file("host_config", name, data)
-        if iptables_config_filenames is not None:
-            for name, data in zip(iptables_config_filenames,
-                                  iptables_configs_upload_content):
-                save_file("iptable_config", name, data)
-        if aws_config_filenames is not None:
-            for name, data in zip(aws_config_filenames,
-                                  aws_configs_upload_content):
-                save_file("aws_config", name, data)
-        if misc_config_filenames is not None:
-            for name, data in zip(misc_config_filenames,
-                                  misc_configs_upload_content):
-                save_file("misc_config", name, data)
-        batfish = Batfish(batfish_host)
-        batfish.set_network(batfish_network)
-        batfish.init_snapshot(snapshot_name)
-        delete_old_files()
-        device_html_list = None
-        host_html_list = None
-        iptable_html_list = None
-        aws_html_list = None
-        misc_html_list = None
+            return all_children, True, dash.no_update
+        if upload_id is None or not any(uploaded_files.values()):
+            raise PreventUpdate
+        job_id = job_queue.submit("Creating snapshot " + snapshot_name,
+                                  create_snapshot_job, batfish_host,
+                                  batfish_network, snapshot_name,
+                                  get_snapshot_upload_dir(upload_id))
 
         all_children = html.Div([
             html.Ul(
                 children=[
-                    html.Li(['Device Configs', device_html_list]),
-                    html.Li(['Host Configs', host_html_list]),
-                    html.Li(['IP Table Configs', iptable_html_list]),
-                    html.Li(['AWS Configs', aws_html_list]),
-                    html.Li(['Misc Configs', misc_html_list]),
+                    html.Li(['Device Configs', None]),
+                    html.Li(['Host Configs', None]),
+                    html.Li(['IP Table Configs', None]),
+                    html.Li(['AWS Configs', None]),
+                    html.Li(['Misc Configs', None]),
                 ],
             )
         ])
-        return all_children, False
-    return all_children, False
+        return all_children, False, job_id
+    return all_children, False, dash.no_update
 
 
 @app.callback(
@@ -431,6 +507,7 @@ def delete_snapshot(batfish_network, submit, delete_snapshot, batfish_host):
         batfish = Batfish(batfish_host)
         batfish.set_network(batfish_network)
         batfish.delete_snapshot(delete_snapshot)
+        clear_tab_content_cache(batfish_host, batfish_network, delete_snapshot)
 
 
 @app.callback(
@@ -557,6 +634,14 @@ def ask_a_question_modal_table(question, host_value, network_value,
 
 
 
+# Rendered tab content keyed by (host, network, snapshot, tab). The graphs
+# in it refer to topologies in the topology store, so it must not hold more
+# entries than the store does
+TAB_CONTENT_CACHE_SIZE = TOPOLOGY_STORE_SIZE
+tab_content_cache = OrderedDict()
+tab_content_cache_lock = threading.Lock()
+
+
 @app.callback(
     Output("main-page-tabs-content", "children"),
     [
@@ -569,19 +654,53 @@ def ask_a_question_modal_table(question, host_value, network_value,
 def set_update_tab_content(content_type, snapshot_value, host_value, network_value):
     if not snapshot_value:
         raise PreventUpdate
+    cache_key = (host_value, network_value, snapshot_value, content_type)
+    with tab_content_cache_lock:
+        children = tab_content_cache.get(cache_key)
+        if children is not None:
+            tab_content_cache.move_to_end(cache_key)
+    if children is not None:
+        # keep the topology of a cached graph as recently used as the graph
+        keep_topology(children)
+        return children
     time.sleep(.10)
-    batfish = Batfish(host_value)
-    batfish.set_network(network_value)
-    batfish.set_snapshot(snapshot_value)
 
+    def get_batfish():
+        batfish = Batfish(host_value)
+        batfish.set_network(network_value)
+        batfish.set_snapshot(snapshot_value)
+        return batfish
+
+    # Only the selected tab's question is asked against Batfish
     tab_content = {
-        'layer3': get_layer3_graph(batfish.get_layer3_edges),
-        'ospf': get_ospf_graph(batfish.get_ospf_edges),
-        'bgp': get_bgp_graph(batfish.get_bgp_edges),
-        'traceroute': get_traceroute_content(batfish.get_interfaces),
-        'all_things_acl': get_acl_content()
+        'layer3': lambda: get_layer3_graph(get_batfish().get_layer3_edges),
+        'ospf': lambda: get_ospf_graph(get_batfish().get_ospf_edges),
+        'bgp': lambda: get_bgp_graph(get_batfish().get_bgp_edges),
+        'traceroute': lambda: get_traceroute_content(
+            get_batfish().get_interfaces),
+        'all_things_acl': get_acl_content
     }
-    return tab_content.get(content_type)
+    if content_type not in tab_content:
+        return None
+    children = tab_content[content_type]()
+    with tab_content_cache_lock:
+        tab_content_cache[cache_key] = children
+        while len(tab_content_cache) > TAB_CONTENT_CACHE_SIZE:
+            tab_content_cache.popitem(last=False)
+    return children
+
+
+def clear_tab_content_cache(host_value, network_value, snapshot_value=None):
+    """
+    Drops cached tab content for a network, or only for one of its
+    snapshots when snapshot_value is given.
+    """
+    with tab_content_cache_lock:
+        for key in list(tab_content_cache):
+            if key[:2] != (host_value, network_value):
+                continue
+            if snapshot_value is None or key[2] == snapshot_value:
+                del tab_content_cache[key]
 
 
 
@@ -694,9 +813,9 @@ def get_advanced_options_form(advanced_option_sw):
 
 @app.callback(
     [Output("main_page_forward_traceroute_graph", "children"),
-     Output("forward_traceroute_tabs", "children"),
+     Output("forward_traceroute_traces", "children"),
      Output("main_page_reverse_traceroute_graph", "children"),
-     Output("reverse_traceroute_tabs", "children"),
+     Output("reverse_traceroute_traces", "children"),
      ],
     [
         Input("traceroute_src_interface", "value"),
@@ -763,6 +882,128 @@ def set_update_trace_graph(source,
     return forward_flow_graph, forward_flow_traces, reverse_flow_graph, reverse_flow_traces,
 
 
+def batch_traceroute_job(job, host_value, network_value, snapshot_value,
+                         sources, destinations, src_ports, dst_ports,
+                         applications, ip_protocols):
+    job.set_progress(5, "Connecting to Batfish")
+    batfish = Batfish(host_value)
+    batfish.set_network(network_value)
+    batfish.set_snapshot(snapshot_value)
+    if not sources:
+        interfaces = batfish.get_interfaces
+        sources = sorted(set(interfaces['Node'] + '[' +
+                             interfaces['Interface'] + ']'))
+    # The rows are only ever appended to, so the table callback can send
+    # the browser just the ones it has not seen yet
+    job.result = rows = []
+    job.set_progress(10, "Tracing {} sources to {} destinations".format(
+        len(sources), len(destinations)))
+    with closing(batfish.batch_traceroute(sources, destinations,
+                                          snapshot_value, src_ports,
+                                          dst_ports, applications,
+                                          ip_protocols)) as results:
+        for count, frame in enumerate(results, 1):
+            rows.extend(frame.to_dict('records'))
+            job.set_progress(10 + int(90 * count / len(destinations)),
+                             "{} of {} destinations traced".format(
+                                 count, len(destinations)))
+    return job.result
+
+
+@app.callback(
+    Output({'type': 'job-store', 'index': 'batch_traceroute'}, 'data'),
+    [Input("batch_traceroute_submit", "n_clicks")],
+    [State("batch_traceroute_sources", "value"),
+     State("batch_traceroute_destinations", "value"),
+     State("traceroute_src_ports", "value"),
+     State("traceroute_dst_ports", "value"),
+     State("traceroute_applications", "value"),
+     State("traceroute_ip_protocols", "value"),
+     State("batfish_host_input", "value"),
+     State("select-network-button", "value"),
+     State("select-snapshot-button", "value")],
+)
+def set_batch_traceroute(submit, sources, destinations, src_ports, dst_ports,
+                         applications, ip_protocols, host_value,
+                         network_value, snapshot_value):
+    if not submit or not destinations:
+        raise PreventUpdate
+    sources = [source.strip() for source in sources.split(',')
+               if source.strip()] if sources else []
+    destinations = list(OrderedDict.fromkeys(destinations.split()))
+    src_ports = src_ports.split(',') if src_ports else None
+    dst_ports = dst_ports.split(',') if dst_ports else None
+    applications = applications.split(',') if applications else None
+    ip_protocols = ip_protocols.split(',') if ip_protocols else None
+    return job_queue.submit("Batch trace route", batch_traceroute_job,
+                            host_value, network_value, snapshot_value,
+                            sources, destinations, src_ports, dst_ports,
+                            applications, ip_protocols)
+
+
+@app.callback(
+    [Output("batch_traceroute_rows", "data"),
+     Output("batch_traceroute_sent", "data"),
+     Output("batch_traceroute_summary", "children"),
+     Output("batch_traceroute_table", "style")],
+    [Input({'type': 'job-status', 'index': 'batch_traceroute'}, 'data')],
+    [State("batch_traceroute_sent", "data")]
+)
+def set_batch_traceroute_rows(status, sent):
+    if not status:
+        raise PreventUpdate
+    job = job_queue.get(status['id'])
+    if job is None or job.result is None:
+        raise PreventUpdate
+    if not sent or sent['id'] != job.id:
+        sent = {'id': job.id, 'count': 0,
+                'totals': dict.fromkeys(['Flows', 'Accepted', 'Denied',
+                                         'No_Route', 'Other'], 0)}
+    start = sent['count']
+    rows = job.result[start:]
+    if start and not rows:
+        raise PreventUpdate
+    totals = dict(sent['totals'])
+    totals['Flows'] += len(rows)
+    for row in rows:
+        for column in ('Accepted', 'Denied', 'No_Route', 'Other'):
+            totals[column] += row[column]
+    sent = {'id': job.id, 'count': start + len(rows), 'totals': totals}
+    return ({'start': start, 'rows': rows}, sent,
+            get_batch_traceroute_summary(totals), {'display': 'block'})
+
+
+# Appends the new rows in the browser instead of sending the whole table on
+# every poll
+app.clientside_callback(
+    """
+    function(delta, data) {
+        if (!delta) {
+            return window.dash_clientside.no_update;
+        }
+        return (data || []).slice(0, delta.start).concat(delta.rows);
+    }
+    """,
+    Output("batch_traceroute_datatable", "data"),
+    [Input("batch_traceroute_rows", "data")],
+    [State("batch_traceroute_datatable", "data")]
+)
+
+
+@app.callback(
+    Output({'type': 'trace-hops', 'index': MATCH}, 'children'),
+    [Input({'type': 'trace-table', 'index': MATCH}, 'selected_rows')],
+    [State({'type': 'trace-result', 'index': MATCH}, 'data')]
+)
+def set_trace_hops(selected_rows, result_id):
+    if not selected_rows or not result_id:
+        raise PreventUpdate
+    trace = get_stored_trace(result_id, selected_rows[0])
+    if trace is None:
+        return html.P("This trace is no longer available, please trace again")
+    return get_trace_hops(trace, selected_rows[0])
+
+
 # Fail nodes and interfaces
 
 @app.callback(
@@ -887,8 +1128,10 @@ def get_chaos_form(n, graph_elements, batfish_host, batfish_network,
     ]
 
     fieldset_children = [html.Legend("Chaos Trace Route"),
+                         get_job_components('chaos'),
                          html.Div(id="chaos_traceroute_graph"),
-                         html.Div(dcc.Tabs(id="chaos_traceroute_tabs")),
+                         html.Div(id="chaos_traceroute_traces"),
+                         get_failure_sweep_content(),
 
                          ]
 
@@ -929,10 +1172,42 @@ def display_interfaces_for_node(choose_node, batfish_host,
     return options
 
 
+def chaos_traceroute_job(job, host_value, network_value, snapshot_value,
+                         change_configuration, failed_nodes,
+                         failed_interfaces, source, destination, src_ports,
+                         dst_ports, applications, ip_protocols):
+    job.set_progress(10, "Connecting to Batfish")
+    batfish = Batfish(host_value)
+    batfish.set_network(network_value)
+
+    bidir = False
+    if change_configuration:
+        reference_snapshot = snapshot_value + "_CHANGED"
+        job.set_progress(20, "Parsing changed configuration")
+        batfish.init_snapshot(reference_snapshot)
+        clear_tab_content_cache(host_value, network_value, reference_snapshot)
+    else:
+        reference_snapshot = snapshot_value + "_FAIL"
+        job.set_progress(20, "Forking snapshot with failures")
+        batfish.network_failure(snapshot_value, reference_snapshot,
+                                failed_nodes, failed_interfaces)
+        clear_tab_content_cache(host_value, network_value, reference_snapshot)
+
+    job.set_progress(60, "Running traceroute")
+    result = batfish.traceroute(source, destination, bidir, reference_snapshot,
+                                    src_ports, dst_ports, applications, ip_protocols
+                                )
+    job.set_progress(90, "Rendering traces")
+    chaos_flow_details = get_traceroute_details('forward', result, False, True)
+    chaos_flow_graph = chaos_flow_details[0]
+    chaos_flow_traces = chaos_flow_details[1]
+    delete_old_files()
+
+    return chaos_flow_graph, chaos_flow_traces
+
+
 @app.callback(
-    [Output("chaos_traceroute_graph", "children"),
-     Output("chaos_traceroute_tabs", "children"),
-     ],
+    Output({'type': 'job-store', 'index': 'chaos'}, 'data'),
     [
         Input("traceroute_src_interface", "value"),
         Input("traceroute_dst", "value"),
@@ -977,30 +1252,113 @@ def set_chaos_trace_graph(source,
     dst_ports = dst_ports.split(',') if dst_ports else None
     applications = applications.split(',') if applications else None
     ip_protocols = ip_protocols.split(',') if ip_protocols else None
-    batfish = Batfish(host_value)
-    batfish.set_network(network_value)
 
-    bidir = False
-    if change_configuration_switch:
-        reference_snapshot = snapshot_value + "_CHANGED"
-        batfish.init_snapshot(reference_snapshot)
-    else:
-        reference_snapshot = snapshot_value + "_FAIL"
+    if not change_configuration_switch:
         deactivated_nodes.append(choose_node)
         if not deactivate_node:
             deactivated_interfaces.append(deactivated_interface)
-        batfish.network_failure(snapshot_value, reference_snapshot,
-                                deactivated_nodes, deactivated_interfaces)
 
-    result = batfish.traceroute(source, destination, bidir, reference_snapshot,
-                                    src_ports, dst_ports, applications, ip_protocols
-                                )
-    chaos_flow_details = get_traceroute_details('forward', result, False, True)
-    chaos_flow_graph = chaos_flow_details[0]
-    chaos_flow_traces = chaos_flow_details[1]
-    delete_old_files()
+    return job_queue.submit("Chaos trace route", chaos_traceroute_job,
+                            host_value, network_value, snapshot_value,
+                            change_configuration_switch, deactivated_nodes,
+                            deactivated_interfaces, source, destination,
+                            src_ports, dst_ports, applications, ip_protocols)
 
-    return chaos_flow_graph, chaos_flow_traces
+
+@app.callback(
+    [Output("chaos_traceroute_graph", "children"),
+     Output("chaos_traceroute_traces", "children")],
+    [Input({'type': 'job-status', 'index': 'chaos'}, 'data')]
+)
+def set_chaos_trace_result(status):
+    return get_finished_job_result(status)
+
+
+def failure_sweep_job(job, host_value, network_value, snapshot_value,
+                      failure_type, depth, source, destination, src_ports,
+                      dst_ports, applications, ip_protocols):
+    job.set_progress(5, "Connecting to Batfish")
+    batfish = Batfish(host_value)
+    batfish.set_network(network_value)
+    batfish.set_snapshot(snapshot_value)
+
+    def trace(snapshot):
+        return batfish.trace_summary(snapshot, source, destination,
+                                     src_ports, dst_ports, applications,
+                                     ip_protocols)
+
+    job.set_progress(10, "Tracing without failures")
+    baseline = trace(snapshot_value)
+    scenarios = batfish.get_failure_scenarios(snapshot_value, failure_type,
+                                              depth)
+    job.set_progress(15, "Sweeping {} failure scenarios".format(
+        len(scenarios)))
+    results = []
+    with closing(batfish.failure_sweep(snapshot_value, scenarios, trace,
+                                       job.id)) as sweep:
+        for count, (scenario, summary) in enumerate(sweep, 1):
+            results.append((scenario['label'], summary))
+            job.result = rank_failures(baseline, results)
+            job.set_progress(15 + int(85 * count / len(scenarios)),
+                             "{} of {} failure scenarios traced".format(
+                                 count, len(scenarios)))
+    return rank_failures(baseline, results)
+
+
+@app.callback(
+    [Output({'type': 'job-store', 'index': 'failure_sweep'}, 'data'),
+     Output("failure_sweep_warning", "children")],
+    [Input("failure_sweep_submit", "n_clicks")],
+    [State("failure_sweep_type", "value"),
+     State("failure_sweep_depth", "value"),
+     State("traceroute_src_interface", "value"),
+     State("traceroute_dst", "value"),
+     State("traceroute_src_ports", "value"),
+     State("traceroute_dst_ports", "value"),
+     State("traceroute_applications", "value"),
+     State("traceroute_ip_protocols", "value"),
+     State("batfish_host_input", "value"),
+     State("select-network-button", "value"),
+     State("select-snapshot-button", "value")],
+)
+def set_failure_sweep(submit, failure_type, depth, source, destination,
+                      src_ports, dst_ports, applications, ip_protocols,
+                      host_value, network_value, snapshot_value):
+    if not submit or not source or not destination:
+        raise PreventUpdate
+    # Each scenario forks the snapshot, so refuse a sweep that is too large
+    # before it is queued
+    batfish = Batfish(host_value)
+    batfish.set_network(network_value)
+    count = batfish.count_failure_scenarios(snapshot_value, failure_type,
+                                            int(depth))
+    if count > BATFISH_MAX_SCENARIOS:
+        return dash.no_update, dbc.Alert(
+            "This sweep has {} failure scenarios, more than the limit of "
+            "{}. Use a lower depth or raise BATFISH_MAX_SCENARIOS.".format(
+                count, BATFISH_MAX_SCENARIOS),
+            color="warning")
+    src_ports = src_ports.split(',') if src_ports else None
+    dst_ports = dst_ports.split(',') if dst_ports else None
+    applications = applications.split(',') if applications else None
+    ip_protocols = ip_protocols.split(',') if ip_protocols else None
+    return job_queue.submit("Failure sweep", failure_sweep_job, host_value,
+                            network_value, snapshot_value, failure_type,
+                            int(depth), source, destination, src_ports,
+                            dst_ports, applications, ip_protocols), None
+
+
+@app.callback(
+    Output("failure_sweep_table", "children"),
+    [Input({'type': 'job-status', 'index': 'failure_sweep'}, 'data')]
+)
+def set_failure_sweep_table(status):
+    if not status:
+        raise PreventUpdate
+    job = job_queue.get(status['id'])
+    if job is None or job.result is None:
+        raise PreventUpdate
+    return get_failure_sweep_table(job.result)
 
 
 @app.callback(
@@ -1201,7 +1559,19 @@ def get_change_configuration(choose_node, batfish_host,batfish_network, batfish_
         if choose_node.lower() in value['Nodes']:
             return batfish.get_configuration(value['File_Name'], batfish_snapshot)
 
-@app.callback(Output('acl_result_table', 'children'),
+def compare_acls_job(job, host_value, network_value, snapshot_value,
+                     original_platform, original_acl, refactored_platform,
+                     refactored_acl):
+    job.set_progress(10, "Connecting to Batfish")
+    batfish = Batfish(host_value)
+    batfish.set_network(network_value)
+    batfish.set_snapshot(snapshot_value)
+    job.set_progress(30, "Comparing ACLs")
+    return batfish.compare_acls(original_acl, refactored_acl,
+                                original_platform, refactored_platform)
+
+
+@app.callback(Output({'type': 'job-store', 'index': 'acl'}, 'data'),
               [Input('acl_original_choose_platform', 'value'),
                Input('acl_original_textarea', 'value'),
                Input('acl_refactored_choose_platform', 'value'),
@@ -1224,12 +1594,15 @@ def acl_table(original_platform,
 
     if button_id != "acl_analyze_button":
         raise PreventUpdate
-    batfish = Batfish(host_value)
-    batfish.set_network(network_value)
-    batfish.set_snapshot(snapshot_value)
-    compare_acl_df = batfish.compare_acls(original_acl, refactored_acl, original_platform, refactored_platform)
-    batfish.delete_snapshot("refactored")
-    batfish.delete_snapshot("original")
+    return job_queue.submit("ACL comparison", compare_acls_job, host_value,
+                            network_value, snapshot_value, original_platform,
+                            original_acl, refactored_platform, refactored_acl)
+
+
+@app.callback(Output('acl_result_table', 'children'),
+              [Input({'type': 'job-status', 'index': 'acl'}, 'data')])
+def acl_table_result(status):
+    compare_acl_df = get_finished_job_result(status)
     children = dash_table.DataTable(
         id='table',
         columns=[{"name": i, "id": i, "deletable": True} for i in
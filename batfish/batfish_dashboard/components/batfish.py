@@ -1,18 +1,21 @@
+import hashlib
+import itertools
+import logging
+import math
+import os
+import queue
+import shutil
+import threading
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 import pandas as pd
-from pybatfish.client.commands import bf_session
-from pybatfish.client.commands import bf_delete_network
-from pybatfish.client.commands import bf_delete_snapshot
-from pybatfish.client.commands import bf_set_snapshot
-from pybatfish.client.commands import bf_set_network
-from pybatfish.client.commands import bf_list_networks
-from pybatfish.client.commands import bf_list_snapshots
-from pybatfish.client.commands import bf_init_snapshot
-from pybatfish.client.commands import bf_fork_snapshot
-from pybatfish.client.extended import bf_get_snapshot_input_object_text
-from pybatfish.question import bfq
-from pybatfish.question import load_questions, list_questions
+from pybatfish.client.session import Session
 from pybatfish.datamodel import HeaderConstraints, Interface
 
+logger = logging.getLogger(__name__)
+
 pd.set_option('display.max_rows', None)
 pd.set_option('display.max_columns', None)
 pd.set_option('display.width', None)
@@ -20,66 +23,387 @@ pd.set_option('display.max_colwidth', -1)
 
 pd.options.display.float_format = '{:,}'.format
 
+BATFISH_MAX_SESSIONS = int(os.environ.get('BATFISH_MAX_SESSIONS', 4))
+# Sessions a batch job may hold at once, the rest stay free for the
+# interactive callbacks
+BATFISH_BATCH_SESSIONS = int(os.environ.get(
+    'BATFISH_BATCH_SESSIONS', max(1, BATFISH_MAX_SESSIONS - 1)))
+# Failure scenarios a sweep may fork, each one is a snapshot fork plus a
+# question, and N-2 grows with the square of the network
+BATFISH_MAX_SCENARIOS = int(os.environ.get('BATFISH_MAX_SCENARIOS', 500))
+BATFISH_ANSWER_CACHE_SIZE = int(
+    os.environ.get('BATFISH_ANSWER_CACHE_SIZE', 256))
+BATFISH_ANSWER_CACHE_DIR = os.environ.get('BATFISH_ANSWER_CACHE_DIR')
+
+# How each trace disposition is counted in the batch traceroute summary
+TRACE_DISPOSITIONS = {
+    'ACCEPTED': 'Accepted',
+    'DELIVERED_TO_SUBNET': 'Accepted',
+    'EXITS_NETWORK': 'Accepted',
+    'DENIED_IN': 'Denied',
+    'DENIED_OUT': 'Denied',
+    'NO_ROUTE': 'No_Route',
+    'NULL_ROUTED': 'No_Route',
+    'NEIGHBOR_UNREACHABLE': 'No_Route',
+}
+BATCH_TRACEROUTE_COLUMNS = ['Source', 'Destination', 'Dst_IP', 'Traces',
+                            'Accepted', 'Denied', 'No_Route', 'Other']
+
+
+class SessionPool():
+    """
+    Long-lived pybatfish sessions for a single Batfish host.
+
+    Each session loads the question templates once when it is created and is
+    then reused by every callback. A session is only ever handed to one
+    caller at a time, so concurrent callbacks never share network/snapshot
+    state.
+    """
+
+    def __init__(self, batfish_host, max_sessions=BATFISH_MAX_SESSIONS):
+        self.batfish_host = batfish_host
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_sessions)
+
+    @contextmanager
+    def session(self, network=None, snapshot=None):
+        self._slots.acquire()
+        try:
+            try:
+                bf = self._idle.get_nowait()
+            except queue.Empty:
+                bf = Session(host=self.batfish_host)
+            bf.network = network
+            bf.snapshot = snapshot
+            try:
+                yield bf
+            finally:
+                self._idle.put(bf)
+        finally:
+            self._slots.release()
+
+
+_session_pools = {}
+_session_pools_lock = threading.Lock()
+
+
+def get_session_pool(batfish_host):
+    with _session_pools_lock:
+        if batfish_host not in _session_pools:
+            _session_pools[batfish_host] = SessionPool(batfish_host)
+        return _session_pools[batfish_host]
+
+
+def count_combinations(n, k):
+    """math.comb(), which the python 3.7 image does not have yet"""
+    if not 0 <= k <= n:
+        return 0
+    return math.factorial(n) // (math.factorial(k) * math.factorial(n - k))
+
+
+def content_hash(*parts):
+    return hashlib.sha256(repr(parts).encode("utf8")).hexdigest()
+
+
+class AnswerCache():
+    """
+    Answer frames keyed by a content hash of the question and its parameters.
+
+    Answers for an initialised snapshot never change, so they are kept in a
+    size bounded LRU and, when cache_dir is set, pickled to disk per
+    snapshot scope (host, network, snapshot) so they survive restarts.
+    On disk the answers are also keyed by the snapshot's identity, its
+    creation time in Batfish, so a snapshot re-created by another process
+    or while the dashboard was down is not answered from the old one.
+    Invalidating a scope drops both tiers for that snapshot, along with the
+    record of any fork made from it.
+    """
+
+    def __init__(self, max_entries=BATFISH_ANSWER_CACHE_SIZE,
+                 cache_dir=BATFISH_ANSWER_CACHE_DIR):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._frames = OrderedDict()
+        self._scopes = {}
+        self._identities = {}
+        self._forks = {}
+        self._lock = threading.Lock()
+
+    def _scope_dir(self, batfish_host, network, snapshot=None):
+        network_dir = os.path.join(self.cache_dir,
+                                   content_hash(batfish_host, network))
+        if snapshot is None:
+            return network_dir
+        return os.path.join(network_dir, content_hash(snapshot))
+
+    def _path(self, scope, identity, key):
+        return os.path.join(self._scope_dir(*scope), content_hash(identity),
+                            key + '.pkl')
+
+    def get(self, scope, key, identity=None):
+        """
+        Looks an answer for this identity of the snapshot up in memory,
+        then on disk when the identity is known.
+        """
+        with self._lock:
+            entry = self._frames.get(key)
+            if entry is not None and entry[1] == identity:
+                self._frames.move_to_end(key)
+                return entry[2].copy()
+        if not self.cache_dir or identity is None:
+            return None
+        try:
+            frame = pd.read_pickle(self._path(scope, identity, key))
+        except (OSError, EOFError, ValueError):
+            return None
+        self._store(scope, key, frame, identity)
+        return frame.copy()
+
+    def put(self, scope, key, frame, identity=None):
+        self._store(scope, key, frame, identity)
+        if self.cache_dir and identity is not None:
+            path = self._path(scope, identity, key)
+            identity_dir = os.path.dirname(path)
+            try:
+                if not os.path.isdir(identity_dir):
+                    # answers of an earlier snapshot by the same name
+                    shutil.rmtree(os.path.dirname(identity_dir),
+                                  ignore_errors=True)
+                    os.makedirs(identity_dir, exist_ok=True)
+                frame.to_pickle(path)
+            except OSError:
+                logger.warning("Could not write %s to the answer cache", path,
+                               exc_info=True)
+
+    def _store(self, scope, key, frame, identity):
+        with self._lock:
+            self._frames[key] = (scope, identity, frame)
+            self._frames.move_to_end(key)
+            self._scopes.setdefault(scope, set()).add(key)
+            while len(self._frames) > self.max_entries:
+                evicted, (evicted_scope, _, _) = \
+                    self._frames.popitem(last=False)
+                keys = self._scopes.get(evicted_scope)
+                if keys is not None:
+                    keys.discard(evicted)
+                    if not keys:
+                        del self._scopes[evicted_scope]
+
+    def identity(self, scope):
+        with self._lock:
+            return self._identities.get(scope)
+
+    def set_identity(self, scope, identity):
+        with self._lock:
+            self._identities[scope] = identity
+
+    def invalidate(self, batfish_host, network, snapshot=None):
+        """
+        Drops every answer for a snapshot, or for the whole network when no
+        snapshot is given.
+        """
+        def matches(scope):
+            return scope[:2] == (batfish_host, network) and \
+                (snapshot is None or scope[2] == snapshot)
+
+        with self._lock:
+            for scope in [scope for scope in self._scopes if matches(scope)]:
+                for key in self._scopes.pop(scope):
+                    self._frames.pop(key, None)
+            for scope in [scope for scope in self._identities
+                          if matches(scope)]:
+                del self._identities[scope]
+            for fork_scope, (base_scope, _) in list(self._forks.items()):
+                if matches(fork_scope) or matches(base_scope):
+                    del self._forks[fork_scope]
+        if self.cache_dir:
+            shutil.rmtree(self._scope_dir(batfish_host, network, snapshot),
+                          ignore_errors=True)
+
+    def fork_is_current(self, scope, base_scope, fork_key):
+        with self._lock:
+            return self._forks.get(scope) == (base_scope, fork_key)
+
+    def record_fork(self, scope, base_scope, fork_key):
+        with self._lock:
+            self._forks[scope] = (base_scope, fork_key)
+
+
+answer_cache = AnswerCache()
+
+
+def rank_failures(baseline, results):
+    """
+    Compares the traceroute summary of every failure scenario with the
+    baseline and ranks the scenarios by how many flows they break. A flow
+    is broken when none of its traces are accepted any more, and degraded
+    when fewer of them are.
+    """
+    key = ['Source', 'Destination']
+    baseline = baseline.groupby(key)['Accepted'].sum()
+    rows = []
+    for label, summary in results:
+        accepted = summary.groupby(key)['Accepted'].sum()\
+            .reindex(baseline.index, fill_value=0)
+        broken = baseline.index[(baseline > 0) & (accepted == 0)]
+        degraded = baseline.index[(accepted > 0) & (accepted < baseline)]
+        rows.append({'Failure': label,
+                     'Broken_Flows': len(broken),
+                     'Degraded_Flows': len(degraded),
+                     'Broken': ', '.join('{} -> {}'.format(*flow)
+                                         for flow in broken)})
+    ranked = pd.DataFrame(rows, columns=['Failure', 'Broken_Flows',
+                                         'Degraded_Flows', 'Broken'])
+    return ranked.sort_values(['Broken_Flows', 'Degraded_Flows', 'Failure'],
+                              ascending=[False, False, True])\
+        .reset_index(drop=True)
+
+
+def summarize_traces(result, destination):
+    """
+    Reduces a traceroute answer to one row per flow with the number of
+    traces ending in each disposition.
+    """
+    rows = []
+    for flow, traces in zip(result['Flow'], result['Traces']):
+        source = str(flow.ingressNode)
+        if flow.ingressInterface:
+            source += '[' + str(flow.ingressInterface) + ']'
+        counts = Counter(TRACE_DISPOSITIONS.get(str(trace.disposition),
+                                                'Other')
+                         for trace in traces)
+        row = {'Source': source,
+               'Destination': destination,
+               'Dst_IP': str(flow.dstIp),
+               'Traces': len(traces)}
+        row.update({column: counts[column]
+                    for column in BATCH_TRACEROUTE_COLUMNS[4:]})
+        rows.append(row)
+    return pd.DataFrame(rows, columns=BATCH_TRACEROUTE_COLUMNS)
+
 
 class Batfish():
 
     def __init__(self, batfish_host):
         self.batfish_host = batfish_host
-        bf_session.host = batfish_host
-        load_questions()
+        self.pool = get_session_pool(batfish_host)
+        self.network = None
+        self.snapshot = None
+
+    def session(self):
+        return self.pool.session(self.network, self.snapshot)
+
+    def scope(self, snapshot):
+        return self.batfish_host, self.network, snapshot
+
+    def answer(self, question, snapshot=None, reference_snapshot=None,
+               **parameters):
+        """
+        Answers a question as a pandas frame, serving it from the answer
+        cache when the same question was already asked of this snapshot.
+        """
+        snapshot = snapshot or self.snapshot
+        key = content_hash(self.batfish_host, self.network, snapshot,
+                           reference_snapshot, question,
+                           sorted(parameters.items()))
+        identity = None
+        if snapshot:
+            identity = self.snapshot_identity(snapshot)
+            result = answer_cache.get(self.scope(snapshot), key, identity)
+            if result is not None:
+                return result
+        with self.session() as bf:
+            result = getattr(bf.q, question)(**parameters)\
+                .answer(snapshot=snapshot,
+                        reference_snapshot=reference_snapshot)\
+                .frame()
+        if snapshot:
+            answer_cache.put(self.scope(snapshot), key, result, identity)
+        return result.copy()
+
+    def snapshot_identity(self, snapshot):
+        """
+        When Batfish created the snapshot, looked up once per snapshot for
+        the disk tier of the answer cache. None when it is unknown, which
+        leaves the snapshot's answers in memory only.
+        """
+        if not answer_cache.cache_dir:
+            return None
+        scope = self.scope(snapshot)
+        identity = answer_cache.identity(scope)
+        if identity is not None:
+            return identity or None
+        identity = ''
+        with self.session() as bf:
+            snapshots = bf.list_snapshots(verbose=True)
+        for entry in snapshots:
+            if isinstance(entry, dict) and entry.get('name') == snapshot:
+                metadata = entry.get('metadata') or {}
+                identity = str(metadata.get('creationTimestamp') or '')
+        if not identity:
+            logger.warning("No creation time for snapshot %s, its answers "
+                           "are not cached on disk", snapshot)
+        answer_cache.set_identity(scope, identity)
+        return identity or None
 
     def delete_network(self, network):
-        bf_delete_network(network)
+        with self.session() as bf:
+            bf.delete_network(network)
+        answer_cache.invalidate(self.batfish_host, network)
 
     def delete_snapshot(self, snapshot):
-        bf_delete_snapshot(snapshot)
+        with self.session() as bf:
+            bf.delete_snapshot(snapshot)
+        answer_cache.invalidate(self.batfish_host, self.network, snapshot)
 
     def set_snapshot(self, snapshot):
-        bf_set_snapshot(snapshot)
+        with self.session() as bf:
+            self.snapshot = bf.set_snapshot(snapshot)
 
     def set_network(self, network):
-        bf_set_network(network)
+        with self.session() as bf:
+            self.network = bf.set_network(network)
+            self.snapshot = None
 
     @property
     def get_existing_networks(self):
-        return bf_list_networks()
+        with self.session() as bf:
+            return bf.list_networks()
 
     @property
     def get_layer3_edges(self):
-        result = bfq.layer3Edges().answer().frame()
-        return result
+        return self.answer('layer3Edges')
 
     @property
     def get_interfaces(self):
-        result = bfq.ipOwners().answer().frame()
-        return result
+        return self.answer('ipOwners')
 
     @property
     def get_ospf_edges(self):
-        result = bfq.ospfEdges().answer().frame()
-        return result
+        return self.answer('ospfEdges')
 
     @property
     def get_bgp_edges(self):
-        result = bfq.bgpEdges().answer().frame()
-        return result
+        return self.answer('bgpEdges')
 
     def get_existing_snapshots(self):
         try:
-            snapshotlist = bf_list_snapshots()
+            with self.session() as bf:
+                snapshotlist = bf.list_snapshots()
         except ValueError:
             snapshotlist = ["None"]
         return snapshotlist
 
-    def init_snapshot(self, snapshot_name, overwrite=True):
-        snapshot_dir = "assets/snapshot_holder/"
-        bf_init_snapshot(snapshot_dir, name=str(snapshot_name),
-                         overwrite=overwrite)
+    def init_snapshot(self, snapshot_name, overwrite=True,
+                      snapshot_dir="assets/snapshot_holder/"):
+        with self.session() as bf:
+            bf.init_snapshot(snapshot_dir, name=str(snapshot_name),
+                             overwrite=overwrite)
+        answer_cache.invalidate(self.batfish_host, self.network,
+                                str(snapshot_name))
 
     def get_info(self, command):
-        execute = 'bfq.' + command + '().answer().frame()'
-        result = eval(execute)
-        return result
+        return self.answer(command)
 
 
 
@@ -95,20 +419,58 @@ class Batfish():
                                     applications=applications,
                                     ipProtocols=ipProtocols)
         if bidir:
-            result = bfq.bidirectionalTraceroute(startLocation=src,
-                                                 headers=headers)\
-                .answer(snapshot=snapshot)\
-                .frame()
+            result = self.answer('bidirectionalTraceroute', snapshot,
+                                 startLocation=src, headers=headers)
         else:
-
-            result = bfq.traceroute(startLocation=src,
-                                    headers=headers)\
-                .answer(snapshot=snapshot)\
-                .frame()
+            result = self.answer('traceroute', snapshot,
+                                 startLocation=src, headers=headers)
         return result
 
+    def trace_summary(self, snapshot, start_location, destination,
+                      srcPorts=None,
+                      dstPorts=None,
+                      applications=None,
+                      ipProtocols=None):
+        headers = HeaderConstraints(dstIps=destination,
+                                    srcPorts=srcPorts,
+                                    dstPorts=dstPorts,
+                                    applications=applications,
+                                    ipProtocols=ipProtocols)
+        result = self.answer('traceroute', snapshot,
+                             startLocation=start_location,
+                             headers=headers)
+        return summarize_traces(result, destination)
+
+    def batch_traceroute(self, sources, destinations, snapshot,
+                         srcPorts=None,
+                         dstPorts=None,
+                         applications=None,
+                         ipProtocols=None,
+                         max_workers=BATFISH_BATCH_SESSIONS):
+        """
+        Traces from every source to every destination. One traceroute
+        question is asked per destination with all the sources in its start
+        location, at most max_workers at a time, and a summary frame is
+        yielded for each destination as soon as its answer arrives.
+        """
+        start_location = ','.join(sources)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = [executor.submit(self.trace_summary, snapshot,
+                                   start_location, destination, srcPorts,
+                                   dstPorts, applications, ipProtocols)
+                   for destination in destinations]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
     def get_configuration(self, file_name, snapshot):
-        return bf_get_snapshot_input_object_text(file_name, snapshot=snapshot)
+        with self.session() as bf:
+            return bf.get_snapshot_input_object_text(file_name,
+                                                     snapshot=snapshot)
 
     def network_failure(self,
                         base_snapshot,
@@ -116,43 +478,177 @@ class Batfish():
                         deactivate_node,
                         deactivated_int,
                         overwrite=True):
-        if not deactivated_int:
-            bf_fork_snapshot(base_snapshot,
-                             reference_snapshot,
-                             deactivate_nodes=deactivate_node,
-                             overwrite=overwrite)
-        else:
-            bf_fork_snapshot(base_snapshot,
-                             reference_snapshot,
+        # Re-forking with the same failure is skipped so chaos runs can be
+        # answered straight from the cache
+        base_scope = self.scope(base_snapshot)
+        fork_key = content_hash(base_snapshot, deactivate_node,
+                                deactivated_int)
+        if answer_cache.fork_is_current(self.scope(reference_snapshot),
+                                        base_scope, fork_key):
+            return
+        with self.session() as bf:
+            if not deactivated_int:
+                bf.fork_snapshot(base_snapshot,
+                                 reference_snapshot,
+                                 deactivate_nodes=deactivate_node,
+                                 overwrite=overwrite)
+            else:
+                bf.fork_snapshot(base_snapshot,
+                                 reference_snapshot,
+                                 deactivate_interfaces=[
+                                     Interface(deactivate_node[0],
+                                               deactivated_int[0])
+                                 ],
+                                 overwrite=overwrite)
+        answer_cache.invalidate(self.batfish_host, self.network,
+                                reference_snapshot)
+        answer_cache.record_fork(self.scope(reference_snapshot), base_scope,
+                                 fork_key)
+
+
+
+    def fork_failures(self, base_snapshot, fork_snapshot, nodes, interfaces):
+        """
+        Forks base_snapshot with the given nodes and (node, interface) pairs
+        deactivated.
+        """
+        with self.session() as bf:
+            bf.fork_snapshot(base_snapshot,
+                             fork_snapshot,
+                             deactivate_nodes=list(nodes) or None,
                              deactivate_interfaces=[
-                                 Interface(deactivate_node[0],
-                                           deactivated_int[0])
-                             ],
-                             overwrite=overwrite)
+                                 Interface(node, interface)
+                                 for node, interface in interfaces
+                             ] or None,
+                             overwrite=True)
+        answer_cache.invalidate(self.batfish_host, self.network,
+                                fork_snapshot)
+
+    def get_failure_elements(self, snapshot, failure_type):
+        """
+        Lists the nodes, or the links when failure_type is 'links', that a
+        failure sweep can fail. A link is failed by deactivating one of its
+        interfaces.
+        """
+        if failure_type == 'links':
+            edges = self.answer('layer3Edges', snapshot)
+            links = {}
+            for local, remote in zip(edges['Interface'],
+                                     edges['Remote_Interface']):
+                key = tuple(sorted((str(local), str(remote))))
+                links.setdefault(key, (local.hostname, local.interface))
+            return [
+                {'label': ' <-> '.join(key), 'nodes': [],
+                 'interfaces': [interface]}
+                for key, interface in sorted(links.items())]
+        nodes = self.answer('nodeProperties', snapshot)['Node']
+        return [{'label': node, 'nodes': [node], 'interfaces': []}
+                for node in sorted(set(nodes))]
 
+    def count_failure_scenarios(self, snapshot, failure_type, depth=1):
+        return count_combinations(
+            len(self.get_failure_elements(snapshot, failure_type)), depth)
 
+    def get_failure_scenarios(self, snapshot, failure_type, depth=1):
+        """
+        Lists every combination of depth failed nodes, or failed links when
+        failure_type is 'links'. Refuses to list more than
+        BATFISH_MAX_SCENARIOS of them.
+        """
+        elements = self.get_failure_elements(snapshot, failure_type)
+        count = count_combinations(len(elements), depth)
+        if count > BATFISH_MAX_SCENARIOS:
+            raise ValueError(
+                "{} failure scenarios, more than the {} allowed by "
+                "BATFISH_MAX_SCENARIOS".format(count, BATFISH_MAX_SCENARIOS))
+        scenarios = []
+        for combination in itertools.combinations(elements, depth):
+            scenarios.append({
+                'label': ' + '.join(element['label']
+                                    for element in combination),
+                'nodes': [node for element in combination
+                          for node in element['nodes']],
+                'interfaces': [interface for element in combination
+                               for interface in element['interfaces']],
+            })
+        return scenarios
+
+    def failure_sweep(self, base_snapshot, scenarios, run_question,
+                      sweep_id, max_workers=BATFISH_BATCH_SESSIONS):
+        """
+        Runs run_question(snapshot) against a fork of base_snapshot for
+        every failure scenario, at most max_workers forks at a time. Each
+        fork is named after sweep_id and its scenario, so concurrent sweeps
+        of the same snapshot do not overwrite each other's forks, and is
+        deleted once answered. Yields (scenario, answer) as the answers
+        arrive.
+        """
+        def run(scenario):
+            fork_snapshot = '{}_SWEEP_{}_{}'.format(
+                base_snapshot, sweep_id,
+                content_hash(scenario['label'])[:12])
+            self.fork_failures(base_snapshot, fork_snapshot,
+                               scenario['nodes'], scenario['interfaces'])
+            try:
+                return scenario, run_question(fork_snapshot)
+            finally:
+                self.delete_snapshot(fork_snapshot)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = [executor.submit(run, scenario) for scenario in scenarios]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
 
     def compare_acls(self,orginal_acl, refactored_acl, original_paltform, refactored_platform):
-        original_snapshot = bf_session.init_snapshot_from_text(orginal_acl,
-                                           platform=original_paltform,
-                                           snapshot_name="original",
-                                           overwrite=True)
-        refactored_snapshot = bf_session.init_snapshot_from_text(refactored_acl,
-                                           platform=refactored_platform,
-                                           snapshot_name="refactored",
-                                           overwrite=True)
-        result = bfq.compareFilters().answer(snapshot=refactored_snapshot, reference_snapshot=original_snapshot).frame()
+        # The temporary snapshots are rebuilt from the ACL text every time,
+        # so the answer is keyed on that text rather than the snapshot names
+        scope = self.scope("refactored")
+        key = content_hash(self.batfish_host, self.network, 'compareFilters',
+                           orginal_acl, refactored_acl, original_paltform,
+                           refactored_platform)
+        result = answer_cache.get(scope, key, identity='compareFilters')
+        if result is not None:
+            return result
+        # Comparisons run concurrently as jobs, so each one gets snapshots
+        # of its own
+        suffix = uuid.uuid4().hex[:12]
+        original_snapshot = "original_" + suffix
+        refactored_snapshot = "refactored_" + suffix
+        created = []
+        with self.session() as bf:
+            try:
+                created.append(bf.init_snapshot_from_text(
+                    orginal_acl, platform=original_paltform,
+                    snapshot_name=original_snapshot, overwrite=True))
+                created.append(bf.init_snapshot_from_text(
+                    refactored_acl, platform=refactored_platform,
+                    snapshot_name=refactored_snapshot, overwrite=True))
+                result = bf.q.compareFilters().answer(snapshot=refactored_snapshot, reference_snapshot=original_snapshot).frame()
+            finally:
+                for snapshot in created:
+                    try:
+                        bf.delete_snapshot(snapshot)
+                    except Exception:
+                        logger.exception("Could not delete ACL snapshot %s",
+                                         snapshot)
         result.rename(
             columns={'Line_Content': 'Refactored ACL Line', 'Reference_Line_Content': 'Original ACL Line'},
             inplace=True)
-        return result
+        answer_cache.put(scope, key, result, identity='compareFilters')
+        return result.copy()
 
 
     def get_question_description(self, question):
-        execute = 'bfq.' + question + '().get_long_description()'
-        result = eval(execute)
+        with self.session() as bf:
+            result = getattr(bf.q, question)().get_long_description()
         return result
 
     @property
     def list_questions(self):
-        return list_questions()
\ No newline at end of file
+        with self.session() as bf:
+            return bf.q.list()
\ No newline at end of file
@@ -1,93 +1,130 @@
-import base64
+import math
 import os
 import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
 import dash_daq as daq
 import dash_cytoscape as cyto
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
+import dash_table
+import pandas as pd
 from ttp import ttp
+from components.batfish import BATCH_TRACEROUTE_COLUMNS
+
+
+# Applied in order to the interface half of every edge endpoint
+INTERFACE_ABBREVIATIONS = [
+    (re.compile(r"\..*"), ".subints"),
+    (re.compile(r"^Ethernet"), "eth"),
+    (re.compile(r"^TenGigabitEthernet"), "Ten"),
+    (re.compile(r"^GigabitEthernet"), "Ge"),
+    (re.compile(r"^port-channel"), "po"),
+    (re.compile(r"^Port-Channel"), "po"),
+    (re.compile(r"([^-]+-\S{4})(.*)"), r"\1"),  #shorten the AWS interface names
+]
+
+
+def get_unique_pairs(first, second):
+    """
+    Returns the unordered (first, second) pairs once each, keyed on
+    (min, max) so an edge and its reverse collapse to the same row.
+    """
+    first = first.astype(str).reset_index(drop=True)
+    second = second.astype(str).reset_index(drop=True)
+    swap = first > second
+    pairs = pd.DataFrame({'source': first.where(~swap, second),
+                          'target': second.where(~swap, first)})
+    return pairs.drop_duplicates()
+
+
+def split_interfaces(interfaces):
+    """
+    Splits "node[interface]" strings into node and abbreviated interface
+    columns.
+    """
+    split = interfaces.str.replace(']', '', regex=False)\
+        .str.split('[', n=1, expand=True)
+    interface_names = split[1]
+    for pattern, replacement in INTERFACE_ABBREVIATIONS:
+        interface_names = interface_names.str.replace(pattern, replacement,
+                                                      regex=True)
+    return split[0], interface_names
 
 
 def get_bgp_nodes(batfish_df):
-    local_node = set(tuple(zip(batfish_df['Node'], batfish_df['AS_Number'])))
-    remote_node = set(
-        tuple(zip(batfish_df['Remote_Node'], batfish_df['Remote_AS_Number'])))
-    all_nodes = list(local_node) + list(remote_node)
+    all_nodes = pd.concat([
+        pd.DataFrame({'device': batfish_df['Node'],
+                      'as_number': batfish_df['AS_Number']}),
+        pd.DataFrame({'device': batfish_df['Remote_Node'],
+                      'as_number': batfish_df['Remote_AS_Number']}),
+    ]).astype(str).drop_duplicates()
     nodes = [
         {
             'data': {'id': device, 'label': device,
                      'parent': 'AS ' + as_number}, 'classes': 'bgp_node',
         }
-        for device, as_number in list(set(all_nodes))
+        for device, as_number in zip(all_nodes['device'],
+                                     all_nodes['as_number'])
     ]
     return nodes
 
 
 def get_bgp_edges(batfish_df):
-    test_edges = set(tuple(zip(batfish_df['Node'], batfish_df['Remote_Node'])))
-    new_edges = []
-    for edge in test_edges:
-        if edge[::-1] not in new_edges:
-            new_edges.append(edge)
-
-    new_edges = list(set(tuple(sub) for sub in new_edges))
+    new_edges = get_unique_pairs(batfish_df['Node'], batfish_df['Remote_Node'])
     edges = [
         {'data': {'source': source, 'target': target}}
-        for source, target in new_edges]
+        for source, target in zip(new_edges['source'], new_edges['target'])]
     return edges
 
 
 def getnodes(batfish_df):
-    node_x = [re.sub('\[.*', '', str(x)) for x in batfish_df['Interface']]
+    node_x = batfish_df['Interface'].astype(str)\
+        .str.replace(r'\[.*', '', regex=True).unique()
     nodes = [{'data': {'id': device, 'label': device}} for device in
-             set(node_x)]
+             node_x]
     return nodes
 
 
 def getparents(batfish_df):
-    as_numbers = list(batfish_df['AS_Number']) + list(
-        batfish_df['Remote_AS_Number'])
+    as_numbers = pd.unique(pd.concat([batfish_df['AS_Number'],
+                                      batfish_df['Remote_AS_Number']])
+                           .astype(str))
     parent_nodes = [
         {
             'data': {'id': 'AS ' + asn, 'label': 'AS ' + asn}, 'classes': 'parent',
         }
-        for asn in list(set(as_numbers))
+        for asn in as_numbers
     ]
     return parent_nodes
 
 
 def getedges(batfish_df):
-    test_edges = set(
-        tuple(zip(batfish_df['Interface'], batfish_df['Remote_Interface'])))
-    new_edges = []
-    new_new_edges = []
-    for edge in test_edges:
-        if edge not in new_edges:
-            if edge[::-1] not in new_edges:
-                new_edges.append(edge)
-                test = []
-                for x in edge:
-                    x = re.sub('\]', '', str(x))
-                    x_test = x.split('[')
-                    x_test[1] = re.sub("\..*", ".subints", x_test[1])
-                    x_test[1] = re.sub("^Ethernet", "eth", x_test[1])
-                    x_test[1] = re.sub("^TenGigabitEthernet", "Ten", x_test[1])
-                    x_test[1] = re.sub("^GigabitEthernet", "Ge", x_test[1])
-                    x_test[1] = re.sub("^port-channel", "po", x_test[1])
-                    x_test[1] = re.sub("^Port-Channel", "po", x_test[1])
-                    x_test[1] = re.sub(r"([^-]+-\S{4})(.*)",r"\1", x_test[1])  #shorten the AWS interface names
-                    test += x_test
-                new_new_edges.append(test)
-    new_new_edges = list(set(tuple(sub) for sub in new_new_edges))
+    if batfish_df.empty:
+        return []
+    new_edges = get_unique_pairs(batfish_df['Interface'],
+                                 batfish_df['Remote_Interface'])
+    source, source_int = split_interfaces(new_edges['source'])
+    target, target_int = split_interfaces(new_edges['target'])
+    new_new_edges = pd.DataFrame({'source': source,
+                                  'source_int': source_int,
+                                  'target': target,
+                                  'target_int': target_int}).drop_duplicates()
     edges = [
         {'data': {'source': source, 'target': target,
                   'source_label': source_int, 'target_label': target_int}}
-        for source, source_int, target, target_int in new_new_edges]
+        for source, source_int, target, target_int in zip(
+            new_new_edges['source'], new_new_edges['source_int'],
+            new_new_edges['target'], new_new_edges['target_int'])]
     return edges
 
 
-def create_graph(elements):
+def create_graph(elements, layout=None):
     children = [
         cyto.Cytoscape(
             id='cytoscape',
@@ -148,11 +185,32 @@ def create_graph(elements):
                         'border-color':'#555555',
                     }
                 },
-            ],
-            layout={'name': 'breadthfirst',
-                    'padding': 60,
-                    'spacingFactor': 2.5,
+                {
+                    'selector': '.cluster',
+                    'style': {
+                        'label': 'data(label)',
+                        'background-image': 'none',
+                        'background-color': 'ghostwhite',
+                        'border-width': '2px',
+                        'border-color':'#555555',
+                        'shape': 'round-rectangle',
                     }
+                },
+                {
+                    'selector': '.cluster_edge',
+                    'style': {
+                        'label': 'data(label)',
+                        'source-label': '',
+                        'target-label': '',
+                        'width': 'data(width)',
+                        'curve-style': 'haystack'
+                    }
+                },
+            ],
+            layout=layout or {'name': 'breadthfirst',
+                              'padding': 60,
+                              'spacingFactor': 2.5,
+                              }
         ),
 
     ]
@@ -229,6 +287,169 @@ def get_flow_details(result_flow, direction):
                     ])
     return flow
 
+TRACE_COLORS = ["red", "blue", "green", "black", "brown", "cyan",
+                "grey", "lime", "purple",
+                "violet", "teal", "silver", "orange", "pink", "yellow"]
+TRACE_STORE_SIZE = 32
+
+# Raw traces of rendered traceroutes, keyed by result id
+trace_store = OrderedDict()
+trace_store_lock = threading.Lock()
+
+
+def get_trace_hops(trace, trace_count):
+    """
+    Builds the per-hop/step toasts of a single trace.
+    """
+    hops = trace.dict()['hops']
+    count = 0
+    step_row_children = []
+    for hop in hops:
+        outside_toast_children = []
+        node = hop['node']
+
+        # Gets details of each hop
+        hop_steps = hop['steps']
+        outside_toast_id = "trace_{trace_count}_step_{step_count}".format(
+            trace_count=trace_count, step_count=count)
+        outside_toast_header = "Step: {step_count} Node: {node}".format(
+            step_count=count, node=node)
+
+        for step_detail in hop_steps:
+            step_detail_dict = step_detail['detail']
+            step_action = step_detail['action']
+            inside_toast_content = ""
+            inside_toast_header = step_action
+            inside_toast_content_html = None
+            inside_toast_id = "trace_{trace_count}_step_{step_count}_{step_action}".format(
+                trace_count=trace_count, step_count=count,
+                step_action=step_action)
+            for outside_key, outside_value in step_detail_dict.items():
+
+                inside_toast_children = []
+                inside_value_dict = ""
+
+                if outside_key == "routes":
+                    if outside_value:
+                        for inside_key, inside_value in outside_value[0].items():
+                            inside_value_dict += "{key} : {value}\n".format(
+                                key=inside_key, value=inside_value)
+                        inside_toast_content_html = html.Details(
+                            [html.Summary(outside_key),
+                             html.Div(html.Pre(inside_value_dict))])
+                    else:
+                        inside_toast_content_html = html.Details(
+                            [html.Summary(outside_key),
+                             html.Div(html.Pre("NO ROUTE"))])
+
+                elif outside_key == "flow":
+                    for inside_key, inside_value in outside_value.items():
+                        inside_value_dict += "{key} : {value}\n".format(
+                            key=inside_key, value=inside_value)
+                    inside_toast_content_html = html.Details(
+                        [html.Summary(outside_key),
+                         html.Div(html.Pre(inside_value_dict))])
+                else:
+                    inside_toast_content += "{key} : {value}\n".format(
+                        key=outside_key, value=outside_value)
+
+            inside_toast_children.append(html.Pre(inside_toast_content))
+            inside_toast_children.append(inside_toast_content_html)
+            inside_toast = dbc.Toast(
+                inside_toast_children,
+                id=inside_toast_id,
+                header=inside_toast_header,
+                style={"min-width": "200px",
+                       "font-size": "12px"})
+
+            outside_toast_children.append(inside_toast)
+        count += 1
+
+        step_toast = dbc.Toast(
+            outside_toast_children,
+            is_open=True,
+            id={
+                'type': 'Step_Toast',
+                'index': outside_toast_id
+            },
+            header=outside_toast_header,
+            style={"min-width": "300px",
+                   "font-size": "15px"},
+
+        )
+
+        step_row_children.append(step_toast)
+
+    return html.Div(
+        dbc.Row(children=step_row_children,
+
+                style={"display": "flex",
+                       "min-width": "100%",
+                       "min-height": "300px",
+                       "overflowX": "auto",
+                       "flex-wrap": "nowrap",
+                       'margin-bottom': '20px'}),
+        style={
+            'whiteSpace': 'nowrap',
+            'width': '1690px',
+            'height': 'auto',
+            'margin-left':"15px"
+
+
+        },
+    )
+
+
+def get_stored_trace(result_id, trace_count):
+    with trace_store_lock:
+        traces = trace_store.get(result_id)
+    if traces is None or not 0 <= trace_count < len(traces):
+        return None
+    return traces[trace_count]
+
+
+def get_trace_summary(kind, result_id, traces):
+    """
+    Compact table with one row per trace. The hop details of a trace are
+    only rendered once its row is selected.
+    """
+    rows = []
+    for trace_count, trace in enumerate(traces):
+        hops = [hop['node'] for hop in trace.dict()['hops']]
+        rows.append({'Trace': trace_count,
+                     'Disposition': str(trace.disposition),
+                     'Hops': len(hops),
+                     'Path': ' -> '.join(hops)})
+    return html.Div(
+        children=[
+            dcc.Store(id={'type': 'trace-result', 'index': kind},
+                      data=result_id),
+            dash_table.DataTable(
+                id={'type': 'trace-table', 'index': kind},
+                columns=[{"name": i, "id": i}
+                         for i in ['Trace', 'Disposition', 'Hops', 'Path']],
+                data=rows,
+                row_selectable='single',
+                selected_rows=[0] if rows else [],
+                page_size=10,
+                filter_action="native",
+                style_cell={'fontSize': 12, 'font-family': 'sans-serif',
+                            'textAlign': 'left'},
+                style_data_conditional=[
+                    {
+                        'if': {'row_index': 'odd'},
+                        'backgroundColor': 'rgb(248, 248, 248)'
+                    }
+                ],
+                style_header={
+                    'backgroundColor': 'rgb(230, 230, 230)',
+                    'fontWeight': 'bold'
+                }
+            ),
+            html.Div(id={'type': 'trace-hops', 'index': kind}),
+        ])
+
+
 def get_traceroute_details(direction, result, bidir, chaos=False):
     """
     :param direction:
@@ -240,7 +461,8 @@ def get_traceroute_details(direction, result, bidir, chaos=False):
         If the traceroute is bidirectional:
             boolean: true or false
     :return:
-        Graph of the trace route and trace route details
+        Graph of the trace route and a trace summary table; the raw traces
+        are kept server-side for the per-hop details
     """
 
     if bidir:
@@ -291,37 +513,28 @@ def get_traceroute_details(direction, result, bidir, chaos=False):
         },
     ]
 
-    colors = ["red", "blue", "green", "black", "brown", "cyan",
-              "grey", "lime", "purple",
-              "violet", "teal", "silver", "orange", "pink", "yellow"]
-    trace_count = 0
-    trace_tabs_children = []
     node_list = []
     nodes = {}
     trace_edges = []
-    for x in traces:
-        trace = traces[trace_count]
+    all_x_values = []
+    max_value = 0
+    for trace_count, trace in enumerate(traces):
         hops = trace.dict()['hops']
-        count = 0
-        step_row_children = []
         x = 0
         y = 0
         first_edge_node_count = 0
         second_edge_node_count = 1
         for hop in hops:
-            outside_toast_children = []
             node = hop['node']
 
             # Node positioning
             if node not in nodes:
-
-                if node not in nodes:
-                    all_x_values = [value[0] for value in nodes.values()]
-                    if x in all_x_values:
-                        nodes[node] = [x, all_x_values.count(x)]
-                    else:
-                        node_list.append(node)
-                        nodes[node] = [x, y]
+                all_x_values = [value[0] for value in nodes.values()]
+                if x in all_x_values:
+                    nodes[node] = [x, all_x_values.count(x)]
+                else:
+                    node_list.append(node)
+                    nodes[node] = [x, y]
             x += 1
 
             pair = []
@@ -338,175 +551,76 @@ def get_traceroute_details(direction, result, bidir, chaos=False):
             first_edge_node_count += 1
             second_edge_node_count += 1
 
-
-            # Gets details of each hop
-            hop_steps = hop['steps']
-            outside_toast_id = "trace_{trace_count}_step_{step_count}".format(
-                trace_count=trace_count, step_count=count)
-            outside_toast_header = "Step: {step_count} Node: {node}".format(
-                step_count=count, node=node)
-
-            for step_detail in hop_steps:
-                step_detail_dict = step_detail['detail']
-                step_action = step_detail['action']
-                inside_toast_content = ""
-                inside_toast_header = step_action
-                inside_toast_content_html = None
-                inside_toast_id = "trace_{trace_count}_step_{step_count}_{step_action}".format(
-                    trace_count=trace_count, step_count=count,
-                    step_action=step_action)
-                for outside_key, outside_value in step_detail_dict.items():
-
-                    inside_toast_children = []
-                    inside_value_dict = ""
-
-                    if outside_key == "routes":
-                        if outside_value:
-                            for inside_key, inside_value in outside_value[0].items():
-                                inside_value_dict += "{key} : {value}\n".format(
-                                    key=inside_key, value=inside_value)
-                            inside_toast_content_html = html.Details(
-                                [html.Summary(outside_key),
-                                 html.Div(html.Pre(inside_value_dict))])
-                        else:
-                            inside_toast_content_html = html.Details(
-                                [html.Summary(outside_key),
-                                 html.Div(html.Pre("NO ROUTE"))])
-
-                    elif outside_key == "flow":
-                        for inside_key, inside_value in outside_value.items():
-                            inside_value_dict += "{key} : {value}\n".format(
-                                key=inside_key, value=inside_value)
-                        inside_toast_content_html = html.Details(
-                            [html.Summary(outside_key),
-                             html.Div(html.Pre(inside_value_dict))])
-                    else:
-                        inside_toast_content += "{key} : {value}\n".format(
-                            key=outside_key, value=outside_value)
-
-                inside_toast_children.append(html.Pre(inside_toast_content))
-                inside_toast_children.append(inside_toast_content_html)
-                inside_toast = dbc.Toast(
-                    inside_toast_children,
-                    id=inside_toast_id,
-                    header=inside_toast_header,
-                    style={"min-width": "200px",
-                           "font-size": "12px"})
-
-                outside_toast_children.append(inside_toast)
-            count += 1
-
-            step_toast = dbc.Toast(
-                outside_toast_children,
-                is_open=True,
-                id={
-                    'type': 'Step_Toast',
-                    'index': outside_toast_id
-                },
-                header=outside_toast_header,
-                style={"min-width": "300px",
-                       "font-size": "15px"},
-
-            )
-
-            step_row_children.append(step_toast)
         try:
 
             max_value = max(all_x_values)
         except ValueError:
             max_value = 0
-        step_row = html.Div(
-            dbc.Row(children=step_row_children,
-
-                    style={"display": "flex",
-                           "min-width": "100%",
-                           "min-height": "300px",
-                           "overflowX": "auto",
-                           "flex-wrap": "nowrap",
-                           'margin-bottom': '20px'}),
-            style={
-                'whiteSpace': 'nowrap',
-                'width': '1690px',
-                'height': 'auto',
-                'margin-left':"15px"
-
-
-            },
-        )
-        tab_style = {
-            'borderBottom': '1px solid #d6d6d6',
-            'padding': '6px',
-            'fontWeight': 'bold',
-            "color": colors[0],
-            "font-size":"18px"
-
-        }
-
-        tab_selected_style = {
-            'borderTop': '1px solid #d6d6d6',
-            'borderBottom': '1px solid #d6d6d6',
-            'backgroundColor': colors[0],
-            'color': 'white',
-            'padding': '6px',
-            "font-size":"18px"
-        }
-        trace_tab = dcc.Tab(className='trace-tab',
-                            label="Trace " + str(trace_count),
-                            children=step_row,
-                            style=tab_style,
-                            selected_style=tab_selected_style)
-
-        trace_tabs_children.append(trace_tab)
 
         trace_style = [{
             'selector': 'edge.' + 'trace_' + str(trace_count),
             'style': {
-                'target-arrow-color': colors[0],
+                'target-arrow-color': TRACE_COLORS[trace_count % len(TRACE_COLORS)],
                 'target-arrow-shape': 'triangle',
-                'line-color': colors[0]
+                'line-color': TRACE_COLORS[trace_count % len(TRACE_COLORS)]
             }
         }]
-        trace_count += 1
-        del colors[0]
         stylesheet = stylesheet + trace_style
 
+    result_id = uuid.uuid4().hex
+    with trace_store_lock:
+        trace_store[result_id] = list(traces)
+        while len(trace_store) > TRACE_STORE_SIZE:
+            trace_store.popitem(last=False)
+
+    kind = 'chaos' if chaos else direction
     return [create_traceroute_graph(
         get_elements(nodes, trace_edges, max_value, node_list), stylesheet),
-        trace_tabs_children]
-
-SNAPSHOT_DEVICE_CONFIG_UPLOAD_DIRECTORY = "assets/snapshot_holder/configs"
-SNAPSHOT_HOST_CONFIG_UPLOAD_DIRECTORY = "assets/snapshot_holder/hosts"
-SNAPSHOT_IPTABLES_CONFIG_UPLOAD_DIRECTORY = "assets/snapshot_holder/iptables"
-SNAPSHOT_AWS_CONFIG_UPLOAD_DIRECTORY = "assets/snapshot_holder/aws_configs"
-SNAPSHOT_MISC_CONFIG_UPLOAD_DIRECTORY = "assets/snapshot_holder/batfish"
-
-
-def save_file(config_type, name, content):
-    data = content.encode("utf8").split(b";base64,")[1]
-    if config_type == 'device_config':
-        directory = SNAPSHOT_DEVICE_CONFIG_UPLOAD_DIRECTORY
-    elif config_type == 'host_config':
-        directory = SNAPSHOT_HOST_CONFIG_UPLOAD_DIRECTORY
-    elif config_type == 'iptable_config':
-        directory = SNAPSHOT_IPTABLES_CONFIG_UPLOAD_DIRECTORY
-    elif config_type == 'aws_config':
-        directory = SNAPSHOT_AWS_CONFIG_UPLOAD_DIRECTORY
-    elif config_type == 'misc_config':
-        directory = SNAPSHOT_MISC_CONFIG_UPLOAD_DIRECTORY
+        get_trace_summary(kind, result_id, traces)]
+
+SNAPSHOT_UPLOAD_ROOT = os.environ.get(
+    'BATFISH_UPLOAD_DIR',
+    os.path.join(tempfile.gettempdir(), 'batfish_dashboard_uploads'))
+SNAPSHOT_UPLOAD_MAX_AGE = 24 * 60 * 60
+
+# Snapshot sub-directory that each upload area streams its files into
+SNAPSHOT_UPLOAD_DIRECTORIES = OrderedDict([
+    ('device-configs-upload-data', 'configs'),
+    ('host-configs-upload-data', 'hosts'),
+    ('iptables-configs-upload-data', 'iptables'),
+    ('aws-configs-upload-data', 'aws_configs'),
+    ('misc-configs-upload-data', 'batfish'),
+])
 
-    try:
-        if not os.path.isdir(directory):
-            os.makedirs(directory)
-    except OSError:
-        print(f"Failed to make directory {directory}")
-    else:
-        print(f"Successfully created directory {directory}")
 
-    with open(os.path.join(directory, name), "wb") as fp:
-        fp.write(base64.decodebytes(data))
+def get_snapshot_upload_dir(upload_id):
+    return os.path.join(SNAPSHOT_UPLOAD_ROOT, upload_id)
 
 
+def get_uploaded_files(upload_id, directory):
+    path = os.path.join(get_snapshot_upload_dir(upload_id), directory)
+    try:
+        return sorted(name for name in os.listdir(path)
+                      if os.path.isfile(os.path.join(path, name)))
+    except OSError:
+        return []
+
 
+def delete_stale_uploads():
+    """
+    Removes upload directories that were never turned into a snapshot.
+    """
+    try:
+        upload_ids = os.listdir(SNAPSHOT_UPLOAD_ROOT)
+    except OSError:
+        return
+    for upload_id in upload_ids:
+        path = get_snapshot_upload_dir(upload_id)
+        try:
+            if time.time() - os.path.getmtime(path) > SNAPSHOT_UPLOAD_MAX_AGE:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError as error:
+            print(error)
 
 
 def delete_old_files():
@@ -520,17 +634,169 @@ def delete_old_files():
         print(error)
 
 
+# Graphs with more devices than this are sent as collapsed clusters
+LOD_NODE_THRESHOLD = 150
+LOD_CLUSTER_SPACING = 300
+LOD_NODE_SPACING = 120
+TOPOLOGY_STORE_SIZE = 32
+
+# Full topologies of the level-of-detail graphs, keyed by graph id
+topology_store = OrderedDict()
+topology_store_lock = threading.Lock()
+
+
+def get_node_group(device):
+    """
+    Groups devices by role/site, taken as the name without its trailing
+    index, e.g. nyc-leaf-12 -> nyc-leaf.
+    """
+    return re.sub(r'[-_.]?\d+$', '', device) or device
+
+
+def get_cluster_id(group):
+    return 'cluster:' + group
+
+
+def get_cluster_layout(groups):
+    """
+    Places the clusters on a circle and each cluster's members on a grid
+    around its centre, so the client can use a preset layout.
+    """
+    members = OrderedDict()
+    for device, group in sorted(groups.items(), key=lambda x: (x[1], x[0])):
+        members.setdefault(group, []).append(device)
+    columns = {group: math.ceil(math.sqrt(len(devices)))
+               for group, devices in members.items()}
+    extent = max(columns.values()) * LOD_NODE_SPACING + LOD_CLUSTER_SPACING
+    radius = extent * len(members) / (2 * math.pi) if len(members) > 1 else 0
+
+    positions = {}
+    for index, (group, devices) in enumerate(members.items()):
+        angle = 2 * math.pi * index / len(members)
+        centre_x = radius * math.cos(angle)
+        centre_y = radius * math.sin(angle)
+        positions[get_cluster_id(group)] = {'x': centre_x, 'y': centre_y}
+        offset = (columns[group] - 1) / 2
+        for position, device in enumerate(devices):
+            row, column = divmod(position, columns[group])
+            positions[device] = {
+                'x': centre_x + (column - offset) * LOD_NODE_SPACING,
+                'y': centre_y + (row - offset) * LOD_NODE_SPACING}
+    return positions
+
+
+def get_lod_elements(topology, expanded):
+    """
+    Returns the elements of a level-of-detail graph: collapsed clusters as
+    single super-nodes, expanded clusters as compound nodes holding their
+    devices, and edges between clusters aggregated with a link count.
+    """
+    groups = topology['groups']
+    positions = topology['positions']
+    elements = []
+    for group, count in sorted(Counter(groups.values()).items()):
+        cluster_id = get_cluster_id(group)
+        cluster = {'data': {'id': cluster_id,
+                            'label': '{} ({})'.format(group, count),
+                            'cluster': group},
+                   'classes': 'cluster'}
+        if group in expanded:
+            cluster['classes'] = 'cluster parent'
+        else:
+            cluster['position'] = positions[cluster_id]
+        elements.append(cluster)
+
+    for node in topology['nodes']:
+        device = node['data']['id']
+        if groups[device] in expanded:
+            data = dict(node['data'], parent=get_cluster_id(groups[device]))
+            elements.append({'data': data, 'position': positions[device]})
+
+    def endpoint(device):
+        if groups[device] in expanded:
+            return device
+        return get_cluster_id(groups[device])
+
+    links = Counter()
+    for edge in topology['edges']:
+        source = endpoint(edge['data']['source'])
+        target = endpoint(edge['data']['target'])
+        if source == target:
+            continue
+        if source == edge['data']['source'] and \
+                target == edge['data']['target']:
+            elements.append(edge)
+        else:
+            links[tuple(sorted((source, target)))] += 1
+    for (source, target), count in links.items():
+        elements.append({'data': {'source': source, 'target': target,
+                                  'label': str(count),
+                                  'width': min(1 + math.log2(count), 10)},
+                         'classes': 'cluster_edge'})
+    return elements
+
+
+def get_topology(graph_id):
+    with topology_store_lock:
+        return topology_store.get(graph_id)
+
+
+def keep_topology(children):
+    """
+    Marks the topology of a graph built by create_topology_graph as the
+    most recently used one, so it outlives older topologies in the store.
+    """
+    if not isinstance(children, list):
+        return
+    for child in children:
+        if getattr(child, 'id', None) == 'topology-graph-id':
+            with topology_store_lock:
+                if child.data in topology_store:
+                    topology_store.move_to_end(child.data)
+            return
+
+
+def create_topology_graph(nodes, edges, groups=None, parents=None):
+    """
+    Builds the topology graph, collapsing it into clusters with server-side
+    coordinates when it has more than LOD_NODE_THRESHOLD devices.
+    """
+    graph_id = None
+    if len(nodes) <= LOD_NODE_THRESHOLD:
+        children = create_graph((parents or []) + nodes + edges)
+    else:
+        if groups is None:
+            groups = {node['data']['id']: get_node_group(node['data']['id'])
+                      for node in nodes}
+        graph_id = uuid.uuid4().hex
+        topology = {'nodes': nodes,
+                    'edges': edges,
+                    'groups': groups,
+                    'positions': get_cluster_layout(groups)}
+        with topology_store_lock:
+            topology_store[graph_id] = topology
+            while len(topology_store) > TOPOLOGY_STORE_SIZE:
+                topology_store.popitem(last=False)
+        children = create_graph(get_lod_elements(topology, []),
+                                layout={'name': 'preset', 'padding': 60})
+    return children + [
+        dcc.Store(id='topology-graph-id', data=graph_id),
+        dcc.Store(id='topology-expanded-clusters', data=[]),
+    ]
+
+
 def get_layer3_graph(batfish_df):
-    return create_graph(
-            getnodes(batfish_df) + getedges(batfish_df))
+    return create_topology_graph(getnodes(batfish_df), getedges(batfish_df))
 
 def get_ospf_graph(batfish_df):
-    return create_graph(
-        getnodes(batfish_df) + getedges(batfish_df))
+    return create_topology_graph(getnodes(batfish_df), getedges(batfish_df))
 
 def get_bgp_graph(batfish_df):
-    return create_graph(getparents(batfish_df) + get_bgp_nodes(
-        batfish_df) + get_bgp_edges(batfish_df))
+    bgp_nodes = get_bgp_nodes(batfish_df)
+    groups = {node['data']['id']: node['data']['parent']
+              for node in bgp_nodes}
+    return create_topology_graph(bgp_nodes, get_bgp_edges(batfish_df), groups,
+                                 getparents(batfish_df))
 
 def get_traceroute_content(batfish_df):
     interfaces = [{'label': row['Node'] + '-' + row['Interface'] + '-' + row['IP'],
@@ -664,7 +930,7 @@ def get_traceroute_content(batfish_df):
                      id="main_page_forward_traceroute_graph"),
                  html.Div(
                      style={"width": "1000px"},
-                     children=[dcc.Tabs(id="forward_traceroute_tabs")]
+                     children=[html.Div(id="forward_traceroute_traces")]
                  ),
 
                  ]),
@@ -674,7 +940,7 @@ def get_traceroute_content(batfish_df):
                  html.Div(id="main_page_reverse_traceroute_graph"),
                  html.Div(
                      style={"width": "1000px"},
-                     children=[dcc.Tabs(id="reverse_traceroute_tabs")]
+                     children=[html.Div(id="reverse_traceroute_traces")]
                  ),
 
                  ]),
@@ -682,12 +948,150 @@ def get_traceroute_content(batfish_df):
             html.Fieldset(
                 id="chaos_traceroute_fieldset"),
 
+            html.Fieldset(
+                id="batch_traceroute_fieldset",
+                children=[
+                    html.Legend("Batch Trace Route"),
+                    dbc.Row(
+                        children=[
+                            dbc.Col(
+                                children=[
+                                    dbc.Input(
+                                        id="batch_traceroute_sources",
+                                        placeholder="Sources, e.g. /leaf.*/ (all interfaces if empty)"),
+                                ]),
+                            dbc.Col(
+                                children=[
+                                    dcc.Textarea(
+                                        id="batch_traceroute_destinations",
+                                        placeholder="Destination IPs or prefixes, one per line",
+                                        style={'width': '100%'}),
+                                ]),
+                            dbc.Col(
+                                width=1,
+                                children=[
+                                    dbc.Button("Trace All!",
+                                               id="batch_traceroute_submit"),
+                                ]),
+                        ]),
+                    get_job_components('batch_traceroute'),
+                    dcc.Store(id="batch_traceroute_rows"),
+                    dcc.Store(id="batch_traceroute_sent"),
+                    html.Div(id="batch_traceroute_table",
+                             style={'display': 'none'},
+                             children=get_batch_traceroute_table()),
+                ]),
+
         ],
 
     ),
 
 
 
+def get_batch_traceroute_summary(totals):
+    return "{} flows: {} accepted, {} denied, {} no route, {} other".format(
+        totals['Flows'], totals['Accepted'], totals['Denied'],
+        totals['No_Route'], totals['Other'])
+
+
+def get_batch_traceroute_table():
+    """
+    The batch traceroute table starts out empty, the rows are appended in
+    the browser as the job traces them.
+    """
+    return [
+        html.P(id='batch_traceroute_summary'),
+        dash_table.DataTable(
+            id='batch_traceroute_datatable',
+            columns=[{"name": i, "id": i} for i in BATCH_TRACEROUTE_COLUMNS],
+            data=[],
+            filter_action="native",
+            sort_action="native",
+            page_size=50,
+            export_format="csv",
+            style_cell={'fontSize': 12, 'font-family': 'sans-serif'},
+            style_data_conditional=[
+                {
+                    'if': {'row_index': 'odd'},
+                    'backgroundColor': 'rgb(248, 248, 248)'
+                },
+                {
+                    'if': {'filter_query': '{Accepted} = 0'},
+                    'color': 'red'
+                }
+            ],
+            style_header={
+                'backgroundColor': 'rgb(230, 230, 230)',
+                'fontWeight': 'bold'
+            }
+        ),
+    ]
+
+
+def get_failure_sweep_content():
+    return html.Div(
+        id="failure_sweep_div",
+        children=[
+            html.Legend("Failure Sweep"),
+            dbc.Row(
+                children=[
+                    dbc.Col(
+                        dbc.InputGroup([
+                            dbc.InputGroupAddon("Fail",
+                                                addon_type="prepend"),
+                            dbc.Select(
+                                id="failure_sweep_type",
+                                options=[
+                                    {'label': 'Nodes', 'value': 'nodes'},
+                                    {'label': 'Links', 'value': 'links'}],
+                                value='nodes',
+                            ),
+                        ])),
+                    dbc.Col(
+                        dbc.Select(
+                            id="failure_sweep_depth",
+                            options=[{'label': 'N-1', 'value': '1'},
+                                     {'label': 'N-2', 'value': '2'}],
+                            value='1',
+                        )),
+                    dbc.Col(
+                        html.Div(
+                            dbc.Button("Sweep!", id="failure_sweep_submit"))),
+                ]),
+            html.Div(id="failure_sweep_warning"),
+            get_job_components('failure_sweep'),
+            html.Div(id="failure_sweep_table"),
+        ])
+
+
+def get_failure_sweep_table(batfish_df):
+    return dash_table.DataTable(
+        id='failure_sweep_datatable',
+        columns=[{"name": i, "id": i} for i in batfish_df.columns],
+        data=batfish_df.to_dict('records'),
+        filter_action="native",
+        sort_action="native",
+        page_size=25,
+        export_format="csv",
+        style_cell={'fontSize': 12, 'font-family': 'sans-serif',
+                    'textAlign': 'left'},
+        style_data_conditional=[
+            {
+                'if': {'row_index': 'odd'},
+                'backgroundColor': 'rgb(248, 248, 248)'
+            },
+            {
+                'if': {'filter_query': '{Broken_Flows} > 0'},
+                'color': 'red'
+            }
+        ],
+        style_header={
+            'backgroundColor': 'rgb(230, 230, 230)',
+            'fontWeight': 'bold'
+        }
+    )
+
+
 def get_acl_content():
 
     options = [{'label': 'Cisco IOS', 'value': 'cisco'},
@@ -786,6 +1190,7 @@ def get_acl_content():
                 html.Fieldset(
                     id="acl_result_fieldset",
                     children=[html.Legend("Results"),
+                              get_job_components('acl'),
                               html.Div(
                                   id="acl_result_table",
                               ),
@@ -796,6 +1201,47 @@ def get_acl_content():
     )
 
 
-
-
-
+def get_job_components(kind):
+    """
+    Components used to follow a background job of the given kind: the job
+    id, its last polled status, the polling interval and the progress bar.
+    """
+    return html.Div(
+        children=[
+            dcc.Store(id={'type': 'job-store', 'index': kind}),
+            dcc.Store(id={'type': 'job-status', 'index': kind}),
+            dcc.Interval(id={'type': 'job-interval', 'index': kind},
+                         interval=1000,
+                         disabled=True),
+            html.Div(id={'type': 'job-progress', 'index': kind}),
+        ])
+
+
+def get_job_progress(kind, job):
+    if job is None:
+        return None
+    if job.status == 'failed':
+        return dbc.Alert(job.description + " failed: " + job.message,
+                         color="danger")
+    if job.status == 'cancelled':
+        return dbc.Alert(job.description + " cancelled", color="warning")
+    if job.status == 'finished':
+        return dbc.Alert(job.description + " complete", color="success")
+    return dbc.Row(
+        children=[
+            dbc.Col(
+                dbc.Progress(value=job.progress,
+                             children=job.message,
+                             striped=True,
+                             animated=True)),
+            dbc.Col(
+                width=1,
+                children=[
+                    dbc.Button("Cancel",
+                               id={'type': 'job-cancel', 'index': kind},
+                               disabled=job.cancelled,
+                               color="dark",
+                               outline=True,
+                               size="sm"),
+                ]),
+        ])
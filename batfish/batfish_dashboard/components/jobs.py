@@ -0,0 +1,119 @@
+import os
+import threading
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+BATFISH_JOB_WORKERS = int(os.environ.get('BATFISH_JOB_WORKERS', 4))
+BATFISH_JOB_HISTORY = 100
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job():
+    """
+    A long-running Batfish operation executed off the Dash request thread.
+
+    The job function is handed the Job so it can report progress and check
+    for cancellation between steps.
+    """
+
+    def __init__(self, description):
+        self.id = uuid.uuid4().hex
+        self.description = description
+        self.status = 'queued'
+        self.progress = 0
+        self.message = 'Waiting for a free worker'
+        self.result = None
+        self.future = None
+        self._cancelled = threading.Event()
+
+    def set_progress(self, progress, message):
+        self.check_cancelled()
+        self.progress = progress
+        self.message = message
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+    @property
+    def done(self):
+        return self.status in ('finished', 'failed', 'cancelled')
+
+
+class JobQueue():
+    """
+    Runs Jobs on a thread pool and keeps them by id for the pollers.
+
+    Jobs live in the memory of the process that submitted them, so the
+    dashboard has to be served by a single process: a poll handled by
+    another worker process would not find the job. Scale with threads
+    (e.g. gunicorn --workers 1 --threads 8), not with worker processes.
+    """
+
+    def __init__(self, max_workers=BATFISH_JOB_WORKERS,
+                 history=BATFISH_JOB_HISTORY):
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, description, function, *args, **kwargs):
+        job = Job(description)
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [job_id for job_id, old_job in self._jobs.items()
+                        if old_job.done]
+            for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+                del self._jobs[job_id]
+        job.future = self._executor.submit(self._run, job, function, *args,
+                                           **kwargs)
+        return job.id
+
+    @staticmethod
+    def _run(job, function, *args, **kwargs):
+        if job.cancelled:
+            job.status = 'cancelled'
+            job.message = 'Cancelled'
+            return
+        job.status = 'running'
+        try:
+            job.result = function(job, *args, **kwargs)
+        except JobCancelled:
+            job.status = 'cancelled'
+            job.message = 'Cancelled'
+        except Exception as error:
+            traceback.print_exc()
+            job.status = 'failed'
+            job.message = str(error)
+        else:
+            job.status = 'finished'
+            job.progress = 100
+            job.message = 'Done'
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None or job.done:
+            return
+        job.cancel()
+        if job.future is not None and job.future.cancel():
+            job.status = 'cancelled'
+            job.message = 'Cancelled'
+
+
+job_queue = JobQueue()
@@ -20,4 +20,5 @@ external_js = ["https://code.jquery.com/jquery-3.2.1.min.js"]
 
 
 if __name__ == '__main__':
-    app.run_server(host="0.0.0.0", port=8050)
+    # Jobs are kept in this process, see components/jobs.py
+    app.run_server(host="0.0.0.0", port=8050, threaded=True, processes=1)
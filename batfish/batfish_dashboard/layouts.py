@@ -2,6 +2,18 @@ import dash_html_components as html
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
 import dash_daq as daq
+import dash_uploader as du
+from components.functions import get_job_components
+
+SNAPSHOT_UPLOAD_MAX_FILES = 1000
+SNAPSHOT_UPLOAD_MAX_FILE_SIZE = 1024  # MB per file
+
+snapshot_upload_style = dict(
+    margin='10px',
+    width='760px',
+    minHeight='70px',
+    borderRadius='3px',
+)
 
 
 main_page_graph_tab_selected = dict(
@@ -247,103 +259,46 @@ main_page_layout = html.Div(id='main-page', children=[
                                          ),
 
                                 html.Div([
-                                    dcc.Upload(
-                                        className='Snapshot_Upload',
+                                    du.Upload(
                                         id='device-configs-upload-data',
-                                        children=html.Div(
-                                            className='inside_drag_and_drop',
-                                            children= [
-                                            html.P(
-                                                className="upload_p",
-                                                children=[
-                                                    html.H3("Device Configurations"),
-                                                    'Drag and Drop or ',
-                                                    html.A('Select Files')
-                                                ],
-                                            ),
-                                        ]),
-                                        # Allow multiple files to be uploaded
-                                        multiple=True
+                                        text='Device Configurations: Drag and Drop or Select Files',
+                                        max_files=SNAPSHOT_UPLOAD_MAX_FILES,
+                                        max_file_size=SNAPSHOT_UPLOAD_MAX_FILE_SIZE,
+                                        default_style=snapshot_upload_style,
                                     ),
-                                    dcc.Upload(
-                                        className='Snapshot_Upload',
+                                    du.Upload(
                                         id='host-configs-upload-data',
-                                        children=html.Div(
-                                            className='inside_drag_and_drop',
-                                            children=[
-                                                html.P(
-                                                    className="upload_p",
-                                                    children=[
-                                                        html.H3(
-                                                            "Host Configurations"),
-                                                        'Drag and Drop or ',
-                                                        html.A('Select Files')
-                                                    ],
-                                                ),
-                                            ]),
-                                        # Allow multiple files to be uploaded
-                                        multiple=True
+                                        text='Host Configurations: Drag and Drop or Select Files',
+                                        max_files=SNAPSHOT_UPLOAD_MAX_FILES,
+                                        max_file_size=SNAPSHOT_UPLOAD_MAX_FILE_SIZE,
+                                        default_style=snapshot_upload_style,
                                     ),
-                                    dcc.Upload(
-                                        className='Snapshot_Upload',
+                                    du.Upload(
                                         id='iptables-configs-upload-data',
-                                        children=html.Div(
-                                            className='inside_drag_and_drop',
-                                            children=[
-                                                html.P(
-                                                    className="upload_p",
-                                                    children=[
-                                                        html.H3(
-                                                            "IP Table Configurations"),
-                                                        'Drag and Drop or ',
-                                                        html.A('Select Files')
-                                                    ],
-                                                ),
-                                            ]),
-                                        # Allow multiple files to be uploaded
-                                        multiple=True
+                                        text='IP Table Configurations: Drag and Drop or Select Files',
+                                        max_files=SNAPSHOT_UPLOAD_MAX_FILES,
+                                        max_file_size=SNAPSHOT_UPLOAD_MAX_FILE_SIZE,
+                                        default_style=snapshot_upload_style,
                                     ),
-                                    dcc.Upload(
-                                        className='Snapshot_Upload',
+                                    du.Upload(
                                         id='aws-configs-upload-data',
-                                        children=html.Div(
-                                            className='inside_drag_and_drop',
-                                            children=[
-                                                html.P(
-                                                    className="upload_p",
-                                                    children=[
-                                                        html.H3(
-                                                            "AWS Configurations"),
-                                                        'Drag and Drop or ',
-                                                        html.A('Select Files')
-                                                    ],
-                                                ),
-                                            ]),
-                                        # Allow multiple files to be uploaded
-                                        multiple=True
+                                        text='AWS Configurations: Drag and Drop or Select Files',
+                                        max_files=SNAPSHOT_UPLOAD_MAX_FILES,
+                                        max_file_size=SNAPSHOT_UPLOAD_MAX_FILE_SIZE,
+                                        default_style=snapshot_upload_style,
                                     ),
-                                    dcc.Upload(
-                                        className='Snapshot_Upload',
+                                    du.Upload(
                                         id='misc-configs-upload-data',
-                                        children=html.Div(
-                                            className='inside_drag_and_drop',
-                                            children=[
-                                                html.P(
-                                                    className="upload_p",
-                                                    children=[
-                                                        html.H3(
-                                                            "Miscellaneous Configurations"),
-                                                        'Drag and Drop or ',
-                                                        html.A('Select Files')
-                                                    ],
-                                                ),
-                                            ]),
-                                        # Allow multiple files to be uploaded
-                                        multiple=True
+                                        text='Miscellaneous Configurations: Drag and Drop or Select Files',
+                                        max_files=SNAPSHOT_UPLOAD_MAX_FILES,
+                                        max_file_size=SNAPSHOT_UPLOAD_MAX_FILE_SIZE,
+                                        default_style=snapshot_upload_style,
                                     ),
 
 
                                     html.Div(id='output-data-upload'),
+                                    dcc.Store(id='snapshot-upload-id'),
+                                    get_job_components('create_snapshot'),
                                 ]),
                             ],
 
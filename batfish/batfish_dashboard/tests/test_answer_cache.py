@@ -0,0 +1,90 @@
+import shutil
+import tempfile
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+
+import pandas as pd
+
+from components import batfish as batfish_module
+from components.batfish import AnswerCache, Batfish
+
+
+class FakeSession():
+
+    def __init__(self, snapshots):
+        self.snapshots = snapshots
+        self.listings = 0
+
+    def list_snapshots(self, verbose=False):
+        self.listings += 1
+        return self.snapshots
+
+
+class SnapshotIdentityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = AnswerCache(cache_dir=self.cache_dir)
+        patcher = mock.patch.object(batfish_module, 'answer_cache',
+                                    self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+
+    def get_batfish(self, snapshots):
+        bf = FakeSession(snapshots)
+
+        @contextmanager
+        def session():
+            yield bf
+
+        batfish = Batfish.__new__(Batfish)
+        batfish.batfish_host = 'batfish'
+        batfish.network = 'network'
+        batfish.snapshot = None
+        batfish.session = session
+        return batfish, bf
+
+    def test_reads_the_nested_creation_timestamp(self):
+        batfish, bf = self.get_batfish([
+            {'name': 'other',
+             'metadata': {'creationTimestamp': '2020-01-01T00:00:00Z'}},
+            {'name': 'snapshot',
+             'metadata': {'creationTimestamp': '2020-05-04T10:00:00Z'}},
+        ])
+        self.assertEqual(batfish.snapshot_identity('snapshot'),
+                         '2020-05-04T10:00:00Z')
+        # looked up once per snapshot
+        batfish.snapshot_identity('snapshot')
+        self.assertEqual(bf.listings, 1)
+
+    def test_unknown_snapshot_is_kept_in_memory_only(self):
+        batfish, bf = self.get_batfish([{'name': 'snapshot'}])
+        self.assertIsNone(batfish.snapshot_identity('snapshot'))
+        batfish.snapshot_identity('snapshot')
+        self.assertEqual(bf.listings, 1)
+
+    def test_recreated_snapshot_is_not_answered_from_disk(self):
+        scope = ('batfish', 'network', 'snapshot')
+        frame = pd.DataFrame({'Node': ['leaf1']})
+        self.cache.put(scope, 'key', frame, identity='created-1')
+
+        restarted = AnswerCache(cache_dir=self.cache_dir)
+        pd.testing.assert_frame_equal(
+            restarted.get(scope, 'key', identity='created-1'), frame)
+        self.assertIsNone(restarted.get(scope, 'key', identity='created-2'))
+        self.assertIsNone(restarted.get(scope, 'key'))
+
+
+class AnswerCacheEvictionTest(unittest.TestCase):
+
+    def test_eviction_drops_the_key_from_its_scope(self):
+        cache = AnswerCache(max_entries=1)
+        cache.put(('host', 'network', 'a'), 'key-a', pd.DataFrame())
+        cache.put(('host', 'network', 'b'), 'key-b', pd.DataFrame())
+        self.assertEqual(cache._scopes, {('host', 'network', 'b'): {'key-b'}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from components import batfish as batfish_module
+from components.batfish import Batfish, count_combinations
+
+
+class FailureScenarioTest(unittest.TestCase):
+
+    def get_batfish(self, node_count):
+        batfish = Batfish.__new__(Batfish)
+        nodes = pd.DataFrame({'Node': ['leaf{}'.format(i)
+                                       for i in range(node_count)]})
+        batfish.answer = mock.Mock(return_value=nodes)
+        return batfish
+
+    def test_count_combinations(self):
+        self.assertEqual(count_combinations(200, 2), 19900)
+        self.assertEqual(count_combinations(3, 1), 3)
+        self.assertEqual(count_combinations(1, 2), 0)
+
+    def test_scenarios_within_the_limit(self):
+        batfish = self.get_batfish(4)
+        self.assertEqual(batfish.count_failure_scenarios('s', 'nodes', 2), 6)
+        scenarios = batfish.get_failure_scenarios('s', 'nodes', 2)
+        self.assertEqual(len(scenarios), 6)
+        self.assertEqual(scenarios[0]['nodes'], ['leaf0', 'leaf1'])
+
+    def test_too_many_scenarios_are_refused(self):
+        batfish = self.get_batfish(40)
+        with mock.patch.object(batfish_module, 'BATFISH_MAX_SCENARIOS', 100):
+            with self.assertRaises(ValueError):
+                batfish.get_failure_scenarios('s', 'nodes', 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
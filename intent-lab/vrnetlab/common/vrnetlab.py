@@ -1,17 +1,30 @@
 #!/usr/bin/env python3
 
+import codecs
+import ctypes
 import datetime
+import fcntl
+import functools
+import hashlib
 import ipaddress
 import json
 import logging
 import math
 import os
+import queue
 import random
 import re
+import selectors
+import shutil
+import socket
+import struct
 import subprocess
 import sys
 import telnetlib
+import threading
 import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
 try:
@@ -21,8 +34,87 @@ except ImportError:
 
 MAX_RETRIES = 60
 
+# backoff between connection attempts to the qemu monitor and serial ports,
+# MAX_RETRIES seconds remain the overall budget
+CONNECT_BACKOFF_MIN = 0.01
+CONNECT_BACKOFF_MAX = 1.0
+
+# unix socket of the QMP (JSON) control channel of each VM
+QMP_SOCKET = "/tmp/vrnetlab-qmp-{num}.sock"
+QMP_TIMEOUT = 30
+
+# netlink constants used to learn about data plane interfaces appearing
+RTMGRP_LINK = 0x1
+RTM_NEWLINK = 16
+IFLA_IFNAME = 3
+NLMSG_HEADER = struct.Struct("IHHII")
+IFINFOMSG = struct.Struct("BxHiII")
+RTATTR_HEADER = struct.Struct("HH")
+
+# file-based signalling backdoor to trigger a system reset of the VMs
+RESET_FILE = "/reset"
+
+# bytes of qemu stdout/stderr kept for logging when the process exits
+QEMU_OUTPUT_LIMIT = 65536
+# seconds qemu gets to exit after SIGTERM, and after SIGKILL, when stopping
+QEMU_STOP_TIMEOUT = 10
+
 DEFAULT_SCRAPLI_TIMEOUT = 900
 
+# bytes read from the console socket per recv(), telnetlib defaults to 50
+CONSOLE_READ_SIZE = 4096
+
+# characters of already searched console output kept around so that a prompt
+# split across two reads still matches
+CONSOLE_MATCH_WINDOW = 4096
+
+# boot metrics in Prometheus text format, written to a textfile collector
+# directory and/or served over HTTP on the given port
+METRICS_TEXTFILE_DIR = os.environ.get("METRICS_TEXTFILE_DIR")
+METRICS_PORT = os.environ.get("METRICS_PORT")
+
+# boot phases in the order they are normally reached
+BOOT_PHASES = [
+    "qemu_spawn",
+    "monitor_connect",
+    "serial_connect",
+    "first_console_byte",
+    "login_prompt",
+    "config_push",
+    "running",
+]
+
+# host-wide boot scheduler: a directory shared by all nodes of a lab holding
+# the boot token lock files, and the number of tokens (weight units)
+BOOT_SCHEDULER_DIR = os.environ.get("BOOT_SCHEDULER_DIR")
+BOOT_SCHEDULER_CAPACITY = int(
+    os.environ.get("BOOT_SCHEDULER_CAPACITY", os.cpu_count() or 1)
+)
+# RAM (MB) that counts as one weight unit
+BOOT_SCHEDULER_RAM_UNIT = 4096
+
+# host-level cache of base images (<sha256 or id key><ext>), only used when a
+# host directory shared by all nodes is bind-mounted there
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", "/images")
+# index of image metadata (format, size) so qemu-img info only runs once per
+# image, kept in the bind-mounted cache directory so all nodes share it
+IMAGE_INDEX_PATH = os.environ.get(
+    "IMAGE_INDEX_PATH", os.path.join(IMAGE_CACHE_DIR, ".image-index.json")
+)
+
+# where warm image state (post-bootstrap disk + saved VM state) is kept,
+# should be a volume shared between nodes and container restarts
+WARM_IMAGE_DIR = os.environ.get("WARM_IMAGE_DIR", "/warm")
+WARM_IMAGE_SAVE_TIMEOUT = 600
+# seconds a restore may take to reach the running state before booting cold
+WARM_IMAGE_RESTORE_TIMEOUT = 300
+
+# how often the VR supervisor refreshes the health file and checks for /reset
+VR_SUPERVISOR_INTERVAL = 1
+# minimum length of an idle bootstrap spin; the platforms' restart limits
+# (spins > 300 etc.) assume spins of about a second
+BOOT_SPIN_INTERVAL = 1
+
 # set fancy logging colours
 logging.addLevelName(
     logging.INFO, f"\x1b[1;32m\t{logging.getLevelName(logging.INFO)}\x1b[0m"
@@ -80,17 +172,677 @@ def boot_delay():
         time.sleep(int(delay))
 
 
+class Deadline:
+    """A wall-clock deadline, used in place of counting loop iterations.
+
+    A timeout of None never expires.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.expires = None if timeout is None else time.monotonic() + timeout
+
+    def remaining(self):
+        """Seconds left until the deadline (never negative), None if unbounded"""
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.expires is not None and time.monotonic() >= self.expires
+
+
+class StreamMatcher:
+    """Match regex patterns incrementally against a stream of console output.
+
+    Only a bounded window of previous output plus the new chunk is searched
+    on every feed(), so matching cost stays linear in the amount of output
+    instead of re-searching everything read so far. Bytes are decoded with an
+    incremental UTF-8 decoder, so a multi-byte character split across reads
+    is decoded correctly.
+    """
+
+    def __init__(self, patterns, window=CONSOLE_MATCH_WINDOW):
+        self.patterns = [
+            re.compile(p.decode() if isinstance(p, bytes) else p) for p in patterns
+        ]
+        self.window = window
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.text = ""
+
+    def feed(self, chunk):
+        """Add a chunk of bytes, return (index, match) of the first matching
+        pattern or (-1, None)."""
+        self.text += self.decoder.decode(chunk)
+        for i, pattern in enumerate(self.patterns):
+            match = pattern.search(self.text)
+            if match:
+                self.text = self.text[match.end() :]
+                return i, match
+        self.text = self.text[-self.window :]
+        return -1, None
+
+
+class ConsoleTelnet(telnetlib.Telnet):
+    """telnetlib.Telnet that reads in larger chunks and records console activity.
+
+    The stock fill_rawq() calls recv(50), which means one syscall per 50
+    bytes of boot output.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.bytes_read = 0
+        self.first_activity = None
+        self.last_activity = time.monotonic()
+        super().__init__(*args, **kwargs)
+
+    def fill_rawq(self):
+        if self.irawq >= len(self.rawq):
+            self.rawq = b""
+            self.irawq = 0
+        buf = self.sock.recv(CONSOLE_READ_SIZE)
+        self.msg("recv %r", buf)
+        self.eof = not buf
+        self.rawq = self.rawq + buf
+        if buf:
+            self.bytes_read += len(buf)
+            self.last_activity = time.monotonic()
+            if self.first_activity is None:
+                self.first_activity = self.last_activity
+
+    def buffered(self) -> bool:
+        """Whether data was already received but not consumed yet"""
+        return bool(self.cookedq) or self.irawq < len(self.rawq)
+
+
+class ConsoleMux:
+    """Wait for bytes on a set of named sockets (serial console, qemu monitor).
+
+    Wraps a selectors.DefaultSelector (epoll on Linux) so that callers sleep
+    in the kernel until data arrives or their deadline passes, instead of
+    polling the sockets in a loop.
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+
+    def register(self, name, sock):
+        self.unregister(name)
+        if sock is not None:
+            self.selector.register(sock, selectors.EVENT_READ, name)
+
+    def unregister(self, name):
+        for key in list(self.selector.get_map().values()):
+            if key.data == name:
+                self.selector.unregister(key.fileobj)
+
+    def wait(self, deadline):
+        """Return the names of the sockets that are readable before the deadline"""
+        if not self.selector.get_map():
+            # nothing to wait on, just honour the deadline
+            time.sleep(deadline.remaining() or 0)
+            return set()
+        try:
+            events = self.selector.select(deadline.remaining())
+        except (OSError, ValueError):
+            # a socket was closed underneath us, report everything as readable
+            # so that the caller's read raises the actual error
+            return {key.data for key in self.selector.get_map().values()}
+        return {key.data for key, _ in events}
+
+    def close(self):
+        self.selector.close()
+
+
+class QMPClient:
+    """Client for the QEMU Machine Protocol (QMP) over a unix socket.
+
+    A reader thread dispatches command responses by id and asynchronous
+    events (RESET, SHUTDOWN, STOP, ...) to subscribed callbacks, so
+    commands can be issued from any thread and nothing has to poll qemu.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.logger = logging.getLogger()
+        self.sock = None
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.pending = {}
+        self.subscribers = []
+        self.closed = False
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        self.sock = sock
+        self.reader = sock.makefile("rb")
+        greeting = json.loads(self.reader.readline() or b"{}")
+        if "QMP" not in greeting:
+            raise QMPError(f"unexpected QMP greeting: {greeting}")
+        threading.Thread(
+            target=self._read_loop, name=f"qmp-{self.path}", daemon=True
+        ).start()
+        self.execute("qmp_capabilities")
+        return self
+
+    def subscribe(self, events, callback):
+        """Call callback(event) for QMP events whose name is in events"""
+        self.subscribers.append((set(events), callback))
+
+    def _read_loop(self):
+        try:
+            for line in self.reader:
+                message = json.loads(line)
+                if "event" in message:
+                    for events, callback in self.subscribers:
+                        if message["event"] in events:
+                            try:
+                                callback(message)
+                            except Exception as e:
+                                self.logger.error(f"QMP event handler failed: {e}")
+                    continue
+                with self.lock:
+                    waiter = self.pending.pop(message.get("id"), None)
+                if waiter is not None:
+                    waiter["response"] = message
+                    waiter["done"].set()
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.closed = True
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            for waiter in pending.values():
+                waiter["done"].set()
+
+    def _send(self, command, arguments=None):
+        with self.lock:
+            if self.closed:
+                raise QMPError("QMP connection is closed")
+            self.next_id += 1
+            waiter = {"done": threading.Event(), "response": None}
+            self.pending[self.next_id] = waiter
+            message = {"execute": command, "id": self.next_id}
+            if arguments:
+                message["arguments"] = arguments
+            self.sock.sendall(json.dumps(message).encode() + b"\n")
+        return command, waiter
+
+    @staticmethod
+    def _result(command, waiter, deadline):
+        if not waiter["done"].wait(deadline.remaining()):
+            raise QMPError(f"timeout waiting for QMP {command}")
+        response = waiter["response"]
+        if response is None:
+            raise QMPError(f"QMP connection closed during {command}")
+        if "error" in response:
+            raise QMPError(f"QMP {command} failed: {response['error'].get('desc')}")
+        return response.get("return")
+
+    def execute(self, command, arguments=None, timeout=QMP_TIMEOUT):
+        """Run a QMP command and return its result"""
+        return self._result(*self._send(command, arguments), Deadline(timeout))
+
+    def execute_batch(self, commands, timeout=QMP_TIMEOUT):
+        """Send several (command, arguments) pairs at once, then wait for all.
+
+        Returns the results in order, raises on the first failed command.
+        """
+        sent = [self._send(command, arguments) for command, arguments in commands]
+        deadline = Deadline(timeout)
+        return [self._result(command, waiter, deadline) for command, waiter in sent]
+
+    def close(self):
+        self.closed = True
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+
+
+class ResetWatcher:
+    """Watch for the /reset signalling file and call back when it is written.
+
+    Uses inotify on the parent directory so nothing has to stat the file
+    in a loop, falling back to polling where inotify is not available.
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, path, callback):
+        self.path = path
+        self.callback = callback
+        self.logger = logging.getLogger()
+
+    def start(self):
+        # a reset requested before we started watching
+        if os.path.exists(self.path):
+            self.callback()
+        threading.Thread(target=self._watch, name="reset-watcher", daemon=True).start()
+
+    def _inotify_fd(self):
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(0)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        directory = os.path.dirname(self.path) or "."
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+        if libc.inotify_add_watch(fd, directory.encode(), mask) < 0:
+            os.close(fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+        return fd
+
+    def _watch(self):
+        name = os.path.basename(self.path).encode()
+        try:
+            fd = self._inotify_fd()
+        except (OSError, AttributeError) as e:
+            self.logger.debug(f"inotify not available ({e}), polling {self.path}")
+            while True:
+                time.sleep(VR_SUPERVISOR_INTERVAL)
+                if os.path.exists(self.path):
+                    self.callback()
+
+        while True:
+            data = os.read(fd, 4096)
+            offset = 0
+            triggered = False
+            while offset < len(data):
+                _, _, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                event_name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                triggered = triggered or event_name == name
+            if triggered and os.path.exists(self.path):
+                self.callback()
+
+
+def netlink_new_links(data):
+    """Yield the interface names of the RTM_NEWLINK messages in a netlink read"""
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(data):
+        msg_len, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+        if msg_len < NLMSG_HEADER.size:
+            break
+        if msg_type == RTM_NEWLINK:
+            attr = offset + NLMSG_HEADER.size + IFINFOMSG.size
+            end = offset + msg_len
+            while attr + RTATTR_HEADER.size <= end:
+                attr_len, attr_type = RTATTR_HEADER.unpack_from(data, attr)
+                if attr_len < RTATTR_HEADER.size:
+                    break
+                if attr_type == IFLA_IFNAME:
+                    value = data[attr + RTATTR_HEADER.size : attr + attr_len]
+                    yield value.rstrip(b"\0").decode()
+                    break
+                attr += (attr_len + 3) & ~3
+        offset += (msg_len + 3) & ~3
+
+
+class BootMetrics:
+    """Boot phase timings and counters of a single VM.
+
+    Phase times are seconds since the start of the current boot attempt and
+    are reset whenever qemu is (re)started; counters accumulate over the
+    lifetime of the container.
+    """
+
+    def __init__(self):
+        self.boot_start = time.monotonic()
+        self.phases = OrderedDict()
+        self.spins = 0
+        self.restarts = 0
+        self.console_bytes = 0
+
+    def reset(self):
+        self.boot_start = time.monotonic()
+        self.phases.clear()
+
+    def mark(self, phase, when=None):
+        """Record the first time a phase is reached in this boot attempt"""
+        if phase not in self.phases:
+            when = time.monotonic() if when is None else when
+            self.phases[phase] = max(0.0, when - self.boot_start)
+
+
+def render_metrics(vms) -> str:
+    """Render the metrics of the given VMs in Prometheus text format"""
+    node = socket.gethostname()
+    lines = [
+        "# HELP vrnetlab_boot_phase_seconds Seconds from qemu start until a boot phase was reached.",
+        "# TYPE vrnetlab_boot_phase_seconds gauge",
+    ]
+    for vm in vms:
+        for phase, seconds in vm.metrics.phases.items():
+            lines.append(
+                f'vrnetlab_boot_phase_seconds{{node="{node}",vm="{vm}",num="{vm.num}",phase="{phase}"}} {seconds:.3f}'
+            )
+    counters = [
+        ("vrnetlab_bootstrap_spins_total", "Calls to bootstrap_spin.", "spins"),
+        ("vrnetlab_qemu_restarts_total", "Times qemu was restarted.", "restarts"),
+        ("vrnetlab_console_bytes_read_total", "Bytes read from the serial console.", "console_bytes"),
+    ]
+    for name, help_text, attr in counters:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for vm in vms:
+            lines.append(
+                f'{name}{{node="{node}",vm="{vm}",num="{vm.num}"}} {getattr(vm.metrics, attr)}'
+            )
+    lines.append("# HELP vrnetlab_vm_running Whether the VM finished bootstrapping.")
+    lines.append("# TYPE vrnetlab_vm_running gauge")
+    for vm in vms:
+        lines.append(
+            f'vrnetlab_vm_running{{node="{node}",vm="{vm}",num="{vm.num}"}} {int(vm.running)}'
+        )
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Expose the boot metrics of a VR's VMs to Prometheus.
+
+    Writes a node_exporter textfile collector file when METRICS_TEXTFILE_DIR
+    is set and serves /metrics on METRICS_PORT when that is set.
+    """
+
+    def __init__(self, vms, textfile_dir=METRICS_TEXTFILE_DIR, port=METRICS_PORT):
+        self.vms = vms
+        self.logger = logging.getLogger()
+        self.textfile = None
+        self.last_text = None
+        if textfile_dir:
+            os.makedirs(textfile_dir, exist_ok=True)
+            self.textfile = os.path.join(
+                textfile_dir, f"vrnetlab-{socket.gethostname()}.prom"
+            )
+        if port:
+            self.serve(int(port))
+
+    def serve(self, port):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = render_metrics(exporter.vms).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.logger.info(f"Serving boot metrics on :{port}/metrics")
+
+    def update(self):
+        """Rewrite the textfile if any metric changed"""
+        if not self.textfile:
+            return
+        text = render_metrics(self.vms)
+        if text == self.last_text:
+            return
+        tmp = self.textfile + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                f.write(text)
+            os.replace(tmp, self.textfile)
+            self.last_text = text
+        except OSError as e:
+            self.logger.error(f"Failed to write metrics textfile: {e}")
+
+
+class BootScheduler:
+    """Host-wide token bucket limiting how many heavy VM boots run at once.
+
+    Tokens are lock files in a directory shared between the containers of a
+    lab. A booting VM holds flock()s on as many token files as its weight,
+    derived from its RAM and vCPUs, until it reaches the running state.
+    Locks are dropped by the kernel if the process dies, so a crashed node
+    never leaks tokens. Waiters line up on a turn lock and only the one
+    holding it takes tokens, all at once, so light VMs cannot keep a heavy
+    one waiting. A waiter never holds tokens, and a VR takes the tokens of
+    all its VMs in one go, so whoever holds tokens never waits for the turn.
+    """
+
+    def __init__(self, directory=BOOT_SCHEDULER_DIR, capacity=BOOT_SCHEDULER_CAPACITY):
+        self.directory = directory
+        self.capacity = max(1, capacity)
+        self.logger = logging.getLogger()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def weight(self, ram, smp) -> int:
+        """Number of tokens a VM with ram MB and the given -smp value needs"""
+        match = re.match(r"\d+", str(smp))
+        cpus = int(match.group()) if match else 1
+        units = max(cpus, math.ceil(int(ram) / BOOT_SCHEDULER_RAM_UNIT), 1)
+        return min(units, self.capacity)
+
+    def _open(self, name):
+        return os.open(os.path.join(self.directory, name), os.O_RDWR | os.O_CREAT, 0o666)
+
+    def _try_acquire(self, weight):
+        """Take weight free tokens, or none if there are not enough"""
+        tokens = []
+        try:
+            for i in range(self.capacity):
+                if len(tokens) == weight:
+                    break
+                fd = self._open(f"token-{i}.lock")
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(fd)
+                    continue
+                tokens.append(fd)
+        except BaseException:
+            self.release(tokens)
+            raise
+        if len(tokens) < weight:
+            self.release(tokens)
+            return []
+        return tokens
+
+    def acquire(self, weight):
+        """Block until weight tokens are held, return them as a list of fds"""
+        os.makedirs(self.directory, exist_ok=True)
+        weight = min(max(1, weight), self.capacity)
+        turn_fd = self._open("turn.lock")
+        try:
+            # wait behind the waiters that came first
+            fcntl.flock(turn_fd, fcntl.LOCK_EX)
+            while True:
+                tokens = self._try_acquire(weight)
+                if tokens:
+                    return tokens
+                time.sleep(0.5)
+        finally:
+            os.close(turn_fd)
+
+    def release(self, tokens):
+        for fd in tokens:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+boot_scheduler = BootScheduler()
+
+
+class BootGrant:
+    """Boot tokens acquired once for all VMs of a VR.
+
+    The VMs of a distributed platform often only come up together, so
+    they are admitted as one boot. The tokens go back to the scheduler when
+    the last of them is running.
+    """
+
+    def __init__(self, tokens, holders):
+        self.tokens = tokens
+        self.holders = set(holders)
+        self.lock = threading.Lock()
+
+    def release(self, holder):
+        with self.lock:
+            self.holders.discard(holder)
+            if self.holders or not self.tokens:
+                return
+            tokens, self.tokens = self.tokens, []
+        boot_scheduler.release(tokens)
+
+
+class ImageCache:
+    """Metadata index and shared store for base disk images.
+
+    Metadata is keyed by (path, size, mtime) so it is invalidated whenever an
+    image changes. A base image found in the shared cache directory is used
+    as the backing file of a node's overlay instead of the node's own copy,
+    so all nodes running the same image read the same file on the host.
+    Images are never hashed at startup: the shared copy is named after the
+    <image>.sha256 written at build time, or after the image's name, size
+    and mtime, which docker keeps identical in every container of an image.
+    The cache is only used when cache_dir is a mount point, so an image is
+    never copied into the container's own layer.
+    """
+
+    def __init__(self, cache_dir=IMAGE_CACHE_DIR, index_path=IMAGE_INDEX_PATH):
+        self.cache_dir = cache_dir
+        self.index_path = index_path
+        self.logger = logging.getLogger()
+        self.lock = threading.Lock()
+        try:
+            with open(index_path) as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def _key(self, path):
+        st = os.stat(path)
+        return f"{os.path.realpath(path)}:{st.st_size}:{st.st_mtime_ns}"
+
+    @property
+    def shared(self) -> bool:
+        """Whether the cache directory is a host directory mounted into the node"""
+        return os.path.ismount(self.cache_dir)
+
+    def _save_index(self):
+        # the index directory is never created here, a missing one means
+        # there is no shared cache to keep the index in
+        if not os.path.isdir(os.path.dirname(self.index_path)):
+            return
+        try:
+            tmp = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.index, f)
+            os.replace(tmp, self.index_path)
+        except OSError as e:
+            # not fatal, the metadata is simply looked up again next start
+            self.logger.debug(f"Could not save image index: {e}")
+
+    def info(self, path) -> dict:
+        """Return the cached `qemu-img info` of an image"""
+        key = self._key(path)
+        with self.lock:
+            entry = self.index.setdefault(key, {})
+            if "format" not in entry:
+                res = run_command(["qemu-img", "info", "--output", "json", path])
+                if res is None:
+                    raise ValueError(f"Could not read image format for {path}")
+                image_info = json.loads(res[0])
+                if "format" not in image_info:
+                    raise ValueError(f"Could not read image format for {path}")
+                entry["format"] = image_info["format"]
+                entry["virtual_size"] = image_info.get("virtual-size")
+                self._save_index()
+            return entry
+
+    def cache_key(self, path) -> str:
+        """Return the name of an image in the shared cache, without its extension.
+
+        The sha256 from the `<image>.sha256` file made at build time when
+        present, otherwise a key derived from the image name, size and mtime.
+        """
+        sidecar = path + ".sha256"
+        if os.path.exists(sidecar):
+            with open(sidecar) as f:
+                return f.read().split()[0]
+        st = os.stat(path)
+        identity = f"{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns}"
+        return "id-" + hashlib.sha256(identity.encode()).hexdigest()
+
+    def resolve(self, path) -> str:
+        """Return the shared copy of an image if the cache has one, else path.
+
+        If the cache directory is writable and does not have the image yet,
+        it is published there for the next nodes. Publishing holds an flock()
+        on <image>.lock, so one node copies the image while the others wait
+        for it and then use the copy.
+        """
+        if not self.shared:
+            return path
+        ext = os.path.splitext(path)[1]
+        shared = os.path.join(self.cache_dir, self.cache_key(path) + ext)
+        if os.path.exists(shared):
+            self.logger.info(f"Using shared base image {shared}")
+            return shared
+        if not os.access(self.cache_dir, os.W_OK):
+            return path
+        tmp = f"{shared}.{os.getpid()}.tmp"
+        try:
+            with open(os.path.splitext(shared)[0] + ".lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if os.path.exists(shared):
+                    self.logger.info(f"Using shared base image {shared}")
+                    return shared
+                self.logger.info(f"Publishing {path} to the image cache as {shared}")
+                shutil.copyfile(path, tmp)
+                os.chmod(tmp, 0o444)
+                os.replace(tmp, shared)
+                return shared
+        except OSError as e:
+            self.logger.warning(f"Could not publish image to cache: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return path
+
+
+image_cache = ImageCache()
+
+
 class VM:
     def __str__(self):
         return self.__class__.__name__
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # time the config push of platforms that have a bootstrap_config()
+        if "bootstrap_config" in cls.__dict__:
+            bootstrap_config = cls.__dict__["bootstrap_config"]
+
+            @functools.wraps(bootstrap_config)
+            def timed_bootstrap_config(self, *args, **kwargs):
+                self.metrics.mark("config_push")
+                return bootstrap_config(self, *args, **kwargs)
+
+            cls.bootstrap_config = timed_bootstrap_config
+
     def _overlay_disk_image_format(self) -> str:
-        res = run_command(["qemu-img", "info", "--output", "json", self.image])
-        if res is not None:
-            image_info = json.loads(res[0])
-            if "format" in image_info:
-                return image_info["format"]
-        raise ValueError(f"Could not read image format for {self.image}")
+        return image_cache.info(self.base_image)["format"]
 
     def __init__(
         self,
@@ -163,11 +915,48 @@ class VM:
 
         self.num = num
         self.image = disk_image
+        # the file actually backing the overlay, a shared copy if cached
+        self.base_image = image_cache.resolve(disk_image) if disk_image else ""
 
         self.running = False
         self.spins = 0
         self.p = None
         self.tn = None
+        self.qm = None
+        self.qmp = None
+        self.qmp_socket = QMP_SOCKET.format(num=num)
+        self.console_mux = None
+        # wall-clock time of the last byte read from the serial console
+        self.last_console_activity = time.monotonic()
+        # restart the VM if the console stays silent for this many seconds
+        # while bootstrapping, on top of the per-platform spin limits
+        stall_timeout = os.environ.get("CONSOLE_STALL_TIMEOUT")
+        self.console_stall_timeout = int(stall_timeout) if stall_timeout else None
+
+        self.metrics = BootMetrics()
+
+        # boot scheduler tokens held while this VM boots, or the grant shared
+        # with the other VMs of its VR
+        self.boot_tokens = []
+        self.boot_grant = None
+        self.boot_token_time = None
+
+        # Warm image mode: after the first successful bootstrap the VM state is
+        # saved, later starts with the same image and bootstrap inputs restore
+        # it instead of booting and bootstrapping again.
+        self.warm_image = os.environ.get("WARM_IMAGE", "").lower() == "true"
+        if self.warm_image and type(self).apply_warm_delta is VM.apply_warm_delta:
+            # a restored node would keep the hostname, config and MACs of
+            # the node that saved the image
+            self.logger.warning(
+                f"{self.__class__.__name__} does not implement apply_warm_delta(), "
+                "ignoring WARM_IMAGE"
+            )
+            self.warm_image = False
+        # None, "restoring" (qemu started from saved state) or "restored"
+        self.warm_state = None
+        self.warm_restore_attempted = False
+        self.warm_restore_deadline = None
 
         self._ram = ram
         self._cpu = cpu
@@ -184,6 +973,15 @@ class VM:
         # "highest" provisioned nic num -- used for making sure we can allocate nics without needing
         # to have them allocated sequential from eth1
         self.highest_provisioned_nic_num = 0
+        # Hot-plug mode: boot with the data plane interfaces that already exist
+        # and hot-add the rest through QMP as containerlab wires them up,
+        # instead of waiting for all of them before starting qemu.
+        self.nic_hotplug = os.environ.get("NIC_HOTPLUG", "").lower() == "true"
+        # whether gen_nics() left interfaces to be hot-plugged in this boot
+        self.nic_hotplug_active = False
+        self.plugged_nics = set()
+        self.nic_hotplug_lock = threading.Lock()
+        self.nic_watcher = None
 
         # Whether the management interface is pass-through or host-forwarded.
         # Host-forwarded is the original vrnetlab mode where a VM gets a static IP for its management address,
@@ -263,6 +1061,7 @@ class VM:
             tokens = overlay_disk_image.split(".")
             tokens[0] = tokens[0] + "-" + self.role + str(self.num)
             overlay_disk_image = ".".join(tokens)
+        self.overlay_disk_image = overlay_disk_image
 
         if not os.path.exists(overlay_disk_image):
             self.logger.debug(
@@ -278,7 +1077,7 @@ class VM:
                     "-F",
                     self._overlay_disk_image_format(),
                     "-b",
-                    disk_image,
+                    self.base_image,
                     overlay_disk_image,
                 ]
             )
@@ -293,6 +1092,8 @@ class VM:
             f"tcp:0.0.0.0:40{self.num:02d},server,nowait",
             "-serial",
             f"telnet:0.0.0.0:50{self.num:02d},server,nowait",
+            "-qmp",
+            f"unix:{self.qmp_socket},server,nowait",
             "-m",  # memory
             str(self.ram),
             "-cpu",  # cpu type
@@ -334,6 +1135,10 @@ class VM:
         self.logger.info(f"Transparent mgmt interface: {mgmt_passthrough_coloured}")
 
         self.start_time = datetime.datetime.now()
+        if self.p is not None:
+            self.metrics.restarts += 1
+        self.metrics.reset()
+        self.console_bytes_seen = 0
 
         cmd = list(self.qemu_args)
 
@@ -364,8 +1169,16 @@ class VM:
         if self.insuffucient_nics:
             cmd.extend(self.gen_dummy_nics())
 
+        if self.warm_image:
+            cmd.extend(self.warm_image_args(cmd))
+
         self.logger.debug("qemu cmd: {}".format(" ".join(cmd)))
 
+        self.acquire_boot_tokens()
+
+        if os.path.exists(self.qmp_socket):
+            os.remove(self.qmp_socket)
+
         self.p = subprocess.Popen(
             " ".join(cmd),
             stdout=subprocess.PIPE,
@@ -374,61 +1187,401 @@ class VM:
             shell=True,
             executable="/bin/bash",
         )
+        self.metrics.mark("qemu_spawn")
 
-        try:
-            outs, errs = self.p.communicate(timeout=2)
-            self.logger.info("STDOUT: %s" % outs)
-            self.logger.info("STDERR: %s" % errs)
-        except:
-            pass
+        # drain qemu output without blocking, see drain_qemu_output()
+        self.qemu_output = {"STDOUT": bytearray(), "STDERR": bytearray()}
+        for pipe in (self.p.stdout, self.p.stderr):
+            os.set_blocking(pipe.fileno(), False)
+
+        self.qmp = self.connect_qemu_port(
+            lambda: QMPClient(self.qmp_socket).connect(),
+            f"QMP socket {self.qmp_socket}",
+        )
+        self.qmp.subscribe(["RESET", "SHUTDOWN", "STOP"], self.on_qmp_event)
+        self.start_nic_hotplug()
 
-        for i in range(1, MAX_RETRIES + 1):
+        if self.use_scrapli:
+            self.connect_qemu_port(
+                self.scrapli_qm.open, f"qemu monitor (port {4000 + self.num})"
+            )
+        else:
+            self.qm = self.connect_qemu_port(
+                lambda: ConsoleTelnet("127.0.0.1", 4000 + self.num),
+                f"qemu monitor (port {4000 + self.num})",
+            )
+        self.metrics.mark("monitor_connect")
+
+        if self.use_scrapli:
+            self.connect_qemu_port(
+                self.scrapli_tn.open, f"serial console (port {5000 + self.num})"
+            )
+        else:
+            self.tn = self.connect_qemu_port(
+                lambda: ConsoleTelnet("127.0.0.1", 5000 + self.num),
+                f"serial console (port {5000 + self.num})",
+            )
+        self.metrics.mark("serial_connect")
+
+        self.open_console_mux()
+
+    def connect_qemu_port(self, connect, name):
+        """Connect to a qemu listening socket, retrying with exponential backoff.
+
+        Starts retrying after 10ms and backs off to a second so the connection
+        is made as soon as qemu listens, and fails fast if qemu exits.
+        """
+        deadline = Deadline(MAX_RETRIES)
+        delay = CONNECT_BACKOFF_MIN
+        attempt = 0
+        while True:
+            attempt += 1
             try:
-                if self.use_scrapli:
-                    self.scrapli_qm.open()
-                else:
-                    self.qm = telnetlib.Telnet("127.0.0.1", 4000 + self.num)
-                break
-            except:
-                self.logger.error(
-                    "Unable to connect to qemu monitor (port {}), retrying in a second (attempt {})".format(
-                        4000 + self.num, i
-                    )
-                )
-                time.sleep(1)
-            if i == MAX_RETRIES:
-                raise QemuBroken(
-                    "Unable to connect to qemu monitor on port {}".format(
-                        4000 + self.num
-                    )
+                return connect()
+            except Exception as e:
+                if self.p.poll() is not None:
+                    self.drain_qemu_output()
+                    raise QemuBroken(
+                        f"qemu exited with {self.p.returncode} before the {name} "
+                        f"came up: {self.qemu_output['STDERR'].decode(errors='replace')}"
+                    ) from e
+                if deadline.expired:
+                    raise QemuBroken(f"Unable to connect to {name}") from e
+                self.logger.debug(
+                    f"Unable to connect to {name}, retrying in {delay:.2f}s (attempt {attempt})"
                 )
+                time.sleep(min(delay, deadline.remaining()))
+                delay = min(delay * 2, CONNECT_BACKOFF_MAX)
 
-        for i in range(1, MAX_RETRIES + 1):
-            try:
-                if self.use_scrapli:
-                    self.scrapli_tn.open()
-                else:
-                    self.tn = telnetlib.Telnet("127.0.0.1", 5000 + self.num)
-                break
-            except:
+    def drain_qemu_output(self):
+        """Read whatever qemu wrote to stdout/stderr without blocking.
+
+        Keeps the pipes from filling up (which would stall qemu) and keeps
+        the tail of the output for logging when qemu exits.
+        """
+        for name, pipe in (("STDOUT", self.p.stdout), ("STDERR", self.p.stderr)):
+            while True:
+                try:
+                    chunk = os.read(pipe.fileno(), 65536)
+                except (BlockingIOError, ValueError, OSError):
+                    break
+                if not chunk:
+                    break
+                output = self.qemu_output[name]
+                output += chunk
+                del output[:-QEMU_OUTPUT_LIMIT]
+
+    def warm_image_key_data(self) -> dict:
+        """Bootstrap inputs that end up inside a warm image.
+
+        Platforms whose bootstrap config depends on more than the credentials
+        should extend this. Per-node settings that are re-applied by
+        apply_warm_delta() (hostname, mgmt address) must not be included.
+        """
+        return {"username": self.username, "password": self.password}
+
+    def warm_image_key(self, cmd) -> str:
+        """Key a warm image by base image, qemu device layout and bootstrap inputs"""
+        image = os.stat(self.image)
+        # MACs are randomly generated per start and do not change the layout
+        layout = re.sub(r"mac=[0-9a-fA-F:]+", "mac=", " ".join(cmd))
+        data = {
+            "class": self.__class__.__name__,
+            "image": [os.path.realpath(self.image), image.st_size, image.st_mtime_ns],
+            "qemu": layout,
+            "bootstrap": self.warm_image_key_data(),
+        }
+        digest = hashlib.sha256(json.dumps(data, sort_keys=True).encode())
+        return digest.hexdigest()[:16]
+
+    def warm_image_paths(self):
+        """Return the (disk, vm state) paths of the warm image for this VM"""
+        base = os.path.join(WARM_IMAGE_DIR, f"{self}-{self.warm_key}")
+        return base + ".qcow2", base + ".state"
+
+    def create_overlay(self, backing_image):
+        """(Re)create the overlay disk of this VM on top of backing_image"""
+        if os.path.exists(self.overlay_disk_image):
+            os.remove(self.overlay_disk_image)
+        fmt = (
+            "qcow2"
+            if backing_image != self.base_image
+            else self._overlay_disk_image_format()
+        )
+        run_command(
+            [
+                "qemu-img",
+                "create",
+                "-f",
+                "qcow2",
+                "-F",
+                fmt,
+                "-b",
+                backing_image,
+                self.overlay_disk_image,
+            ]
+        )
+
+    def warm_image_args(self, cmd):
+        """Return extra qemu args to restore the warm image, if one exists.
+
+        A restore is only attempted on the first start; if it does not reach
+        the running state the overlay is rebuilt from the base image and the
+        VM boots cold.
+        """
+        self.warm_key = self.warm_image_key(cmd)
+        disk, state = self.warm_image_paths()
+
+        if self.warm_state == "restoring":
+            self.logger.warning("Restoring warm image failed, booting cold")
+            self.create_overlay(self.base_image)
+            self.warm_state = None
+            return []
+
+        if self.warm_restore_attempted:
+            return []
+        self.warm_restore_attempted = True
+
+        if not (os.path.exists(disk) and os.path.exists(state)):
+            self.logger.info(f"No warm image for key {self.warm_key}, booting cold")
+            return []
+
+        self.logger.info(f"Restoring warm image {state}")
+        self.create_overlay(disk)
+        self.warm_state = "restoring"
+        self.warm_restore_deadline = Deadline(WARM_IMAGE_RESTORE_TIMEOUT)
+        return ["-incoming", f'"exec:cat {state}"']
+
+    def on_qmp_event(self, event):
+        """Handle asynchronous QMP events of this VM (called on the QMP thread)"""
+        name = event["event"]
+        data = event.get("data", {})
+        if name == "SHUTDOWN":
+            self.logger.warning(f"VM num {self.num} shut down ({data.get('reason')})")
+        else:
+            self.logger.info(f"VM num {self.num} QMP event {name} {data}")
+
+    def system_reset(self):
+        """Reset the VM through QMP, falling back to the human monitor"""
+        if self.qmp is not None and not self.qmp.closed:
+            self.qmp.execute("system_reset")
+        elif self.use_scrapli:
+            self.scrapli_qm.channel.write("system_reset\r")
+        else:
+            self.qm.write("system_reset\r".encode())
+
+    def save_warm_image(self):
+        """Save the disk and VM state after the first successful bootstrap"""
+        disk, state = self.warm_image_paths()
+        os.makedirs(WARM_IMAGE_DIR, exist_ok=True)
+        tmp_disk, tmp_state = disk + f".{os.getpid()}.tmp", state + f".{os.getpid()}.tmp"
+
+        self.logger.info(f"Saving warm image {state}")
+        save_start = time.monotonic()
+        try:
+            self.qmp.execute_batch(
+                [("stop", None), ("migrate", {"uri": f"exec:cat > {tmp_state}"})]
+            )
+            deadline = Deadline(WARM_IMAGE_SAVE_TIMEOUT)
+            while True:
+                status = self.qmp.execute("query-migrate").get("status")
+                if status == "completed":
+                    break
+                if status in ("failed", "cancelled") or deadline.expired:
+                    raise QemuBroken(f"saving VM state failed: {status}")
+                time.sleep(0.5)
+            # the migration flushed the disk and the VM is paused, so the
+            # overlay can be copied consistently
+            shutil.copyfile(self.overlay_disk_image, tmp_disk)
+            os.replace(tmp_disk, disk)
+            os.replace(tmp_state, state)
+            self.logger.info(
+                f"Saved warm image in {time.monotonic() - save_start:.1f}s"
+            )
+        except Exception as e:
+            self.logger.error(f"Failed to save warm image: {e}")
+            for path in (tmp_disk, tmp_state):
+                if os.path.exists(path):
+                    os.remove(path)
+        finally:
+            self.qmp.execute("cont")
+
+    def apply_warm_delta(self):
+        """Apply per-node settings to a VM restored from a warm image.
+
+        The restored guest carries the hostname, config and MAC addresses of
+        the node that saved it. Platforms supporting warm images override this
+        to push their per-node settings and raise QemuBroken when that fails,
+        which makes the VM boot cold; WARM_IMAGE is ignored for platforms that
+        don't.
+        """
+        raise NotImplementedError
+
+    def warm_restore_spin(self):
+        """Wait for qemu to load the saved state, then resume and finish the restore.
+
+        The state was saved with the VM paused, so qemu restores it paused
+        and it has to be continued. A restore that does not reach the running
+        state before its deadline is abandoned and the VM boots cold.
+        """
+        status = self.qmp.execute("query-status")["status"]
+        if status == "paused":
+            migrate = self.qmp.execute("query-migrate").get("status")
+            if migrate in ("failed", "cancelled"):
+                self.logger.error(f"Loading warm image failed: {migrate}")
+                self.restart()
+                return
+            if migrate in (None, "completed"):
+                self.qmp.execute("cont")
+                status = self.qmp.execute("query-status")["status"]
+        if status != "running":
+            if self.warm_restore_deadline.expired:
                 self.logger.error(
-                    "Unable to connect to qemu monitor (port {}), retrying in a second (attempt {})".format(
-                        5000 + self.num, i
-                    )
-                )
-                time.sleep(1)
-            if i == MAX_RETRIES:
-                raise QemuBroken(
-                    "Unable to connect to qemu monitor on port {}".format(
-                        5000 + self.num
-                    )
+                    f"Warm image not running after {WARM_IMAGE_RESTORE_TIMEOUT}s ({status})"
                 )
+                # start() sees the failed restore and boots cold
+                self.restart()
+                return
+            time.sleep(1)
+            return
         try:
-            outs, errs = self.p.communicate(timeout=2)
-            self.logger.info("STDOUT: %s" % outs)
-            self.logger.info("STDERR: %s" % errs)
-        except:
-            pass
+            self.apply_warm_delta()
+        except (QemuBroken, EOFError, OSError) as e:
+            self.logger.error(f"Applying node settings to the warm image failed: {e}")
+            # start() sees the failed restore and boots cold
+            self.restart()
+            return
+        self.warm_state = "restored"
+        self.running = True
+        self.metrics.mark("running")
+        self.release_boot_tokens()
+        startup_time = datetime.datetime.now() - self.start_time
+        self.logger.info(f"Restored from warm image in: {startup_time}")
+
+    def acquire_boot_tokens(self):
+        """Wait for the host-wide boot scheduler to admit this VM's boot"""
+        if not boot_scheduler.enabled or self.boot_tokens or self.boot_grant:
+            return
+        weight = boot_scheduler.weight(self.ram, self.smp)
+        self.logger.info(f"Waiting for {weight} boot token(s)")
+        wait_start = time.monotonic()
+        self.boot_tokens = boot_scheduler.acquire(weight)
+        self.boot_token_time = time.monotonic()
+        self.logger.info(
+            f"Acquired {weight} boot token(s) after {self.boot_token_time - wait_start:.1f}s"
+        )
+
+    def release_boot_tokens(self):
+        """Hand the boot tokens back once the VM is running"""
+        if self.boot_grant:
+            self.boot_grant.release(self)
+            self.boot_grant = None
+        elif self.boot_tokens:
+            boot_scheduler.release(self.boot_tokens)
+            self.boot_tokens = []
+        else:
+            return
+        self.logger.info(
+            f"Released boot token(s), booted in {time.monotonic() - self.boot_token_time:.1f}s"
+        )
+
+    def console_socket(self, con):
+        """Return the underlying socket of a telnetlib or scrapli connection"""
+        if isinstance(con, telnetlib.Telnet):
+            return con.get_socket()
+        try:
+            return con.transport.socket.sock
+        except AttributeError:
+            return None
+
+    def open_console_mux(self):
+        """(Re)register the serial console and qemu monitor sockets for waiting"""
+        if self.console_mux is not None:
+            self.console_mux.close()
+        self.console_mux = ConsoleMux()
+        self.last_console_activity = time.monotonic()
+        if self.use_scrapli:
+            serial, monitor = self.scrapli_tn, self.scrapli_qm
+        else:
+            serial, monitor = self.tn, self.qm
+        self.console_mux.register("serial", self.console_socket(serial))
+        self.console_mux.register("monitor", self.console_socket(monitor))
+
+    def console_buffered(self) -> bool:
+        """Whether the serial connection holds data that was already received"""
+        if self.use_scrapli:
+            transport = self.scrapli_tn.transport
+            return bool(
+                getattr(transport, "_cooked_buf", b"")
+                or getattr(transport, "_raw_buf", b"")
+            )
+        return self.tn is not None and self.tn.buffered()
+
+    def drain_monitor(self):
+        """Consume pending qemu monitor output so its socket stops waking us up"""
+        try:
+            if self.use_scrapli:
+                out = self.scrapli_qm.channel.read()
+            else:
+                out = self.qm.read_very_eager()
+        except Exception:
+            self.console_mux.unregister("monitor")
+            return
+        if out:
+            self.logger.debug(f"qemu monitor: {out!r}")
+
+    def wait_console(self, deadline):
+        """Block until the serial console has data to read or the deadline passes.
+
+        Returns True when data is available.
+        """
+        if self.console_buffered():
+            return True
+        if self.console_mux is None:
+            return True
+        while True:
+            ready = self.console_mux.wait(deadline)
+            if "monitor" in ready:
+                self.drain_monitor()
+            if "serial" in ready:
+                return True
+            if deadline.expired or not ready:
+                return False
+
+    def read_console(self, deadline):
+        """Read whatever the serial console has, waiting until the deadline for it.
+
+        Returns b"" when nothing arrived in time.
+        """
+        if not self.wait_console(deadline):
+            return b""
+        if self.use_scrapli:
+            buf = self.scrapli_tn.channel.read()
+            if buf:
+                self.last_console_activity = time.monotonic()
+                self.metrics.mark("first_console_byte")
+                self.metrics.console_bytes += len(buf)
+        else:
+            buf = self.tn.read_very_eager()
+            self.last_console_activity = self.tn.last_activity
+        return buf
+
+    def update_console_metrics(self):
+        """Pull console byte counts from the telnetlib serial connection"""
+        if self.use_scrapli or self.tn is None:
+            return
+        if self.tn.first_activity is not None:
+            self.metrics.mark("first_console_byte", self.tn.first_activity)
+        self.metrics.console_bytes += self.tn.bytes_read - self.console_bytes_seen
+        self.console_bytes_seen = self.tn.bytes_read
+
+    def console_idle_time(self) -> float:
+        """Seconds since the last byte was read from the serial console"""
+        if not self.use_scrapli and self.tn is not None:
+            self.last_console_activity = max(
+                self.last_console_activity, self.tn.last_activity
+            )
+        return time.monotonic() - self.last_console_activity
 
     def create_tc_tap_ifup(self):
         """Create tap ifup script that is used in tc datapath mode"""
@@ -608,6 +1761,14 @@ class VM:
                 self.insuffucient_nics = True
             return
 
+        if self.nic_hotplug and self.conn_mode == "tc":
+            self.logger.debug(
+                "not waiting for provisioned interfaces, missing ones are hot-plugged"
+            )
+            if self.num_provisioned_nics < self.min_nics:
+                self.insuffucient_nics = True
+            return
+
         self.logger.debug("waiting for provisioned interfaces to appear...")
 
         # start_eth means eth index for VM
@@ -674,6 +1835,21 @@ class VM:
             )
         return res
 
+    def nic_pci_placement(self, i):
+        """Return the (pci bus, addr) of the data plane nic for eth index i"""
+        # PCI bus counter is to ensure pci bus index starts from 1
+        # and continuing in sequence regardles the eth index
+        pci_bus_ctr = i - self.start_nic_eth_idx + 1
+
+        # calc which PCI bus we are on and the local add on that PCI bus
+        x = pci_bus_ctr
+        if "vEOS" in self.image:
+            x = pci_bus_ctr + 1
+
+        pci_bus = math.floor(x / self.nics_per_pci_bus) + 1
+        addr = (x % self.nics_per_pci_bus) + 1
+        return pci_bus, addr
+
     def gen_nics(self):
         """Generate qemu args for the normal traffic carrying interface(s)"""
         self.nic_provision_delay()
@@ -683,25 +1859,19 @@ class VM:
         if self.conn_mode == "tc":
             self.create_tc_tap_ifup()
 
+        hotplug = self.nic_hotplug and self.conn_mode == "tc"
+        self.nic_hotplug_active = hotplug
+        self.plugged_nics = set()
+
         start_eth = self.start_nic_eth_idx
         end_eth = self.start_nic_eth_idx + self.num_nics
-        pci_bus_ctr = 0
         for i in range(start_eth, end_eth):
-            # PCI bus counter is to ensure pci bus index starts from 1
-            # and continuing in sequence regardles the eth index
-            pci_bus_ctr += 1
-
-            # calc which PCI bus we are on and the local add on that PCI bus
-            x = pci_bus_ctr
-            if "vEOS" in self.image:
-                x = pci_bus_ctr + 1
-
-            pci_bus = math.floor(x / self.nics_per_pci_bus) + 1
-            addr = (x % self.nics_per_pci_bus) + 1
+            pci_bus, addr = self.nic_pci_placement(i)
 
             # if the matching container interface ethX doesn't exist, we don't create a nic
             if not os.path.exists(f"/sys/class/net/{self.data_intf_prefix}{i}"):
-                if i >= self.highest_provisioned_nic_num:
+                # it is hot-plugged into its slot once it appears
+                if hotplug or i >= self.highest_provisioned_nic_num:
                     continue
 
                 # current intf number is *under* the highest provisioned nic number, so we need
@@ -727,6 +1897,7 @@ class VM:
             res.append("-device")
             res.append(
                 f"{self.nic_type},netdev=p{i:02d},mac={mac}"
+                + (f",id=nic{i}" if hotplug else "")
                 + (
                     f",bus=pci.{pci_bus},addr=0x{addr:x}"
                     if self.provision_pci_bus
@@ -739,38 +1910,116 @@ class VM:
                 res.append(
                     f"tap,id=p{i:02d},ifname=tap{i},script=/etc/tc-tap-ifup,downscript=no"
                 )
+            self.plugged_nics.add(i)
 
         return res
 
+    def start_nic_hotplug(self):
+        """Hot-plug interfaces that appear after qemu was started.
+
+        Listens for RTM_NEWLINK on a netlink socket so interfaces are plugged
+        as soon as containerlab wires them up, after first catching the ones
+        that appeared while qemu was starting.
+        """
+        if not self.nic_hotplug_active:
+            return
+        if self.nic_watcher is None:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_LINK))
+            self.nic_watcher = threading.Thread(
+                target=self.watch_nics, args=(sock,), name=f"{self}-{self.num}-nics", daemon=True
+            )
+            self.nic_watcher.start()
+        for i in range(self.start_nic_eth_idx, self.start_nic_eth_idx + self.num_nics):
+            if os.path.exists(f"/sys/class/net/{self.data_intf_prefix}{i}"):
+                self.hotplug_nic(i)
+
+    def watch_nics(self, sock):
+        pattern = re.compile(rf"{re.escape(self.data_intf_prefix)}(\d+)$")
+        while True:
+            data = sock.recv(65536)
+            for ifname in netlink_new_links(data):
+                match = pattern.match(ifname)
+                if match:
+                    self.hotplug_nic(int(match.group(1)))
+
+    def hotplug_nic(self, i):
+        """Add the nic for eth index i through QMP, in the same PCI slot
+        gen_nics() would have put it in."""
+        if not self.nic_hotplug_active:
+            return
+        if not self.start_nic_eth_idx <= i < self.start_nic_eth_idx + self.num_nics:
+            return
+        with self.nic_hotplug_lock:
+            if i in self.plugged_nics or self.qmp is None or self.qmp.closed:
+                return
+            device = {
+                "driver": self.nic_type,
+                "id": f"nic{i}",
+                "netdev": f"p{i:02d}",
+                "mac": gen_mac(i),
+            }
+            if self.provision_pci_bus:
+                pci_bus, addr = self.nic_pci_placement(i)
+                device.update({"bus": f"pci.{pci_bus}", "addr": f"0x{addr:x}"})
+            netdev = {
+                "type": "tap",
+                "id": f"p{i:02d}",
+                "ifname": f"tap{i}",
+                "script": "/etc/tc-tap-ifup",
+                "downscript": "no",
+            }
+            try:
+                self.qmp.execute_batch([("netdev_add", netdev), ("device_add", device)])
+            except QMPError as e:
+                self.logger.error(f"Failed to hot-plug {self.data_intf_prefix}{i}: {e}")
+                return
+            self.plugged_nics.add(i)
+            self.logger.info(f"Hot-plugged {self.data_intf_prefix}{i}")
+
     def stop(self):
         """Stop this VM"""
         self.running = False
 
+        if self.qmp is not None:
+            self.qmp.close()
+
         try:
             self.p.terminate()
         except ProcessLookupError:
             return
 
-        try:
-            self.p.communicate(timeout=10)
-        except:
+        # wait on the process rather than communicate() on the non-blocking
+        # pipes, draining them so qemu never blocks on a full pipe on its way out
+        deadline = Deadline(QEMU_STOP_TIMEOUT)
+        while True:
             try:
-                # this construct is included as an example at
-                # https://docs.python.org/3.6/library/subprocess.html but has
-                # failed on me so wrapping in another try block. It was this
-                # communicate() that failed with:
-                # ValueError: Invalid file object: <_io.TextIOWrapper name=3 encoding='ANSI_X3.4-1968'>
+                self.p.wait(timeout=0.1)
+                break
+            except subprocess.TimeoutExpired:
+                self.drain_qemu_output()
+            if deadline.expired:
+                self.logger.warning(
+                    f"qemu did not exit {QEMU_STOP_TIMEOUT}s after SIGTERM, killing it"
+                )
                 self.p.kill()
-                self.p.communicate(timeout=10)
-            except:
-                # just assume it's dead or will die?
-                self.p.wait(timeout=10)
+                self.p.wait(timeout=QEMU_STOP_TIMEOUT)
+                break
+        self.drain_qemu_output()
+        for pipe in (self.p.stdout, self.p.stderr):
+            pipe.close()
 
     def restart(self):
         """Restart this VM"""
         self.stop()
         self.start()
 
+    def mark_bootstrap_interaction(self):
+        """Record the login prompt phase at the first command written to the
+        console during bootstrap, platforms can mark it more precisely."""
+        if not self.running:
+            self.metrics.mark("login_prompt")
+
     def wait_write(
         self, cmd, wait="__defaultpattern__", con=None, clean_buffer=False, hold=""
     ):
@@ -783,6 +2032,8 @@ class VM:
         if self.use_scrapli:
             return self.wait_write_scrapli(cmd, wait)
 
+        self.mark_bootstrap_interaction()
+
         con_name = "custom con"
         if con is None:
             con = self.tn
@@ -836,6 +2087,8 @@ class VM:
 
             self.con_read_until(wait)
 
+        self.mark_bootstrap_interaction()
+
         time.sleep(0.1)  # don't write to the console too fast
 
         self.write_to_stdout(b"\n")
@@ -856,21 +2109,23 @@ class VM:
         - buffer of cosole read until match, or function exit.
         """
 
-        buf = b""
+        buf = bytearray()
+        deadline = Deadline(timeout)
+        matcher = StreamMatcher(regex_list)
 
-        if timeout:
-            t_end = time.time() + timeout
-            while time.time() < t_end:
-                buf += self.scrapli_tn.channel.read()
-        else:
-            buf = self.scrapli_tn.channel.read()
+        while True:
+            chunk = self.read_console(deadline)
+            buf += chunk
 
-        for i, obj in enumerate(regex_list):
-            match = re.search(obj.decode(), buf.decode())
+            i, match = matcher.feed(chunk)
             if match:
-                return i, match, buf
+                return i, match, bytes(buf)
+
+            # without a timeout a single read is done, like before
+            if timeout is None or deadline.expired:
+                break
 
-        return -1, None, buf
+        return -1, None, bytes(buf)
 
     def con_read_until(self, match_str, timeout=None):
         """
@@ -885,30 +2140,26 @@ class VM:
         - match_str: string to match on (string)
         - timeout: timeout in seconds, defaults to None (float)
         """
-        buf = b""
-
-        if timeout:
-            t_end = time.time() + timeout
+        buf = bytearray()
+        deadline = Deadline(timeout)
+        matcher = StreamMatcher([match_str])
 
         while True:
-            current_buf = self.scrapli_tn.channel.read()
+            current_buf = self.read_console(deadline)
             buf += current_buf
 
-            match = re.search(match_str, current_buf.decode())
-
-            # for reliability purposes, doublecheck the entire buffer
-            # maybe the current buffer only has partial output
-            if match is None:
-                match = re.search(match_str, buf.decode())
+            # the matcher keeps the tail of earlier reads, so output split
+            # across reads still matches without searching the whole buffer
+            _, match = matcher.feed(current_buf)
 
             self.write_to_stdout(current_buf)
 
             if match:
                 break
-            if timeout and time.time() > t_end:
+            if deadline.expired:
                 break
 
-        return buf
+        return bytes(buf)
 
     def write_to_stdout(self, bytes):
         """
@@ -922,12 +2173,35 @@ class VM:
 
     def work(self):
         self.check_qemu()
+        if self.warm_state == "restoring" and not self.running:
+            self.warm_restore_spin()
+            return
         if not self.running:
+            if (
+                self.console_stall_timeout
+                and self.console_idle_time() > self.console_stall_timeout
+            ):
+                self.logger.error(
+                    f"No console output for {self.console_stall_timeout}s, restarting"
+                )
+                self.restart()
+                return
             try:
+                self.metrics.spins += 1
                 self.bootstrap_spin()
             except EOFError:
                 self.logger.error("Telnet session was disconnected, restarting")
                 self.restart()
+                return
+            finally:
+                self.update_console_metrics()
+            if self.running:
+                self.metrics.mark("running")
+            if self.running and self.warm_image and self.warm_state is None:
+                self.save_warm_image()
+                self.warm_state = "restored"
+            if self.running:
+                self.release_boot_tokens()
 
     def check_qemu(self):
         """Check health of qemu. This is mostly just seeing if there's error
@@ -937,11 +2211,17 @@ class VM:
             self.logger.debug("VM not started; starting!")
             self.start()
 
-        # check for output
-        try:
-            outs, errs = self.p.communicate(timeout=1)
-        except subprocess.TimeoutExpired:
+        self.drain_qemu_output()
+        if self.p.poll() is None:
+            if not self.running:
+                # pace the spin like the blocking communicate(timeout=1) this
+                # replaced, but stop waiting as soon as the console has output
+                self.wait_console(Deadline(BOOT_SPIN_INTERVAL))
+                self.drain_qemu_output()
             return
+
+        outs = self.qemu_output["STDOUT"].decode(errors="replace")
+        errs = self.qemu_output["STDERR"].decode(errors="replace")
         self.logger.info("STDOUT: %s" % outs)
         self.logger.info("STDERR: %s" % errs)
 
@@ -1033,25 +2313,72 @@ class VR:
         except:
             pass
 
+    def vm_worker(self, vm):
+        """Run vm.work() in a loop on a dedicated thread.
+
+        While bootstrapping, work() paces itself as bootstrap_spin() blocks on
+        the console; once running the worker sleeps until qemu exits or the
+        next supervisor interval. Any exception,
+        including SystemExit from a platform's bootstrap code, is handed over
+        to the supervisor loop in start() so it is raised on the main thread.
+        """
+        try:
+            while True:
+                vm.work()
+                if vm.running:
+                    # nothing to do until qemu exits, wake up when it does
+                    try:
+                        vm.p.wait(timeout=VR_SUPERVISOR_INTERVAL)
+                    except subprocess.TimeoutExpired:
+                        pass
+        except BaseException as e:
+            self.vm_errors.put((vm, e))
+
     def update_health(self, exit_status, message):
         health_file = open("/health", "w")
         health_file.write("%d %s" % (exit_status, message))
         health_file.close()
 
     def start(self):
-        """Start the virtual router"""
+        """Start the virtual router
+
+        Every VM is driven by its own worker thread so that the VMs of a
+        distributed platform (control plane + line cards) boot in parallel.
+        This loop only aggregates their state into the health file and
+        re-raises the first error hit by a worker; reset requests are handled
+        by a ResetWatcher.
+        """
         self.logger.debug("Starting vrnetlab %s" % self.__class__.__name__)
         self.logger.debug("VMs: %s" % self.vms)
 
+        self.metrics_exporter = MetricsExporter(self.vms)
+        ResetWatcher(RESET_FILE, self.handle_reset).start()
+
+        self.acquire_boot_tokens()
+
+        self.vm_errors = queue.Queue()
+        for vm in self.vms:
+            worker = threading.Thread(
+                target=self.vm_worker,
+                args=(vm,),
+                name=f"{vm}-{vm.num}",
+                daemon=True,
+            )
+            worker.start()
+
         started = False
+        last_running = None
         while True:
-            all_running = True
-            for vm in self.vms:
-                vm.work()
-                if vm.running != True:
-                    all_running = False
+            try:
+                vm, error = self.vm_errors.get(timeout=VR_SUPERVISOR_INTERVAL)
+            except queue.Empty:
+                pass
+            else:
+                self.logger.error(f"VM num {vm.num} ({vm}) failed: {error!r}")
+                raise error
 
-            if all_running:
+            running = sum(1 for vm in self.vms if vm.running)
+            if running == len(self.vms):
                 self.update_health(0, "running")
                 started = True
             else:
@@ -1059,40 +2386,74 @@ class VR:
                     self.update_health(1, "VM failed - restarting")
                 else:
                     self.update_health(1, "starting")
+            self.metrics_exporter.update()
 
-            # file-based signalling backdoor to trigger a system reset (via qemu-monitor) on all or specific VMs.
-            # if file is empty: reset whole VR (all VMs)
-            # if file is non-empty: reset only specified VMs (comma separated list)
-            if os.path.exists("/reset"):
-                with open("/reset", "rt") as f:
-                    fcontent = f.read().strip()
-                vm_num_list = fcontent.split(",")
-                for vm in self.vms:
-                    if (str(vm.num) in vm_num_list) or not fcontent:
-                        try:
-                            if vm.use_scrapli:
-                                vm.scrapli_qm.channel.write("system_reset\r")
-                            else:
-                                vm.qm.write("system_reset\r".encode())
-                            self.logger.debug(
-                                f"Sent qemu-monitor system_reset to VM num {vm.num} "
-                            )
-                        except Exception as e:
-                            self.logger.error(
-                                f"Failed to send qemu-monitor system_reset to VM num {vm.num} ({e})"
-                            )
+            if running != last_running and len(self.vms) > 1:
+                self.logger.info(f"{running}/{len(self.vms)} VMs running")
+            last_running = running
+
+    def acquire_boot_tokens(self):
+        """Admit the boot of all VMs of a distributed platform at once
+
+        Booting VMs hold their tokens until they run, so a VM waiting for
+        tokens held by a sibling that only comes up with it would never
+        boot. Single VM routers acquire their own tokens in VM.start().
+        """
+        if not boot_scheduler.enabled or len(self.vms) < 2:
+            return
+        weight = min(
+            sum(boot_scheduler.weight(vm.ram, vm.smp) for vm in self.vms),
+            boot_scheduler.capacity,
+        )
+        self.logger.info(f"Waiting for {weight} boot token(s) for {len(self.vms)} VMs")
+        wait_start = time.monotonic()
+        grant = BootGrant(boot_scheduler.acquire(weight), self.vms)
+        token_time = time.monotonic()
+        for vm in self.vms:
+            vm.boot_grant = grant
+            vm.boot_token_time = token_time
+        self.logger.info(
+            f"Acquired {weight} boot token(s) after {token_time - wait_start:.1f}s"
+        )
+
+    def handle_reset(self):
+        """Handle the file-based signalling backdoor to trigger a system reset
+        on all or specific VMs.
+
+        if file is empty: reset whole VR (all VMs)
+        if file is non-empty: reset only specified VMs (comma separated list)
+        """
+        try:
+            with open(RESET_FILE, "rt") as f:
+                fcontent = f.read().strip()
+        except FileNotFoundError:
+            return
+        vm_num_list = fcontent.split(",")
+        for vm in self.vms:
+            if (str(vm.num) in vm_num_list) or not fcontent:
                 try:
-                    os.remove("/reset")
+                    vm.system_reset()
+                    self.logger.debug(f"Sent system_reset to VM num {vm.num} ")
                 except Exception as e:
                     self.logger.error(
-                        f"Failed to cleanup /reset file({e}). qemu-monitor system_reset will likely be triggered again on VMs"
+                        f"Failed to send system_reset to VM num {vm.num} ({e})"
                     )
+        try:
+            os.remove(RESET_FILE)
+        except Exception as e:
+            self.logger.error(
+                f"Failed to cleanup /reset file({e}). system_reset will likely be triggered again on VMs"
+            )
 
 
 class QemuBroken(Exception):
     """Our Qemu instance is somehow broken"""
 
 
+class QMPError(Exception):
+    """A QMP command failed or the QMP connection was lost"""
+
+
 def get_digits(input_str: str) -> int:
     """
     Strip all non-numeric characters from a string
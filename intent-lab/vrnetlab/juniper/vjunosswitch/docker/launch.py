@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import datetime
+import hashlib
 import logging
 import os
 import re
@@ -163,6 +164,59 @@ class VJUNOSSWITCH_vm(vrnetlab.VM):
 
         return
 
+    def warm_image_key_data(self) -> dict:
+        """The user startup config is part of the config disk, so of a warm image"""
+        data = super().warm_image_key_data()
+        if os.path.exists(STARTUP_CONFIG_FILE):
+            with open(STARTUP_CONFIG_FILE, "rb") as f:
+                data["startup_config"] = hashlib.sha256(f.read()).hexdigest()
+        return data
+
+    def apply_warm_delta(self):
+        """Set this node's hostname and management addresses on a restored VM.
+
+        The VM was saved logged in on the console, after bootstrap_spin(), so
+        the CLI is normally at the operational prompt.
+        """
+        self.tn.write(b"\r")
+        (ridx, match, res) = self.tn.expect([b"> ", b"# ", b"login:", b"% "], 30)
+        if not match:
+            raise vrnetlab.QemuBroken("no prompt on the console of the restored VM")
+        # the operational prompt was just read, otherwise wait for it
+        prompt = None if ridx == 0 else ">"
+        if ridx == 1:
+            self.wait_write("exit configuration-mode", None)
+        elif ridx == 2:
+            self.wait_write("admin", None)
+            self.wait_write(self.password, wait="Password:")
+        elif ridx == 3:
+            self.wait_write("cli", None)
+
+        commands = [
+            f"set system host-name {self.hostname}",
+            "delete interfaces fxp0 unit 0 family inet address",
+            f"set interfaces fxp0 unit 0 family inet address {self.mgmt_address_ipv4}",
+            "delete interfaces fxp0 unit 0 family inet6 address",
+            f"set interfaces fxp0 unit 0 family inet6 address {self.mgmt_address_ipv6}",
+            "delete routing-instances mgmt_junos routing-options static route 0.0.0.0/0",
+            "set routing-instances mgmt_junos routing-options static route 0.0.0.0/0"
+            f" next-hop {self.mgmt_gw_ipv4}",
+            "delete routing-instances mgmt_junos routing-options rib mgmt_junos.inet6.0"
+            " static route ::/0",
+            "set routing-instances mgmt_junos routing-options rib mgmt_junos.inet6.0"
+            f" static route ::/0 next-hop {self.mgmt_gw_ipv6}",
+        ]
+        self.wait_write("configure", wait=prompt)
+        for command in commands:
+            self.wait_write(command, wait="#")
+        self.wait_write("commit and-quit", wait="#")
+        (ridx, match, res) = self.tn.expect([b"commit complete"], 120)
+        if not match:
+            raise vrnetlab.QemuBroken(
+                f"commit of the warm image settings failed: {res.decode(errors='replace')}"
+            )
+        self.logger.info(f"Applied hostname {self.hostname} and mgmt addresses")
+
 
 class VJUNOSSWITCH(vrnetlab.VR):
     def __init__(self, hostname, username, password, conn_mode):
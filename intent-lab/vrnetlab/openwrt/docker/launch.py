@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 
 import datetime
+import fcntl
+import functools
+import gzip
+import hashlib
 import ipaddress
 import logging
 import os
@@ -8,7 +12,10 @@ import re
 import shutil
 import signal
 import sys
+import threading
 import time
+import urllib.request
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 
 import vrnetlab
 
@@ -37,6 +44,250 @@ def trace(self, message, *args, **kws):
 
 logging.Logger.trace = trace
 
+# Seconds to wait for a console command to print its end-of-output sentinel
+COMMAND_TIMEOUT = 30
+# opkg talks to the package repository, give it longer
+OPKG_TIMEOUT = 300
+# Seconds to wait per domain for nslookup to answer
+NSLOOKUP_TIMEOUT = 15
+
+# Seconds to wait for the package cache to be populated, e.g. behind another
+# node holding its lock, before falling back to the online repository
+OPKG_CACHE_TIMEOUT = 300
+# Port the host-side package cache is served on, reached by the guest through
+# the qemu user network gateway
+OPKG_CACHE_PORT = 8808
+# Package feeds of a release, relative to <mirror>/<release>/
+OPKG_FEEDS = {
+    "core": "targets/x86/64/packages",
+    "base": "packages/x86_64/base",
+    "luci": "packages/x86_64/luci",
+    "packages": "packages/x86_64/packages",
+    "routing": "packages/x86_64/routing",
+    "telephony": "packages/x86_64/telephony",
+}
+# opkg invocation using only the package cache as feed
+OPKG_CACHE_CONF = "/tmp/opkg-vrnetlab.conf"
+OPKG_CACHE_CONF_DIR = "/tmp/opkg-vrnetlab.d"
+
+
+def release_from_image(path):
+    """Return the OpenWrt release of an image, e.g. 24.10.0, or None"""
+    m = re.search(r"openwrt-(\d{2}\.\d{2}(?:\.\d+)?)-", os.path.basename(path))
+    return m.group(1) if m else None
+
+
+def parse_packages_index(text):
+    """Split an opkg Packages index into {name: (fields, stanza)}"""
+    packages = {}
+    for stanza in re.split(r"\n\s*\n", text):
+        fields = dict(re.findall(r"^(\S+?):\s*(.*)$", stanza, flags=re.M))
+        if "Package" in fields:
+            packages[fields["Package"]] = (fields, stanza.strip())
+    return packages
+
+
+class OpkgCache:
+    """Host-side opkg feed holding the PACKAGES of one OpenWrt release.
+
+    The feed lives in <cache_dir>/<release>/ and is shared by all nodes that
+    bind-mount cache_dir. The upstream Packages indexes are fetched once per
+    release, the requested packages and their dependencies are downloaded
+    next to them and checked against the index checksums, and a Packages
+    index covering every cached file lets opkg use the directory as a feed.
+    Nothing is fetched when the directory already holds everything, so a
+    pre-populated cache also works on hosts without internet access.
+    Population is serialised between nodes with an flock().
+    """
+
+    def __init__(self, cache_dir, image, mirror_url):
+        self.logger = logging.getLogger()
+        self.release = release_from_image(image)
+        self.mirror_url = mirror_url.rstrip("/")
+        self.directory = (
+            os.path.join(cache_dir, self.release) if self.release else None
+        )
+        self.available = set()
+        self.thread = None
+        self.server = None
+
+    def start(self, packages):
+        """Populate the cache for packages and serve it, in the background"""
+        if self.directory is None:
+            self.logger.warning("📦 Cannot tell the OpenWrt release, no package cache")
+            return
+        self.thread = threading.Thread(
+            target=self._prepare_and_serve, args=(packages,), daemon=True
+        )
+        self.thread.start()
+
+    def wait(self, timeout=OPKG_CACHE_TIMEOUT):
+        """Wait for start() to finish, return the requested packages available
+
+        Nothing is available when the cache is not ready within timeout.
+        """
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                self.logger.warning(
+                    f"📦 Package cache not ready after {timeout}s, not waiting for it"
+                )
+                return set()
+        return self.available
+
+    def _prepare_and_serve(self, packages):
+        try:
+            os.makedirs(os.path.join(self.directory, "indexes"), exist_ok=True)
+            with open(os.path.join(self.directory, ".lock"), "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                self.available = self.prepare(packages)
+            self.serve()
+        except Exception as e:
+            self.logger.warning(f"📦 Package cache unavailable: {e}")
+            self.available = set()
+
+    def feed_index(self, feed):
+        """Return the parsed upstream index of a feed, fetching it once"""
+        path = os.path.join(self.directory, "indexes", f"{feed}.Packages")
+        if not os.path.exists(path):
+            url = f"{self.mirror_url}/{self.release}/{OPKG_FEEDS[feed]}/Packages.gz"
+            self.logger.info(f"📦 Fetching package index {url}")
+            with urllib.request.urlopen(url, timeout=60) as r:
+                data = gzip.decompress(r.read())
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        with open(path, encoding="utf-8") as f:
+            return parse_packages_index(f.read())
+
+    def load_indexes(self):
+        """Return {name: (feed, fields, stanza)} across all feeds"""
+        index = {}
+        for feed in OPKG_FEEDS:
+            try:
+                packages = self.feed_index(feed)
+            except OSError as e:
+                self.logger.warning(f"📦 No package index for feed {feed}: {e}")
+                continue
+            for name, (fields, stanza) in packages.items():
+                index.setdefault(name, (feed, fields, stanza))
+        return index
+
+    @staticmethod
+    def dependencies(fields):
+        """Yield the alternatives of each dependency of a package"""
+        for dep in fields.get("Depends", "").split(","):
+            alternatives = [
+                re.sub(r"\(.*?\)", "", alt).strip() for alt in dep.split("|")
+            ]
+            alternatives = [alt for alt in alternatives if alt]
+            if alternatives:
+                yield alternatives
+
+    def resolve(self, index, packages):
+        """Return the names needed to install packages and the ones not found"""
+        provides = {}
+        for name, (_, fields, _) in index.items():
+            for provided in fields.get("Provides", "").split(","):
+                provided = re.sub(r"\(.*?\)", "", provided).strip()
+                if provided:
+                    provides.setdefault(provided, name)
+
+        needed, missing = set(), set()
+        todo = list(packages)
+        while todo:
+            name = todo.pop()
+            name = name if name in index else provides.get(name, name)
+            if name in needed or name in missing:
+                continue
+            if name not in index:
+                missing.add(name)
+                continue
+            needed.add(name)
+            for alternatives in self.dependencies(index[name][1]):
+                todo.append(
+                    next(
+                        (alt for alt in alternatives if alt in index or alt in provides),
+                        alternatives[0],
+                    )
+                )
+        return needed, missing
+
+    def fetch(self, feed, fields):
+        """Download one package into the cache unless it is already there"""
+        filename = os.path.basename(fields["Filename"])
+        path = os.path.join(self.directory, filename)
+        if os.path.exists(path):
+            return
+        url = f"{self.mirror_url}/{self.release}/{OPKG_FEEDS[feed]}/{fields['Filename']}"
+        self.logger.info(f"📦 Caching {filename}")
+        sha256 = hashlib.sha256()
+        with urllib.request.urlopen(url, timeout=60) as r, open(
+            path + ".tmp", "wb"
+        ) as f:
+            for chunk in iter(lambda: r.read(65536), b""):
+                sha256.update(chunk)
+                f.write(chunk)
+        if fields.get("SHA256sum") and sha256.hexdigest() != fields["SHA256sum"]:
+            os.remove(path + ".tmp")
+            raise ValueError(f"checksum mismatch for {filename}")
+        os.replace(path + ".tmp", path)
+
+    def write_index(self, index):
+        """Write Packages/Packages.gz covering every package file in the cache"""
+        cached = set(os.listdir(self.directory))
+        stanzas = []
+        for name, (_, fields, stanza) in sorted(index.items()):
+            filename = os.path.basename(fields.get("Filename", ""))
+            if filename in cached:
+                stanzas.append(
+                    re.sub(
+                        r"^Filename:.*$", f"Filename: {filename}", stanza, flags=re.M
+                    )
+                )
+        data = ("\n\n".join(stanzas) + "\n").encode("utf-8")
+        for name, content in (("Packages", data), ("Packages.gz", gzip.compress(data))):
+            path = os.path.join(self.directory, name)
+            with open(path + ".tmp", "wb") as f:
+                f.write(content)
+            os.replace(path + ".tmp", path)
+
+    def prepare(self, packages):
+        """Make sure packages are cached, return the ones that are"""
+        index = self.load_indexes()
+        needed, missing = self.resolve(index, packages)
+        for name in sorted(needed):
+            feed, fields, _ = index[name]
+            try:
+                self.fetch(feed, fields)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"📦 Could not cache {name}: {e}")
+                missing.add(name)
+        self.write_index(index)
+
+        available = set()
+        for package in packages:
+            closure, unresolved = self.resolve(index, [package])
+            if not unresolved and not closure & missing:
+                available.add(package)
+        self.logger.info(
+            f"📦 Package cache for OpenWrt {self.release}: {len(available)}/{len(packages)} packages available"
+        )
+        return available
+
+    def serve(self):
+        """Serve the cache directory over HTTP on the loopback interface"""
+        handler = functools.partial(
+            QuietHTTPRequestHandler, directory=self.directory
+        )
+        self.server = ThreadingHTTPServer(("127.0.0.1", OPKG_CACHE_PORT), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+class QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logging.getLogger().debug("package cache: " + format % args)
+
 
 class OpenWRT_vm(vrnetlab.VM):
     def __init__(
@@ -51,6 +302,8 @@ class OpenWRT_vm(vrnetlab.VM):
         packages,
         lan_ip,
         lan_netmask,
+        opkg_cache_dir,
+        opkg_mirror_url,
     ):
         for e in os.listdir("/"):
             if re.search(".img$", e):
@@ -72,6 +325,13 @@ class OpenWRT_vm(vrnetlab.VM):
         self.packet_repository_domains = packet_repository_domains
         self.packet_repository_dns_server = packet_repository_dns_server
         self.packages = packages
+        self.command_seq = 0
+        self.opkg_updated = False
+        self.opkg = "opkg"
+        self.opkg_cache = None
+        if opkg_cache_dir and self.requested_packages():
+            self.opkg_cache = OpkgCache(opkg_cache_dir, disk_image, opkg_mirror_url)
+            self.opkg_cache.start(self.requested_packages())
 
     def vm_stop_start_rm_tc_rules(self):
         import subprocess
@@ -234,12 +494,108 @@ class OpenWRT_vm(vrnetlab.VM):
 
         return
 
+    def run_commands(self, commands, timeout=COMMAND_TIMEOUT):
+        """Run one or more shell commands and return their combined output.
+
+        The commands are written in one go, followed by an echo of a sentinel
+        that is unique to this call, and the console is read until the
+        sentinel comes back. The call therefore takes as long as the guest
+        needs and no longer. The sentinel is echoed with an empty quote pair
+        inside it, so the echo of the command line itself never matches.
+
+        Echoed command lines and bare prompts are dropped from the output.
+        """
+        if isinstance(commands, str):
+            commands = [commands]
+        self.command_seq += 1
+        marker = f"VRNETLAB_DONE_{self.command_seq}"
+        lines = list(commands) + [f'echo "{marker[:8]}""{marker[8:]} $?"']
+        self.tn.write(("\n".join(lines) + "\n").encode("utf-8"))
+
+        _, match, buf = self.con_expect([rf"{marker} (\d+)"], timeout=timeout)
+        text = buf.decode("utf-8", errors="replace").replace("\r", "")
+        if match:
+            text = text[: text.rfind(marker)]
+            if match.group(1) != "0":
+                self.logger.debug(
+                    f"'{lines[-2]}' exited with status {match.group(1)}"
+                )
+        else:
+            self.logger.warning(
+                f"⚠ No end of output from '{lines[-2]}' after {timeout}s"
+            )
+
+        output = []
+        for line in text.split("\n"):
+            stripped = line.strip()
+            if not stripped or re.fullmatch(r"\S+@\S+:\S*[#$]", stripped):
+                continue
+            if any(stripped.endswith(cmd.strip()) for cmd in lines):
+                continue
+            output.append(line.rstrip())
+        output = "\n".join(output)
+        self.logger.trace(f"console output:\n{output}")
+        return output
+
+    def restart_network(self):
+        """Restart the network and wait until the mgmt interface is up again"""
+        self.run_commands(
+            [
+                "/etc/init.d/network restart",
+                f"for i in $(seq 100); do ifstatus {self.mgmt_interface_interface}"
+                " | grep -q '\"up\": true' && break; sleep 0.2; done",
+            ]
+        )
+
+    def requested_packages(self):
+        """Return the packages listed in PACKAGES, split on spaces and commas"""
+        if not self.packages:
+            return []
+        return [
+            pkg.strip()
+            for pkg in self.packages.replace(",", " ").split()
+            if pkg.strip()
+        ]
+
+    def setup_opkg_cache(self):
+        """Point opkg at the host-side package cache if it holds all PACKAGES"""
+        self.opkg = "opkg"
+        if self.opkg_cache is None:
+            return
+        if self.mgmt_passthrough:
+            self.logger.info(
+                "📦 Package cache is not reachable with MGMT passthrough, using the online repository"
+            )
+            return
+        missing = set(self.requested_packages()) - self.opkg_cache.wait()
+        if missing:
+            self.logger.info(
+                f"📦 Package cache lacks {', '.join(sorted(missing))}, using the online repository"
+            )
+            return
+        # a feed list of its own, so opkg does not try the online feeds
+        self.run_commands(
+            [
+                f"mkdir -p {OPKG_CACHE_CONF_DIR}",
+                f"grep -v '^option check_signature' /etc/opkg.conf > {OPKG_CACHE_CONF}",
+                f"echo 'src/gz vrnetlab_cache http://{self.mgmt_gw_ipv4}:{OPKG_CACHE_PORT}'"
+                f" > {OPKG_CACHE_CONF_DIR}/cache.conf",
+            ]
+        )
+        self.opkg = f"OPKG_CONF_DIR={OPKG_CACHE_CONF_DIR} opkg -f {OPKG_CACHE_CONF}"
+        self.logger.info("📦 Installing packages from the package cache")
+
+    def opkg_update(self):
+        """Refresh the package lists, once per bootstrap"""
+        if self.opkg_updated:
+            return
+        self.logger.info("\n[🔄] Running `opkg update`...")
+        self.run_commands(f"{self.opkg} update", timeout=OPKG_TIMEOUT)
+        self.opkg_updated = True
+
     def get_network_config(self):
         """Retrieve the current network configuration from OpenWrt"""
-        self.tn.write(b"cat /etc/config/network\n")
-        time.sleep(1)
-        output = self.tn.read_very_eager().decode("utf-8").strip()
-        return output
+        return self.run_commands("cat /etc/config/network")
 
     def get_ready(self):
         self.tn.write(b"\r\n")
@@ -577,16 +933,28 @@ class OpenWRT_vm(vrnetlab.VM):
         self.get_ready()
         if changes_network:
             self.logger.info("\n[🔄] Reloading network configuration...")
-            self.tn.write(b"/etc/init.d/network restart\n")
-            time.sleep(3)
+            self.restart_network()
             self.logger.info("✅ Network restarted!")
 
         if changes_firewall:
             self.logger.info("\n[🔄] Reloading firewall configuration...")
-            self.tn.write(b"/etc/init.d/firewall reload\n")
-            time.sleep(3)
+            self.run_commands("/etc/init.d/firewall reload")
             self.logger.info("✅ Firewall reloaded!")
 
+    def uci_add_route(self, target, comment):
+        """Return the uci commands adding a mgmt route to target"""
+        if self.mgmt_passthrough_ipv4_address == self.mgmt_address_ipv4:
+            gateway = self.mgmt_passthrough_ipv4_gateway
+        else:
+            gateway = self.mgmt_gw_ipv4
+        return [
+            "uci add network route",
+            f"uci set network.@route[-1].interface='{self.mgmt_interface_interface}'",
+            f"uci set network.@route[-1].target='{target}'",
+            f"uci set network.@route[-1].gateway='{gateway}'",
+            f"uci set network.@route[-1].comment='{comment}'",
+        ]
+
     def routes_and_dns(self):
         # Target domains & DNS server
         domains = (
@@ -602,61 +970,36 @@ class OpenWRT_vm(vrnetlab.VM):
         self.logger.info(
             f"➕ Adding temporary route to {self.packet_repository_dns_server}..."
         )
-        self.tn.write(b"uci add network route\r\n")
-        time.sleep(0.5)
-        self.tn.write(
-            f"uci set network.@route[-1].interface='{self.mgmt_interface_interface}'\r\n".encode(
-                "utf-8"
-            )
+        self.run_commands(
+            self.uci_add_route(f"{self.packet_repository_dns_server}/32", "dns")
+            + ["uci commit network"]
         )
-        time.sleep(0.5)
-        self.tn.write(
-            f"uci set network.@route[-1].target='{self.packet_repository_dns_server}/32'\r\n".encode(
-                "utf-8"
-            )
-        )
-        time.sleep(0.5)
-        if self.mgmt_passthrough_ipv4_address == self.mgmt_address_ipv4:
-            self.tn.write(
-                f"uci set network.@route[-1].gateway='{self.mgmt_passthrough_ipv4_gateway}'\r\n".encode(
-                    "utf-8"
-                )
-            )
-            time.sleep(0.5)
-        else:
-            self.tn.write(
-                f"uci set network.@route[-1].gateway='{self.mgmt_gw_ipv4}'\r\n".encode(
-                    "utf-8"
-                )
-            )
-            time.sleep(0.5)
-        self.tn.write(b"uci set network.@route[-1].comment='dns'\n")
-        time.sleep(0.5)
-        self.tn.write(b"uci commit network\r\n")
-        time.sleep(1)
-        self.tn.write(b"/etc/init.d/network restart\r\n")
-        time.sleep(3)
+        self.restart_network()
         self.logger.info("✅ Temporary route to DNS server added!")
 
         # Storage for resolved IPs
         ipv4_addresses = {}
 
-        # Resolve each domain
-        for domain in domain_list:
-            self.logger.info(
-                f"[🔍] Resolving {domain} using {self.packet_repository_dns_server} via Telnet..."
-            )
-            self.tn.write(
-                f"nslookup {domain} {self.packet_repository_dns_server}\r\n".encode(
-                    "utf-8"
-                )
-            )
-            time.sleep(2)  # Wait for response
-            nslookup_output = self.tn.read_very_eager().decode("utf-8")
+        # Resolve all domains in one pass, each answer is preceded by a
+        # '@@ <domain>' line so the output can be split up again
+        self.logger.info(
+            f"[🔍] Resolving {', '.join(domain_list)} using {self.packet_repository_dns_server} via Telnet..."
+        )
+        nslookup_output = self.run_commands(
+            f"for d in {' '.join(domain_list)}; do echo \"@@ $d\"; "
+            f"nslookup $d {self.packet_repository_dns_server}; done",
+            timeout=NSLOOKUP_TIMEOUT * len(domain_list),
+        )
+        sections = re.split(r"^@@ (\S+)$", nslookup_output, flags=re.M)
+        nslookup_results = dict(zip(sections[1::2], sections[2::2]))
 
+        for domain in domain_list:
             # Extract IPv4 addresses
             resolved_ips = set(
-                re.findall(r"Address:\s+(\d+\.\d+\.\d+\.\d+)", nslookup_output)
+                re.findall(
+                    r"Address:\s+(\d+\.\d+\.\d+\.\d+)",
+                    nslookup_results.get(domain, ""),
+                )
             )  # Remove duplicates
             resolved_ips.discard(
                 self.packet_repository_dns_server
@@ -671,17 +1014,14 @@ class OpenWRT_vm(vrnetlab.VM):
                 ipv4_addresses[domain] = resolved_ips
 
         # Check current `/etc/hosts` and network routes
-        self.tn.write(b"cat /etc/hosts\r\n")
-        time.sleep(1)
-        hosts_output = self.tn.read_very_eager().decode("utf-8")
-
-        self.tn.write(b"cat /etc/config/network\r\n")
-        time.sleep(1)
-        network_output = self.tn.read_very_eager().decode("utf-8")
+        hosts_output = self.run_commands("cat /etc/hosts")
+        network_output = self.run_commands("cat /etc/config/network")
 
         # Change tracking
         changes_hosts = 0
         changes_routes = 0
+        # Commands collected below are applied in a single batch
+        commands = []
 
         # Remove domains from /etc/hosts if domain not in domain_list, but skip localhost
         existing_hosts = re.findall(
@@ -694,19 +1034,14 @@ class OpenWRT_vm(vrnetlab.VM):
                 self.logger.info(
                     f"❌ Removing {ip} from /etc/hosts (domain {domain} no longer in domain_list or IP changed)..."
                 )
-                self.tn.write(
-                    f"sed -i '/{ip} {domain} # opkg/d' /etc/hosts\r\n".encode("utf-8")
-                )
-                time.sleep(0.5)
+                commands.append(f"sed -i '/{ip} {domain} # opkg/d' /etc/hosts")
                 changes_hosts = 1
 
         # Remove outdated routes
         self.logger.info("\n🔍 Checking for outdated routes...")
 
         # Get all configured routes (ensuring comments and targets are captured correctly)
-        self.tn.write(b"uci show network | grep route\r\n")
-        time.sleep(1)
-        network_routes = self.tn.read_very_eager().decode("utf-8").strip().split("\n")
+        network_routes = self.run_commands("uci show network | grep route").split("\n")
 
         # Dictionary to store existing routes
         existing_routes = {}
@@ -777,14 +1112,9 @@ class OpenWRT_vm(vrnetlab.VM):
                         f"🔄 Updating gateway for route {route_ip} (index {route_index}, comment: {route_comment}) "
                         f"from {route_gateway} to {expected_gateway}..."
                     )
-                    self.tn.write(
-                        f"uci set network.@route[{route_index}].gateway='{expected_gateway}'\r\n".encode(
-                            "utf-8"
-                        )
+                    commands.append(
+                        f"uci set network.@route[{route_index}].gateway='{expected_gateway}'"
                     )
-                    time.sleep(0.5)
-                    self.tn.write(b"uci commit network\r\n")
-                    time.sleep(0.5)
                     changes_routes = 1
 
         # Sort routes in descending order and delete them
@@ -793,12 +1123,7 @@ class OpenWRT_vm(vrnetlab.VM):
         )  # unique + descending
         for route_index in routes_to_delete:
             self.logger.info(f"❌ Removing outdated route at index {route_index}...")
-            self.tn.write(
-                f"uci delete network.@route[{route_index}]\r\n".encode("utf-8")
-            )
-            time.sleep(0.5)
-            self.tn.write(b"uci commit network\r\n")
-            time.sleep(0.5)
+            commands.append(f"uci delete network.@route[{route_index}]")
             changes_routes = 1
 
         # Update `/etc/hosts` with missing entries
@@ -806,10 +1131,7 @@ class OpenWRT_vm(vrnetlab.VM):
             for ip in ips:
                 if f"{ip} {domain} # opkg" not in hosts_output:
                     self.logger.info(f"➕ Adding {ip} to /etc/hosts for {domain}...")
-                    self.tn.write(
-                        f"echo '{ip} {domain} # opkg' >> /etc/hosts\r\n".encode("utf-8")
-                    )
-                    time.sleep(0.5)
+                    commands.append(f"echo '{ip} {domain} # opkg' >> /etc/hosts")
                     changes_hosts = 1
 
         # Add missing routes
@@ -823,53 +1145,21 @@ class OpenWRT_vm(vrnetlab.VM):
 
                 if not route_exists:
                     self.logger.info(f"➕ Adding route {ip}/32 for {domain}...")
-                    self.tn.write(b"uci add network route\r\n")
-                    time.sleep(0.5)
-                    self.tn.write(
-                        f"uci set network.@route[-1].interface='{self.mgmt_interface_interface}'\r\n".encode(
-                            "utf-8"
-                        )
-                    )
-                    time.sleep(0.5)
-                    self.tn.write(
-                        f"uci set network.@route[-1].target='{ip}/32'\r\n".encode(
-                            "utf-8"
-                        )
-                    )
-                    time.sleep(0.5)
-                    if self.mgmt_passthrough_ipv4_address == self.mgmt_address_ipv4:
-                        self.tn.write(
-                            f"uci set network.@route[-1].gateway='{self.mgmt_passthrough_ipv4_gateway}'\r\n".encode(
-                                "utf-8"
-                            )
-                        )
-                        time.sleep(0.5)
-                    else:
-                        self.tn.write(
-                            f"uci set network.@route[-1].gateway='{self.mgmt_gw_ipv4}'\r\n".encode(
-                                "utf-8"
-                            )
-                        )
-                        time.sleep(0.5)
-                    self.tn.write(
-                        f"uci set network.@route[-1].comment='{domain}-opkg'\n".encode(
-                            "utf-8"
-                        )
-                    )
-                    time.sleep(0.5)
-                    self.tn.write(b"uci commit network\r\n")
-                    time.sleep(0.5)
+                    commands += self.uci_add_route(f"{ip}/32", f"{domain}-opkg")
                     changes_routes = 1
 
+        if changes_routes:
+            commands.append("uci commit network")
+        if commands:
+            self.run_commands(commands)
+
         # Remove temporary DNS server route
         self.logger.info(
             f"❌ Searching for the temporary DNS route to {self.packet_repository_dns_server}..."
         )
 
         # Retrieve the DNS route index using `uci show network`
-        self.tn.write(b"uci show network | grep route | grep dns\r\n")
-        time.sleep(1)
-        route_output = self.tn.read_very_eager().decode("utf-8").strip()
+        route_output = self.run_commands("uci show network | grep route | grep dns")
 
         # Extract the route index using regex
         match = re.search(r"network.@route\[(\d+)\].comment='dns'", route_output)
@@ -881,12 +1171,9 @@ class OpenWRT_vm(vrnetlab.VM):
             )
 
             # Delete the specific route by index
-            self.tn.write(
-                f"uci delete network.@route[{route_index}]\r\n".encode("utf-8")
+            self.run_commands(
+                [f"uci delete network.@route[{route_index}]", "uci commit network"]
             )
-            time.sleep(0.5)
-            self.tn.write(b"uci commit network\r\n")
-            time.sleep(1)
             changes_routes = 1
             self.logger.info("✅ Temporary DNS route removed!")
         else:
@@ -895,59 +1182,46 @@ class OpenWRT_vm(vrnetlab.VM):
         # Commit & restart if necessary
         if changes_routes:
             self.logger.info("\n[🔄] Reloading network configuration...")
-            self.tn.write(b"/etc/init.d/network restart\r\n")
-            time.sleep(3)
+            self.restart_network()
             self.logger.info("✅ Network restarted!")
 
         if changes_hosts:
             self.logger.info("\n[🔄] Restarting dnsmasq to apply /etc/hosts changes...")
-            self.tn.write(b"/etc/init.d/dnsmasq restart\r\n")
-            time.sleep(3)
+            self.run_commands("/etc/init.d/dnsmasq restart")
             self.logger.info("✅ dnsmasq restarted")
 
         self.logger.info("\n✅ All routes_and_dns tasks completed!")
 
-    def packet_update(self):
-        # 1. Detect OpenWrt prompt dynamically
-        self.tn.write(b"echo PROMPT_DETECT\r\n")
-        time.sleep(1)
-        prompt_output = self.tn.read_very_eager().decode("utf-8").strip()
-        prompt_lines = [
-            line.strip()
-            for line in prompt_output.split("\n")
-            if "PROMPT_DETECT" not in line and line.strip()
-        ]
+    def online_opkg_update(self):
+        """Refresh the online package lists, return whether that worked"""
+        self.logger.info("\n[🔄] Running `opkg update` against the online repository...")
+        output = self.run_commands(
+            'opkg update >/dev/null 2>&1 && echo "OPKG_""UPDATED"', timeout=OPKG_TIMEOUT
+        )
+        return "OPKG_UPDATED" in output
 
-        # Extract the actual OpenWrt prompt (last non-empty line)
-        prompt = prompt_lines[-1] if prompt_lines else "#"
-        # self.logger.info(f"[🔍] Detected prompt: `{prompt}`")
-        # 2. Run `opkg update`
-        self.logger.info("\n[🔄] Running `opkg update`...")
-        self.tn.write(b"opkg update\r\n")
-        time.sleep(5)  # Wait for package lists to update
-        self.tn.read_very_eager()  # Clear the buffer
+    def packet_update(self):
+        # 1. Run `opkg update`. The package cache only holds PACKAGES and
+        # their dependencies, so everything else is upgraded from the online
+        # repository when it is reachable
+        opkg = self.opkg
+        if self.opkg != "opkg" and self.online_opkg_update():
+            opkg = "opkg"
+        else:
+            if self.opkg != "opkg":
+                self.logger.warning(
+                    "⚠ Online repository unreachable, only packages in the package cache are upgraded"
+                )
+            self.opkg_update()
 
-        # 3. Retrieve list of upgradable packages
+        # 2. Retrieve list of upgradable packages
         self.logger.info("\n[🔍] Checking for upgradable packages...")
-        self.tn.write(b"opkg list-upgradable\r\n")
-        time.sleep(2)
-        opkg_output = self.tn.read_very_eager().decode("utf-8").strip()
-
-        # Extract package names for upgrading
-        lines = [line.strip() for line in opkg_output.split("\n")]
-
-        # 4. Remove unwanted lines
-        filtered_packages = []
-        for line in lines:
-            if not line or line.startswith("opkg"):  # Ignore `opkg` itself
-                continue
-            if line.startswith(prompt):  # Ignore prompt lines
-                continue
-            package_name = line.split()[0]  # Extract first word (package name)
-            filtered_packages.append(package_name)
+        opkg_output = self.run_commands(f"{opkg} list-upgradable")
 
-        # 6. Remove duplicates & prepare package list
-        upgradable_packages = list(set(filtered_packages))
+        # Lines look like `<package> - <installed version> - <new version>`
+        upgradable_packages = sorted(
+            {line.split()[0] for line in opkg_output.split("\n") if " - " in line}
+        )
 
         if not upgradable_packages:
             self.logger.info("✅ No packages need an upgrade.")
@@ -956,11 +1230,10 @@ class OpenWRT_vm(vrnetlab.VM):
                 f"🔄 Upgrading {len(upgradable_packages)} packages: {', '.join(upgradable_packages)}"
             )
 
-            # 6. Upgrade packages
-            for package in upgradable_packages:
-                self.logger.info(f"➕ Upgrading {package}...")
-                self.tn.write(f"opkg upgrade {package}\r\n".encode("utf-8"))
-                time.sleep(2)  # Wait briefly after each upgrade
+            # 3. Upgrade all packages in one transaction
+            self.run_commands(
+                f"{opkg} upgrade {' '.join(upgradable_packages)}", timeout=OPKG_TIMEOUT
+            )
 
             self.logger.info("\n✅ All packages updated successfully!")
 
@@ -969,29 +1242,21 @@ class OpenWRT_vm(vrnetlab.VM):
         # 1. Read package list from ENV variable
         if not self.packages:
             self.logger.info("❌ No packages specified in ENV variable `PACKAGES`.")
-        # Split the package list (supports both spaces and commas)
-        packages = [
-            pkg.strip()
-            for pkg in self.packages.replace(",", " ").split()
-            if pkg.strip()
-        ]
+            return changes_network
+        packages = self.requested_packages()
         if not packages:
             self.logger.info("❌ No valid packages found after parsing `PACKAGES`.")
+            return changes_network
 
         # 2. Run `opkg update` before installing packages
-        self.logger.info("\n[🔄] Running `opkg update`...")
-        self.tn.write(b"opkg update\r\n")
-        time.sleep(5)  # Wait for package lists to update
-        self.tn.read_very_eager()  # Clear the buffer
+        self.opkg_update()
 
         # 3. Get list of installed packages
         self.logger.info("\n[🔍] Checking for already installed packages...")
-        self.tn.write(b"opkg list-installed\r\n")
-        time.sleep(2)
-        installed_output = self.tn.read_very_eager().decode("utf-8").strip()
+        installed_output = self.run_commands(f"{self.opkg} list-installed")
         # Extract installed package names
         installed_packages = {
-            line.split()[0] for line in installed_output.split("\n") if line
+            line.split()[0] for line in installed_output.split("\n") if " - " in line
         }
 
         # 4. Filter out already installed packages
@@ -1003,22 +1268,21 @@ class OpenWRT_vm(vrnetlab.VM):
             self.logger.info(
                 "\n✅ All packages are already installed. No installation needed."
             )
+            return changes_network
 
-        # 5. Check if remaining packages exist in the repository using `opkg find`
+        # 5. Check if remaining packages exist in the repository, one `opkg find`
+        # pass for all of them
+        self.logger.info(
+            f"[🔎] Checking if {', '.join(not_installed_packages)} are available in the repository..."
+        )
+        find_output = self.run_commands(
+            f"for p in {' '.join(not_installed_packages)}; do {self.opkg} find $p; done"
+        ).split("\n")
         valid_packages = []
         not_found_packages = []
         for package in not_installed_packages:
-            self.logger.info(
-                f"[🔎] Checking if `{package}` is available in the repository..."
-            )
-            self.tn.write(f"opkg find {package}\r\n".encode("utf-8"))
-            time.sleep(1)
-            package_found = self.tn.read_very_eager().decode("utf-8").strip()
-
             # Ensure that the package name appears at the beginning of a line
-            if any(
-                line.startswith(package + " - ") for line in package_found.split("\n")
-            ):
+            if any(line.startswith(package + " - ") for line in find_output):
                 valid_packages.append(package)
             else:
                 not_found_packages.append(package)
@@ -1031,17 +1295,17 @@ class OpenWRT_vm(vrnetlab.VM):
 
         if not valid_packages:
             self.logger.info("\n✅ No valid packages to install.")
+            return changes_network
 
         self.logger.info(
             f"\n🔄 Installing {len(valid_packages)} packages: {', '.join(valid_packages)}"
         )
 
-        # 7. Install only valid and missing packages
-        for package in valid_packages:
-            self.logger.info(f"➕ Installing {package}...")
-            self.tn.write(f"opkg install {package}\r\n".encode("utf-8"))
-            time.sleep(2)  # Wait briefly after each installation
-            changes_network = 1
+        # 7. Install only valid and missing packages, in one transaction
+        self.run_commands(
+            f"{self.opkg} install {' '.join(valid_packages)}", timeout=OPKG_TIMEOUT
+        )
+        changes_network = 1
 
         self.logger.info("\n✅ All required packages installed successfully!")
         return changes_network
@@ -1087,6 +1351,7 @@ class OpenWRT_vm(vrnetlab.VM):
 
         # Track changes
         changes_network = 0
+        self.opkg_updated = False
         changes_firewall = 0
 
         # Get current network config
@@ -1109,6 +1374,8 @@ class OpenWRT_vm(vrnetlab.VM):
 
         self.routes_and_dns()
 
+        self.setup_opkg_cache()
+
         self.packet_update()
 
         changes_network += self.packages_install()
@@ -1135,6 +1402,8 @@ class OpenWRT(vrnetlab.VR):
         packages,
         lan_ip,
         lan_netmask,
+        opkg_cache_dir,
+        opkg_mirror_url,
     ):
         super(OpenWRT, self).__init__(username, password)
         self.vms = [
@@ -1149,6 +1418,8 @@ class OpenWRT(vrnetlab.VR):
                 packages,
                 lan_ip,
                 lan_netmask,
+                opkg_cache_dir,
+                opkg_mirror_url,
             )
         ]
 
@@ -1226,6 +1497,19 @@ import click
     required=True,
     help="Lan netmask",
 )
+@click.option(
+    "--opkg-cache-dir",
+    envvar="OPKG_CACHE_DIR",
+    required=False,
+    help="host directory (bind-mounted) holding a package cache per release",
+)
+@click.option(
+    "--opkg-mirror-url",
+    default="https://downloads.openwrt.org/releases",
+    envvar="OPKG_MIRROR_URL",
+    required=True,
+    help="where the package cache is populated from",
+)
 def args(
     tracing,
     username,
@@ -1238,6 +1522,8 @@ def args(
     packages,
     lan_ip,
     lan_netmask,
+    opkg_cache_dir,
+    opkg_mirror_url,
 ):
     LOG_FORMAT = "%(asctime)s: %(module)-10s %(levelname)-8s %(message)s"
     logging.basicConfig(format=LOG_FORMAT)
@@ -1258,6 +1544,8 @@ def args(
         packages,
         lan_ip,
         lan_netmask,
+        opkg_cache_dir,
+        opkg_mirror_url,
     )
     vr.start()
 
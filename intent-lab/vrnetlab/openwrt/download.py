@@ -1,82 +1,225 @@
 #!/usr/bin/env python3
 
+import argparse
+import hashlib
+import os
 import re
-import shutil
 import sys
-import os
-import gzip
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
-from bs4 import BeautifulSoup, Tag
+from bs4 import BeautifulSoup
 
 base_url = "https://downloads.openwrt.org/"
 
-def get_rel(url, version):
-    res = requests.get(url)
-    if not res.status_code == 200:
-        return
-    c = res.content
-    soup = BeautifulSoup(c, "lxml")
-    links = soup.find_all("a")
-    for l in links:
-        #print(l)
-        
-        #filename = l.string.strip()
-        filename = l['href']
-        if not (re.search('combined-ext4.img.gz', filename) or re.search('generic-ext4-combined.img.gz', filename)):
-            #print("ignoring {}".format(filename))
+# number of releases fetched in parallel
+DOWNLOAD_WORKERS = 4
+# times a broken download is resumed before giving up
+DOWNLOAD_RETRIES = 5
+CHUNK_SIZE = 1024 * 1024
+
+IMAGE_RE = re.compile(r"(combined-ext4|generic-ext4-combined)\.img\.gz$")
+VERSION_RE = re.compile(
+    r"[^0-9]([0-9]{2}\.[0-9]{2}[^0-9](?:[0-9]{1,2}))|[^0-9]([0-9]{2}\.[0-9]{2})"
+)
+
+
+class HTTPSource:
+    """Release directories on downloads.openwrt.org"""
+
+    def __init__(self):
+        self.session = requests.Session()
+
+    def releases(self):
+        """Yield (version, release directory url)"""
+        res = self.session.get(base_url)
+        if not res.status_code == 200:
+            return
+        soup = BeautifulSoup(res.content, "lxml")
+        for l in soup.find_all("a"):
+            href = l.attrs.get("href", "")
+            if not re.search(r"//", href):
+                rel_url = "{}{}x86/64/".format(base_url, href)
+            else:
+                rel_url = "https:{}x86/64/".format(href)
+            m = VERSION_RE.search(href)
+            if not m:
+                continue
+            yield m.group(1) or m.group(2), rel_url
+
+    def listing(self, location):
+        res = self.session.get(location)
+        if not res.status_code == 200:
+            return []
+        soup = BeautifulSoup(res.content, "lxml")
+        return [l["href"] for l in soup.find_all("a") if l.get("href")]
+
+    def read(self, location, filename):
+        res = self.session.get(location + filename)
+        if not res.status_code == 200:
+            return None
+        return res.text
+
+    def stream(self, location, filename, offset=0):
+        """Yield the file contents from offset on, using a Range request"""
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        with self.session.get(
+            location + filename, headers=headers, stream=True, timeout=60
+        ) as r:
+            r.raise_for_status()
+            # the server ignored the range, skip what we already have
+            skip = offset if r.status_code != 206 else 0
+            for chunk in r.iter_content(CHUNK_SIZE):
+                if skip:
+                    dropped = min(skip, len(chunk))
+                    chunk, skip = chunk[dropped:], skip - dropped
+                if chunk:
+                    yield chunk
+
+
+class MirrorSource:
+    """Release directories in a local copy of downloads.openwrt.org"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def releases(self):
+        for root, _, _ in os.walk(self.directory):
+            if not root.endswith(os.path.join("x86", "64")):
+                continue
+            m = VERSION_RE.search(root)
+            if m:
+                yield m.group(1) or m.group(2), root + os.sep
+
+    def listing(self, location):
+        return sorted(os.listdir(location))
+
+    def read(self, location, filename):
+        try:
+            with open(location + filename) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def stream(self, location, filename, offset=0):
+        with open(location + filename, "rb") as f:
+            f.seek(offset)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                yield chunk
+
+
+def parse_sha256sums(text):
+    """Map file names to their sha256 from a release's sha256sums file"""
+    sums = {}
+    for line in (text or "").splitlines():
+        parts = line.split()
+        if len(parts) == 2:
+            sums[parts[1].lstrip("*")] = parts[0].lower()
+    return sums
+
+
+def resumable_stream(source, location, filename):
+    """Yield a file's contents, resuming a broken transfer where it stopped.
+
+    Only errors reading the source are retried, an error raised by the
+    consumer of a chunk is not seen here.
+    """
+    offset = 0
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        try:
+            for chunk in source.stream(location, filename, offset):
+                offset += len(chunk)
+                yield chunk
+            return
+        except (requests.RequestException, OSError) as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise
+            print(f"{filename}: {e}, resuming at byte {offset}")
+
+
+def fetch_image(source, location, filename, output_file, expected_sha256):
+    """Download and gunzip an image in one pass.
+
+    The compressed stream is hashed and decompressed as it arrives, so no
+    .gz is written to disk. A broken transfer is resumed with a Range
+    request at the byte it stopped at, feeding the same decompressor.
+    OpenWrt images carry trailing data after the gzip stream, which is
+    ignored like gzip does.
+    """
+    sha256 = hashlib.sha256()
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    part_file = output_file + ".part"
+    try:
+        with open(part_file, "wb") as f:
+            for chunk in resumable_stream(source, location, filename):
+                sha256.update(chunk)
+                if not decompressor.eof:
+                    f.write(decompressor.decompress(chunk))
+            f.write(decompressor.flush())
+        if not decompressor.eof:
+            raise ValueError(f"{filename} is not a complete GZIP file")
+        if expected_sha256 is None:
+            print(f"Warning: no checksum for {filename}, not verified")
+        elif sha256.hexdigest() != expected_sha256:
+            raise ValueError(
+                f"{filename}: sha256 {sha256.hexdigest()} does not match {expected_sha256}"
+            )
+        os.replace(part_file, output_file)
+    except BaseException:
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        raise
+
+
+def get_rel(source, url, version):
+    sums = None
+    for filename in source.listing(url):
+        if not IMAGE_RE.search(filename):
             continue
-        if re.search('^openwrt-x86-', filename):
-            local_filename = re.sub('^openwrt-x86-', 'openwrt-{}-x86-'.format(version), filename)
-        file_url = "{}{}".format(url, filename)
-        if not os.path.exists(filename):
-            print("Downloading {} -> {}".format(file_url, filename))
-            r = requests.get(file_url, stream=True)
-            print(filename)
-            base_name, file_extension = os.path.splitext(filename)
-            if file_extension == ".gz":
-                output_file = base_name
-            print(output_file)
-            with open(filename, 'wb') as f:
-                shutil.copyfileobj(r.raw, f)
-            try:
-                with gzip.open(filename, 'rb') as f_in:
-                    with open(output_file, 'wb') as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                print(f"The file was successfully unpacked: {output_file}")
-            except gzip.BadGzipFile:
-                if not os.path.exists(output_file):
-                    print(f"Warning: The file '{filename}' is not a valid GZIP file and could not be unpacked.")
-                else:
-                    print(f"gzip: {filename}: decompression OK, trailing garbage ignored. ")
-            except Exception as e:
-                print(f"Error unpacking the file '{filename}': {e}")
-        else:
-            print("File '{}' already exists. Skipping download.".format(filename))
+        local_filename = re.sub(
+            "^openwrt-x86-", "openwrt-{}-x86-".format(version), filename
+        )
+        output_file = local_filename[: -len(".gz")]
+        if os.path.exists(output_file):
+            print("File '{}' already exists. Skipping download.".format(output_file))
+            continue
+        if sums is None:
+            sums = parse_sha256sums(source.read(url, "sha256sums"))
+        print("Downloading {}{} -> {}".format(url, filename, output_file))
+        try:
+            fetch_image(source, url, filename, output_file, sums.get(filename))
+            print(f"The file was successfully unpacked: {output_file}")
+        except Exception as e:
+            print(f"Error downloading '{filename}': {e}")
 
 
 def main():
-    res = requests.get("https://downloads.openwrt.org/")
-    if not res.status_code == 200:
-        return
-    c = res.content
-    soup = BeautifulSoup(c, "lxml")
-    links = soup.find_all("a")
-    for l in links:
-        m = re.search('\/\/', l.attrs['href'])
-        if not m:
-            rel_url = "{}{}x86/64/".format(base_url, l.attrs['href'])
-        else:
-            current_href = l['href']
-            new_href = 'https:' + current_href
-            l['href'] = new_href
-            rel_url = "{}x86/64/".format(l.attrs['href'])
-        m = re.search('[^0-9]([0-9]{2}\.[0-9]{2}[^0-9](?:[0-9]{1,2}))|[^0-9]([0-9]{2}\.[0-9]{2})', l.attrs['href'])
-        if not m:
-            continue
-        #print(l.string.strip(), l.attrs['href'], rel_url)
-        get_rel(rel_url, m.group(1))
+    parser = argparse.ArgumentParser(description="Download OpenWrt x86/64 images")
+    parser.add_argument(
+        "--mirror",
+        help="read releases from a local copy of downloads.openwrt.org instead",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("DOWNLOAD_WORKERS", DOWNLOAD_WORKERS)),
+        help="number of releases downloaded in parallel",
+    )
+    args = parser.parse_args()
 
+    source = MirrorSource(args.mirror) if args.mirror else HTTPSource()
+    releases = dict((url, version) for version, url in source.releases())
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {
+            executor.submit(get_rel, source, url, version): url
+            for url, version in releases.items()
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error reading {futures[future]}: {e}", file=sys.stderr)
 
 
 main()
@@ -1,16 +1,47 @@
 """
 title: NetBox Network Query Tool
 author: ChatOps
-version: 1.0.0
+version: 1.2.0
 description: Query and interact with NetBox network inventory API
 requirements: requests
 """
 
 import os
+import threading
+import time
 import requests
-from typing import Optional, Dict, Any, List
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Iterator, Tuple
 from pydantic import BaseModel, Field
 
+# Results fetched per request when paginating
+NETBOX_PAGE_SIZE = int(os.getenv("NETBOX_PAGE_SIZE", "250"))
+# Pages fetched in parallel, also the size of the connection pool
+NETBOX_MAX_WORKERS = int(os.getenv("NETBOX_MAX_WORKERS", "4"))
+
+# Number of query results kept, least recently used ones are dropped first
+NETBOX_CACHE_SIZE = int(os.getenv("NETBOX_CACHE_SIZE", "128"))
+# Seconds a cached result is served without asking NetBox, per endpoint
+NETBOX_CACHE_TTLS = {
+    "dcim/devices/": 300,
+    "dcim/interfaces/": 120,
+    "ipam/vlans/": 600,
+    "ipam/ip-addresses/": 120,
+    "ipam/prefixes/": 600,
+}
+NETBOX_CACHE_TTL = int(os.getenv("NETBOX_CACHE_TTL", "60"))
+# Allowed clock difference to NetBox when asking for changed objects
+NETBOX_CLOCK_SKEW = 60
+
+# Only the fields the query functions format are requested
+DEVICE_FIELDS = "id,name,device_type,role,device_role,site,status,primary_ip"
+INTERFACE_FIELDS = "id,name,device,type,enabled,mtu,description"
+VLAN_FIELDS = "id,vid,name,site,status,description"
+IP_ADDRESS_FIELDS = "id,address,status,dns_name,assigned_object,description"
+PREFIX_FIELDS = "id,prefix,site,status,vlan,description"
+
 
 class Tools:
     def __init__(self):
@@ -21,19 +52,31 @@ class Tools:
             "Content-Type": "application/json",
             "Accept": "application/json"
         }
+        # One keep-alive session for all requests, sized for parallel pages
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=NETBOX_MAX_WORKERS
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Query results by (endpoint, normalised params, limit), in LRU order
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.cache_stats = {"hits": 0, "misses": 0, "revalidated": 0, "evictions": 0}
     
     def _make_request(self, endpoint: str, method: str = "GET", data: Optional[Dict] = None) -> Dict[str, Any]:
         """Make API request to NetBox"""
         url = f"{self.netbox_url}/api/{endpoint}"
         try:
             if method == "GET":
-                response = requests.get(url, headers=self.headers, params=data, timeout=10)
+                response = self.session.get(url, params=data, timeout=10)
             elif method == "POST":
-                response = requests.post(url, headers=self.headers, json=data, timeout=10)
+                response = self.session.post(url, json=data, timeout=10)
             elif method == "PATCH":
-                response = requests.patch(url, headers=self.headers, json=data, timeout=10)
+                response = self.session.patch(url, json=data, timeout=10)
             elif method == "DELETE":
-                response = requests.delete(url, headers=self.headers, timeout=10)
+                response = self.session.delete(url, timeout=10)
             else:
                 return {"error": f"Unsupported method: {method}"}
             
@@ -41,6 +84,137 @@ class Tools:
             return response.json() if response.content else {"success": True}
         except requests.exceptions.RequestException as e:
             return {"error": str(e)}
+
+    def _paginate(self, endpoint: str, params: Dict, limit: int = 0) -> Tuple[int, Iterator[Dict]]:
+        """
+        Query a list endpoint across all of its pages.
+
+        The first page is fetched right away for the total count. The
+        remaining pages are fetched in parallel by offset, at most
+        NETBOX_MAX_WORKERS ahead of the consumer, and their results are
+        yielded in order, so memory use does not grow with the result size.
+
+        :param limit: Maximum number of results, 0 for all
+        :return: Total number of matching objects and an iterator over the results
+        :raises requests.exceptions.RequestException: When a page cannot be fetched
+        """
+        page_size = min(limit, NETBOX_PAGE_SIZE) if limit else NETBOX_PAGE_SIZE
+        params = dict(params, limit=page_size)
+
+        first = self._make_request(endpoint, data=params)
+        if "error" in first:
+            raise requests.exceptions.RequestException(first["error"])
+        count = first.get("count", 0)
+        wanted = min(count, limit) if limit else count
+
+        def results():
+            yield from first.get("results", [])[:wanted]
+            offsets = range(page_size, wanted, page_size)
+            if not offsets:
+                return
+            with ThreadPoolExecutor(max_workers=NETBOX_MAX_WORKERS) as executor:
+                pending = deque()
+                for offset in offsets:
+                    pending.append(
+                        (offset, executor.submit(self._make_request, endpoint, data=dict(params, offset=offset)))
+                    )
+                    if len(pending) < NETBOX_MAX_WORKERS:
+                        continue
+                    yield from self._page_results(*pending.popleft(), wanted)
+                while pending:
+                    yield from self._page_results(*pending.popleft(), wanted)
+
+        return count, results()
+
+    def _query(self, endpoint: str, params: Dict, limit: int = 0) -> Tuple[int, Iterator[Dict]]:
+        """
+        _paginate with a cache in front.
+
+        Results younger than the endpoint's TTL are served from memory.
+        Older ones are revalidated with two one-object requests: the total
+        count catches deletions, a last_updated__gte filter catches new and
+        changed objects. Only when either differs are the results fetched
+        again, and stored once they have been read completely.
+        """
+        # partial matches (__ic) are case-insensitive, so is their key
+        normalised = sorted(
+            (k, str(v).lower() if k.endswith("__ic") else str(v))
+            for k, v in params.items()
+            if v is not None
+        )
+        key = (endpoint, tuple(normalised), limit)
+        ttl = NETBOX_CACHE_TTLS.get(endpoint, NETBOX_CACHE_TTL)
+
+        with self.cache_lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.cache.move_to_end(key)
+        if entry is not None:
+            if time.monotonic() - entry["checked"] < ttl:
+                with self.cache_lock:
+                    self.cache_stats["hits"] += 1
+                return entry["count"], iter(entry["results"])
+            checked, fetched = time.monotonic(), time.time()
+            if self._unchanged(endpoint, params, entry):
+                with self.cache_lock:
+                    entry["checked"], entry["fetched"] = checked, fetched
+                    self.cache_stats["hits"] += 1
+                    self.cache_stats["revalidated"] += 1
+                return entry["count"], iter(entry["results"])
+
+        with self.cache_lock:
+            self.cache_stats["misses"] += 1
+        checked, fetched = time.monotonic(), time.time()
+        count, results = self._paginate(endpoint, params, limit)
+
+        def cached_results():
+            collected = []
+            for result in results:
+                collected.append(result)
+                yield result
+            with self.cache_lock:
+                self.cache[key] = {
+                    "count": count,
+                    "results": collected,
+                    "checked": checked,
+                    "fetched": fetched,
+                }
+                self.cache.move_to_end(key)
+                while len(self.cache) > NETBOX_CACHE_SIZE:
+                    self.cache.popitem(last=False)
+                    self.cache_stats["evictions"] += 1
+
+        return count, cached_results()
+
+    def _unchanged(self, endpoint: str, params: Dict, entry: Dict) -> bool:
+        """Whether the objects matching params are the same as in a cache entry"""
+        since = datetime.fromtimestamp(entry["fetched"] - NETBOX_CLOCK_SKEW, timezone.utc)
+        probe = dict(params, limit=1, fields="id")
+        # both probes go out at once, each on its own pooled connection
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            total = executor.submit(self._make_request, endpoint, data=probe)
+            changed = executor.submit(
+                self._make_request, endpoint, data=dict(probe, last_updated__gte=since.isoformat())
+            )
+            total, changed = total.result(), changed.result()
+        if "error" in total or "error" in changed:
+            return False
+        return total.get("count") == entry["count"] and changed.get("count") == 0
+
+    @staticmethod
+    def _page_results(offset: int, future, wanted: int) -> List[Dict]:
+        """Results of a page fetched by _paginate, cut off at wanted"""
+        page = future.result()
+        if "error" in page:
+            raise requests.exceptions.RequestException(page["error"])
+        return page.get("results", [])[:max(0, wanted - offset)]
+
+    @staticmethod
+    def _found(count: int, shown: int, noun: str) -> str:
+        """Header line of a query result, saying when results were cut off"""
+        if shown < count:
+            return f"Found {count} {noun}, showing the first {shown}:\n\n"
+        return f"Found {count} {noun}:\n\n"
     
     def query_devices(
         self,
@@ -57,10 +231,10 @@ class Tools:
         :param site: Filter by site name
         :param device_type: Filter by device type
         :param role: Filter by device role
-        :param limit: Maximum number of results to return (default 50)
+        :param limit: Maximum number of results to return (default 50, 0 for all)
         :return: JSON string with device information
         """
-        params = {"limit": limit}
+        params = {"fields": DEVICE_FIELDS}
         if name:
             params["name__ic"] = name
         if site:
@@ -70,24 +244,22 @@ class Tools:
         if role:
             params["role"] = role
         
-        result = self._make_request("dcim/devices/", data=params)
-        
-        if "error" in result:
-            return f"Error querying devices: {result['error']}"
-        
-        devices = result.get("results", [])
-        if not devices:
-            return "No devices found matching the criteria."
-        
-        # Format output
-        output = f"Found {len(devices)} device(s):\n\n"
-        for device in devices:
-            output += f"- **{device.get('name')}**\n"
-            output += f"  - Type: {device.get('device_type', {}).get('display', 'N/A')}\n"
-            output += f"  - Role: {device.get('device_role', {}).get('display', 'N/A')}\n"
-            output += f"  - Site: {device.get('site', {}).get('name', 'N/A')}\n"
-            output += f"  - Status: {device.get('status', {}).get('label', 'N/A')}\n"
-            output += f"  - Primary IP: {device.get('primary_ip', {}).get('address', 'N/A') if device.get('primary_ip') else 'N/A'}\n\n"
+        try:
+            count, devices = self._query("dcim/devices/", params, limit)
+            if not count:
+                return "No devices found matching the criteria."
+
+            # Format output, page by page as results arrive
+            output = self._found(count, min(count, limit) if limit else count, "device(s)")
+            for device in devices:
+                output += f"- **{device.get('name')}**\n"
+                output += f"  - Type: {device.get('device_type', {}).get('display', 'N/A')}\n"
+                output += f"  - Role: {(device.get('role') or device.get('device_role') or {}).get('display', 'N/A')}\n"
+                output += f"  - Site: {device.get('site', {}).get('name', 'N/A')}\n"
+                output += f"  - Status: {device.get('status', {}).get('label', 'N/A')}\n"
+                output += f"  - Primary IP: {device.get('primary_ip', {}).get('address', 'N/A') if device.get('primary_ip') else 'N/A'}\n\n"
+        except requests.exceptions.RequestException as e:
+            return f"Error querying devices: {e}"
         
         return output
     
@@ -102,32 +274,30 @@ class Tools:
         
         :param device: Filter by device name
         :param name: Filter by interface name
-        :param limit: Maximum number of results to return (default 50)
+        :param limit: Maximum number of results to return (default 50, 0 for all)
         :return: JSON string with interface information
         """
-        params = {"limit": limit}
+        params = {"fields": INTERFACE_FIELDS}
         if device:
             params["device"] = device
         if name:
             params["name__ic"] = name
         
-        result = self._make_request("dcim/interfaces/", data=params)
-        
-        if "error" in result:
-            return f"Error querying interfaces: {result['error']}"
-        
-        interfaces = result.get("results", [])
-        if not interfaces:
-            return "No interfaces found matching the criteria."
-        
-        # Format output
-        output = f"Found {len(interfaces)} interface(s):\n\n"
-        for iface in interfaces:
-            output += f"- **{iface.get('name')}** on {iface.get('device', {}).get('name', 'N/A')}\n"
-            output += f"  - Type: {iface.get('type', {}).get('label', 'N/A')}\n"
-            output += f"  - Enabled: {iface.get('enabled', False)}\n"
-            output += f"  - MTU: {iface.get('mtu', 'N/A')}\n"
-            output += f"  - Description: {iface.get('description', 'N/A')}\n\n"
+        try:
+            count, interfaces = self._query("dcim/interfaces/", params, limit)
+            if not count:
+                return "No interfaces found matching the criteria."
+
+            # Format output, page by page as results arrive
+            output = self._found(count, min(count, limit) if limit else count, "interface(s)")
+            for iface in interfaces:
+                output += f"- **{iface.get('name')}** on {iface.get('device', {}).get('name', 'N/A')}\n"
+                output += f"  - Type: {iface.get('type', {}).get('label', 'N/A')}\n"
+                output += f"  - Enabled: {iface.get('enabled', False)}\n"
+                output += f"  - MTU: {iface.get('mtu', 'N/A')}\n"
+                output += f"  - Description: {iface.get('description', 'N/A')}\n\n"
+        except requests.exceptions.RequestException as e:
+            return f"Error querying interfaces: {e}"
         
         return output
     
@@ -144,10 +314,10 @@ class Tools:
         :param vid: Filter by VLAN ID
         :param name: Filter by VLAN name
         :param site: Filter by site name
-        :param limit: Maximum number of results to return (default 50)
+        :param limit: Maximum number of results to return (default 50, 0 for all)
         :return: JSON string with VLAN information
         """
-        params = {"limit": limit}
+        params = {"fields": VLAN_FIELDS}
         if vid:
             params["vid"] = vid
         if name:
@@ -155,22 +325,20 @@ class Tools:
         if site:
             params["site"] = site
         
-        result = self._make_request("ipam/vlans/", data=params)
-        
-        if "error" in result:
-            return f"Error querying VLANs: {result['error']}"
-        
-        vlans = result.get("results", [])
-        if not vlans:
-            return "No VLANs found matching the criteria."
-        
-        # Format output
-        output = f"Found {len(vlans)} VLAN(s):\n\n"
-        for vlan in vlans:
-            output += f"- **VLAN {vlan.get('vid')}** - {vlan.get('name')}\n"
-            output += f"  - Site: {vlan.get('site', {}).get('name', 'N/A') if vlan.get('site') else 'Global'}\n"
-            output += f"  - Status: {vlan.get('status', {}).get('label', 'N/A')}\n"
-            output += f"  - Description: {vlan.get('description', 'N/A')}\n\n"
+        try:
+            count, vlans = self._query("ipam/vlans/", params, limit)
+            if not count:
+                return "No VLANs found matching the criteria."
+
+            # Format output, page by page as results arrive
+            output = self._found(count, min(count, limit) if limit else count, "VLAN(s)")
+            for vlan in vlans:
+                output += f"- **VLAN {vlan.get('vid')}** - {vlan.get('name')}\n"
+                output += f"  - Site: {vlan.get('site', {}).get('name', 'N/A') if vlan.get('site') else 'Global'}\n"
+                output += f"  - Status: {vlan.get('status', {}).get('label', 'N/A')}\n"
+                output += f"  - Description: {vlan.get('description', 'N/A')}\n\n"
+        except requests.exceptions.RequestException as e:
+            return f"Error querying VLANs: {e}"
         
         return output
     
@@ -187,10 +355,10 @@ class Tools:
         :param address: Filter by IP address (partial match)
         :param device: Filter by device name
         :param interface: Filter by interface name
-        :param limit: Maximum number of results to return (default 50)
+        :param limit: Maximum number of results to return (default 50, 0 for all)
         :return: JSON string with IP address information
         """
-        params = {"limit": limit}
+        params = {"fields": IP_ADDRESS_FIELDS}
         if address:
             params["address__ic"] = address
         if device:
@@ -198,24 +366,22 @@ class Tools:
         if interface:
             params["interface"] = interface
         
-        result = self._make_request("ipam/ip-addresses/", data=params)
-        
-        if "error" in result:
-            return f"Error querying IP addresses: {result['error']}"
-        
-        ips = result.get("results", [])
-        if not ips:
-            return "No IP addresses found matching the criteria."
-        
-        # Format output
-        output = f"Found {len(ips)} IP address(es):\n\n"
-        for ip in ips:
-            output += f"- **{ip.get('address')}**\n"
-            output += f"  - Status: {ip.get('status', {}).get('label', 'N/A')}\n"
-            output += f"  - DNS Name: {ip.get('dns_name', 'N/A')}\n"
-            if ip.get('assigned_object'):
-                output += f"  - Assigned to: {ip.get('assigned_object', {}).get('display', 'N/A')}\n"
-            output += f"  - Description: {ip.get('description', 'N/A')}\n\n"
+        try:
+            count, ips = self._query("ipam/ip-addresses/", params, limit)
+            if not count:
+                return "No IP addresses found matching the criteria."
+
+            # Format output, page by page as results arrive
+            output = self._found(count, min(count, limit) if limit else count, "IP address(es)")
+            for ip in ips:
+                output += f"- **{ip.get('address')}**\n"
+                output += f"  - Status: {ip.get('status', {}).get('label', 'N/A')}\n"
+                output += f"  - DNS Name: {ip.get('dns_name', 'N/A')}\n"
+                if ip.get('assigned_object'):
+                    output += f"  - Assigned to: {ip.get('assigned_object', {}).get('display', 'N/A')}\n"
+                output += f"  - Description: {ip.get('description', 'N/A')}\n\n"
+        except requests.exceptions.RequestException as e:
+            return f"Error querying IP addresses: {e}"
         
         return output
     
@@ -232,10 +398,10 @@ class Tools:
         :param prefix: Filter by IP prefix (CIDR notation)
         :param site: Filter by site name
         :param vlan: Filter by VLAN ID
-        :param limit: Maximum number of results to return (default 50)
+        :param limit: Maximum number of results to return (default 50, 0 for all)
         :return: JSON string with prefix information
         """
-        params = {"limit": limit}
+        params = {"fields": PREFIX_FIELDS}
         if prefix:
             params["prefix"] = prefix
         if site:
@@ -243,22 +409,20 @@ class Tools:
         if vlan:
             params["vlan_id"] = vlan
         
-        result = self._make_request("ipam/prefixes/", data=params)
-        
-        if "error" in result:
-            return f"Error querying prefixes: {result['error']}"
-        
-        prefixes = result.get("results", [])
-        if not prefixes:
-            return "No prefixes found matching the criteria."
-        
-        # Format output
-        output = f"Found {len(prefixes)} prefix(es):\n\n"
-        for pfx in prefixes:
-            output += f"- **{pfx.get('prefix')}**\n"
-            output += f"  - Site: {pfx.get('site', {}).get('name', 'N/A') if pfx.get('site') else 'Global'}\n"
-            output += f"  - Status: {pfx.get('status', {}).get('label', 'N/A')}\n"
-            output += f"  - VLAN: {pfx.get('vlan', {}).get('display', 'N/A') if pfx.get('vlan') else 'N/A'}\n"
-            output += f"  - Description: {pfx.get('description', 'N/A')}\n\n"
+        try:
+            count, prefixes = self._query("ipam/prefixes/", params, limit)
+            if not count:
+                return "No prefixes found matching the criteria."
+
+            # Format output, page by page as results arrive
+            output = self._found(count, min(count, limit) if limit else count, "prefix(es)")
+            for pfx in prefixes:
+                output += f"- **{pfx.get('prefix')}**\n"
+                output += f"  - Site: {pfx.get('site', {}).get('name', 'N/A') if pfx.get('site') else 'Global'}\n"
+                output += f"  - Status: {pfx.get('status', {}).get('label', 'N/A')}\n"
+                output += f"  - VLAN: {pfx.get('vlan', {}).get('display', 'N/A') if pfx.get('vlan') else 'N/A'}\n"
+                output += f"  - Description: {pfx.get('description', 'N/A')}\n\n"
+        except requests.exceptions.RequestException as e:
+            return f"Error querying prefixes: {e}"
         
         return output
@@ -35,6 +35,16 @@ print("-"*60)
 result = tools.query_vlans()
 print(result)
 
+print("\n4. Testing query_interfaces() across all pages...")
+print("-"*60)
+result = tools.query_interfaces(limit=0)
+print(result.split("\n")[0])
+
+print("\n5. Testing query_vlans() again (served from the cache)...")
+print("-"*60)
+result = tools.query_vlans()
+print(f"Cache stats: {tools.cache_stats}")
+
 print("\n="*60)
 print("Test Complete!")
 print("="*60)